@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+
+"""
+Reports the size/time trade-off of each save_compression level, and of
+fast_save, by compressing a save file's members the way utility.Compression
+does. Sheet chunks are zlib compressed inside; they're unpacked first, so no
+wx is needed. Without a file, uses synthetic handwriting and images.
+
+USAGE: python benchmark-compression.py [FILE]
+"""
+
+import imp
+import os
+import random
+import sys
+import time
+import zipfile
+import zlib
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+strokes = imp.load_source("strokes", os.path.join(root, "whyteboard", "misc", "strokes.py"))
+png = imp.load_source("png", os.path.join(root, "whyteboard", "misc", "png.py"))
+
+MAGIC = "WBR\x01"  # see records.py
+FAST_LEVEL = 1
+
+
+def make_sheet(pens):
+    """Roughly what records.dumps() writes for a sheet of pen strokes"""
+    data = []
+    for x in xrange(pens):
+        x, y = random.randint(0, 800), random.randint(0, 600)
+        points, times, now = [], [], time.time()
+        for i in xrange(random.randint(20, 400)):
+            nx, ny = x + random.randint(-4, 4), y + random.randint(-4, 4)
+            points.append([x, y, nx, ny])
+            now += random.uniform(0.01, 0.02)
+            times.append(now)
+            x, y = nx, ny
+        data.append("Pen\x00\x00\x00\x01" + strokes.encode(points, times))
+    return "".join(data)
+
+
+def make_image(width, height):
+    rows = []
+    for y in xrange(height):
+        if y % 40 == 0:
+            row = chr(random.randint(0, 255)) * 3 * width
+        rows.append(row[:width * 2] + os.urandom(width))  # a photo-like third
+    return png.encode_png(width, height, "".join(rows), None)
+
+
+def read_members(filename):
+    """A save's sheets (unpacked) and its other members"""
+    sheets, others = [], []
+    _zip = zipfile.ZipFile(filename)
+    for name in _zip.namelist():
+        data = _zip.read(name)
+        if name.startswith(u"sheets/"):
+            if data.startswith(MAGIC):
+                data = data[len(MAGIC):]
+            sheets.append(zlib.decompress(data))
+        else:
+            others.append(data)
+    _zip.close()
+    return sheets, others
+
+
+def deflate(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+def measure(sheets, others, level, fast):
+    """(bytes, save seconds, load seconds) for one policy"""
+    size = sum(len(data) for data in others)  # stored as they are
+    start = time.time()
+    packed = []
+    for data in sheets:
+        chunk = zlib.compress(data, FAST_LEVEL if fast else 0)
+        if not fast and level:
+            chunk = deflate(chunk, level)
+        packed.append(chunk)
+    saving = time.time() - start
+
+    start = time.time()
+    for chunk in packed:
+        if not fast and level:
+            chunk = zlib.decompress(chunk, -15)
+        zlib.decompress(chunk)
+    loading = time.time() - start
+    return size + sum(len(chunk) for chunk in packed), saving, loading
+
+
+if len(sys.argv) > 1:
+    sheets, others = read_members(sys.argv[1])
+else:
+    sheets = [make_sheet(300) for x in range(10)]
+    others = [make_image(1280, 800) for x in range(4)]
+
+raw = sum(len(data) for data in sheets)
+print 'Sheets: %i, %.1f MB unpacked; other members: %.2f MB' % (
+    len(sheets), raw / 1048576.0, sum(len(data) for data in others) / 1048576.0)
+
+for level, fast in [(level, False) for level in range(10)] + [(None, True)]:
+    size, saving, loading = measure(sheets, others, level, fast)
+    print '%-10s %8.2f MB  save %6.3fs (%6.1f MB/s)  load %6.3fs' % (
+        'fast_save' if fast else 'level %i' % level, size / 1048576.0,
+        saving, raw / 1048576.0 / max(saving, 0.0001), loading)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+
+
+"""
+Converts a document with each PDF rasterizer backend that's installed (see
+whyteboard/misc/rasterizers.py), reporting pages per second and the size of
+the images. Without a file, writes a sample PDF of text and line drawings.
+
+USAGE: python benchmark-rasterizers.py [FILE] [QUALITY]
+"""
+
+import imp
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+rasterizers = imp.load_source("rasterizers", os.path.join(root, "whyteboard", "misc", "rasterizers.py"))
+
+SAMPLE_PAGES = 20
+
+
+def make_sample(path, pages):
+    """A PDF of text and lines, much like lecture slides"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(pages):
+        stream = ["BT /F1 28 Tf 72 720 Td (Page %i) Tj ET" % (page + 1)]
+        for line in range(30):
+            stream.append("BT /F1 11 Tf 72 %i Td (Line %i of some sample text on this page) Tj ET"
+                          % (680 - line * 18, line))
+        for x in range(40):
+            stream.append("%i %i m %i %i l S" % (300 + x * 6, 100 + x * 5, 560 - x * 2, 400 - x * 7))
+        stream = "\n".join(stream)
+        objects.append("<< /Length %i >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       "/Resources << /Font << /F1 3 0 R >> >> /Contents %i 0 R >>" % len(objects))
+        kids.append("%i 0 R" % len(objects))
+    objects[1] = "<< /Type /Pages /Kids [%s] /Count %i >>" % (" ".join(kids), pages)
+
+    data, offsets = "%PDF-1.4\n", []
+    for number, obj in enumerate(objects):
+        offsets.append(len(data))
+        data += "%i 0 obj\n%s\nendobj\n" % (number + 1, obj)
+    xref = len(data)
+    data += "xref\n0 %i\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += "".join("%010i 00000 n \n" % offset for offset in offsets)
+    data += "trailer\n<< /Size %i /Root 1 0 R >>\nstartxref\n%i\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def measure(backend, location, source, quality, directory):
+    """(pages, seconds, bytes) to convert the whole document in one process"""
+    output = os.path.join(directory, backend.name + u"-%04d.png")
+    start = time.time()
+    subprocess.call(backend.command(location, quality, source, output),
+                    shell=os.name != "nt")
+    backend.collect(output)
+    taken = time.time() - start
+
+    pages = 0
+    size = 0
+    while os.path.exists(output % pages):
+        size += os.path.getsize(output % pages)
+        pages += 1
+    return pages, taken, size
+
+
+directory = tempfile.mkdtemp()
+try:
+    if len(sys.argv) > 1:
+        source = os.path.abspath(sys.argv[1])
+    else:
+        source = os.path.join(directory, u"sample.pdf")
+        make_sample(source, SAMPLE_PAGES)
+    quality = sys.argv[2] if len(sys.argv) > 2 else "normal"
+    print 'Converting %s at %s quality' % (os.path.basename(source), quality)
+
+    for backend in rasterizers.BACKENDS:
+        location = backend.find()
+        if not location or not backend.supports(source):
+            print '%-12s not installed, or can\'t read this file' % backend.label
+            continue
+        pages, taken, size = measure(backend, location, source, quality, directory)
+        if not pages:
+            print '%-12s failed' % backend.label
+            continue
+        print '%-12s %4i pages  %7.2fs  %6.2f pages/s  %7.2f MB  %6.1f KB/page' % (
+            backend.label, pages, taken, pages / max(taken, 0.0001),
+            size / 1048576.0, size / 1024.0 / pages)
+finally:
+    shutil.rmtree(directory)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+"""
+Times how long saving takes to encode a batch of images with an increasing
+number of workers (the save_workers preference), to show how it scales.
+Uses synthetic, screenshot-like images; png.py is loaded on its own so wx
+isn't needed.
+
+USAGE: python benchmark-save.py [IMAGES] [WIDTH] [HEIGHT]
+"""
+
+import imp
+import os
+import random
+import sys
+import time
+
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "whyteboard", "misc", "png.py"))
+png = imp.load_source("png", path)
+
+
+def make_image(width, height):
+    """Flat bands of colour with some noise, like a screenshot"""
+    rows = []
+    for y in xrange(height):
+        if y % 40 == 0:
+            colour = chr(random.randint(0, 255)) * 3
+            row = colour * width
+        rows.append(row[:width * 3 - 8] + os.urandom(8))
+    return (width, height, "".join(rows), None)
+
+
+args = [int(x) for x in sys.argv[1:4]]
+count, width, height = args + [24, 1280, 800][len(args):]
+
+print 'Creating %i %ix%i images' % (count, width, height)
+images = [make_image(width, height) for x in range(count)]
+size = sum(len(image[2]) for image in images) / 1024.0 / 1024.0
+
+baseline = None
+workers = 1
+while workers <= png.cpu_count() * 2:
+    start = time.time()
+    png.encode_all(images, workers)
+    taken = time.time() - start
+    baseline = baseline or taken
+    print '%2i workers: %6.2fs  %6.1f MB/s  %4.2fx' % (workers, taken, size / taken,
+                                                       baseline / taken)
+    workers *= 2
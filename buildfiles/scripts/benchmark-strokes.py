@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+
+"""
+Times encoding and decoding pen strokes with misc/strokes.py, and compares
+their size with pickling the same lists. Reads the pens from the given .wtbd
+files, which needs wx; without any, uses synthetic handwriting.
+
+USAGE: python benchmark-strokes.py [FILE...]
+"""
+
+import cPickle
+import imp
+import os
+import random
+import sys
+import time
+import zipfile
+import zlib
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+strokes = imp.load_source("strokes", os.path.join(root, "whyteboard", "misc", "strokes.py"))
+
+
+def make_stroke(length):
+    """A random walk, drawn at around 60 points a second"""
+    x, y = random.randint(0, 800), random.randint(0, 600)
+    now = time.time()
+    points, times = [], []
+    for i in xrange(length):
+        nx, ny = x + random.randint(-4, 4), y + random.randint(-4, 4)
+        points.append([x, y, nx, ny])
+        now += random.uniform(0.01, 0.02)
+        times.append(now)
+        x, y = nx, ny
+    return (points, times)
+
+
+def read_strokes(filename):
+    """Every pen's (points, time) in a chunked .wtbd file"""
+    sys.path.insert(0, root)
+    from whyteboard.misc import codec, records
+    import whyteboard.tools as tools
+
+    found = []
+    _zip = zipfile.ZipFile(filename)
+    for name in _zip.namelist():
+        if not name.startswith(u"sheets/"):
+            continue
+        data = _zip.read(name)
+        if records.is_records(data):
+            sheet = records.loads(data)
+        else:
+            sheet = codec.loads(data)
+        found.extend((shape.points, shape.time) for shape in sheet['shapes']
+                     if isinstance(shape, tools.Pen))
+    _zip.close()
+    return found
+
+
+if len(sys.argv) > 1:
+    pens = []
+    for filename in sys.argv[1:]:
+        pens.extend(read_strokes(filename))
+else:
+    pens = [make_stroke(random.randint(20, 400)) for x in range(2000)]
+
+count = sum(len(points) for points, times in pens)
+print 'Benchmarking %i strokes, %i segments' % (len(pens), count)
+
+pickled = sum(len(cPickle.dumps(pen, cPickle.HIGHEST_PROTOCOL)) for pen in pens)
+compressed = sum(len(zlib.compress(cPickle.dumps(pen, cPickle.HIGHEST_PROTOCOL)))
+                 for pen in pens)
+print '%-14s %10i bytes' % ('pickle', pickled)
+print '%-14s %10i bytes' % ('pickle + zlib', compressed)
+
+for compress in (False, True):
+    start = time.time()
+    encoded = [strokes.encode(points, times, compress) for points, times in pens]
+    encoding = time.time() - start
+
+    start = time.time()
+    for data in encoded:
+        strokes.decode(data)
+    decoding = time.time() - start
+
+    print '%-14s %10i bytes  encode %7.0f seg/s  decode %7.0f seg/s' % (
+        'strokes + zlib' if compress else 'strokes', sum(len(x) for x in encoded),
+        count / encoding, count / decoding)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+
+"""
+Converts .wtbd files' pickled sheets to records (see whyteboard/misc/records.py)
+in place, and reports how the two compare in size and loading time. Files in
+the older, single pickle format (save.data) are converted by running
+whyteboard --migrate DIR, which converts every older file in a directory.
+
+Only convert files you trust: the pickled sheets have to be unpickled.
+
+USAGE: python convert-save.py FILE [FILE...]
+"""
+
+import os
+import shutil
+import sys
+import time
+import zipfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from whyteboard.misc import codec, records, utility
+
+
+def timed(func, data, repeat=5):
+    start = time.time()
+    for x in range(repeat):
+        func(data)
+    return (time.time() - start) / repeat
+
+
+def convert(filename):
+    source = zipfile.ZipFile(filename)
+    names = source.namelist()
+    if utility.MANIFEST not in names:
+        source.close()
+        print '%s: old save format; open and save it in Whyteboard instead' % filename
+        return
+
+    tmp_file = filename + u".tmp"
+    target = zipfile.ZipFile(tmp_file, "w")
+    before = after = 0
+    old_time = new_time = 0.0
+    for name in names:
+        if not name.startswith(u"sheets/"):
+            utility.copy_member(source, name, target)
+            continue
+        data = source.read(name)
+        converted = records.convert_chunk(data)
+        if converted is not data:
+            old_time += timed(codec.loads, data)
+            new_time += timed(records.loads, converted)
+        before += len(data)
+        after += len(converted)
+        target.writestr(name, converted)
+    target.close()
+    source.close()
+
+    shutil.move(tmp_file, filename)
+    print '%s: sheets %i -> %i bytes, loaded in %.1fms -> %.1fms' % (
+        filename, before, after, old_time * 1000, new_time * 1000)
+
+
+if len(sys.argv) < 2:
+    print __doc__
+    sys.exit(1)
+
+for filename in sys.argv[1:]:
+    convert(filename)
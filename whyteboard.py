@@ -26,6 +26,7 @@ wxPython version is recent enough, as Whyteboard uses newer versions' features.
 import sys
 import webbrowser
 import locale
+import multiprocessing
 
 locale.setlocale(locale.LC_ALL)
 
@@ -45,4 +46,6 @@ if not hasattr(sys, 'frozen'):
 import wx
 from whyteboard.gui import WhyteboardApp
 
-WhyteboardApp(redirect=False).MainLoop()
\ No newline at end of file
+if __name__ == '__main__':  # not in --migrate's worker processes, on Windows
+    multiprocessing.freeze_support()
+    WhyteboardApp(redirect=False).MainLoop()
\ No newline at end of file
@@ -2,4 +2,5 @@
 # -*- coding: utf-8 -*-
 
 from config import Config
-from sheetmanager import SheetManager, Sheet
\ No newline at end of file
+from sheetmanager import SheetManager, Sheet
+from spatial import SpatialIndex
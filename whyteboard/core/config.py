@@ -137,4 +137,54 @@ class Config(object):
     def toolbar(self, value=None):
         if value is None:
             return self.config["toolbar"]
-        self.config["toolbar"] = value
\ No newline at end of file
+        self.config["toolbar"] = value
+
+    def undo_limit(self, value=None):
+        if value is None:
+            return self.config["undo_limit"]
+        self.config["undo_limit"] = value
+
+    def undo_memory(self, value=None):
+        if value is None:
+            return self.config["undo_memory"]
+        self.config["undo_memory"] = value
+
+    def undo_save_depth(self, value=None):
+        if value is None:
+            return self.config["undo_save_depth"]
+        self.config["undo_save_depth"] = value
+
+    def save_workers(self, value=None):
+        if value is None:
+            return self.config["save_workers"]
+        self.config["save_workers"] = value
+
+    def image_memory(self, value=None):
+        if value is None:
+            return self.config["image_memory"]
+        self.config["image_memory"] = value
+
+    def autosave_interval(self, value=None):
+        if value is None:
+            return self.config["autosave_interval"]
+        self.config["autosave_interval"] = value
+
+    def save_compression(self, value=None):
+        if value is None:
+            return self.config["save_compression"]
+        self.config["save_compression"] = value
+
+    def fast_save(self, value=None):
+        if value is None:
+            return self.config["fast_save"]
+        self.config["fast_save"] = value
+
+    def pdf_cache_size(self, value=None):
+        if value is None:
+            return self.config["pdf_cache_size"]
+        self.config["pdf_cache_size"] = value
+
+    def pdf_backend(self, value=None):
+        if value is None:
+            return self.config["pdf_backend"]
+        self.config["pdf_backend"] = value
\ No newline at end of file
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+"""
+A uniform grid spatial index over the shapes on a canvas, used to answer
+"which shapes lie inside this rectangle" without testing every shape.
+
+Shapes are bucketed by their bounding box (see Tool.get_bounds). The index is
+cheap to append to, and is simply marked as stale when shapes are moved or
+removed; it is then rebuilt on the next query.
+"""
+
+import logging
+
+logger = logging.getLogger("whyteboard.core.spatial")
+
+CELL_SIZE = 128  # pixels per grid cell
+
+#----------------------------------------------------------------------
+
+
+class SpatialIndex(object):
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.bounds = {}
+        self.stale = False
+
+
+    def cells_for(self, bounds):
+        """All grid cell keys that a (x1, y1, x2, y2) rectangle covers"""
+        size = self.cell_size
+        x1, y1, x2, y2 = bounds
+        for cx in xrange(int(x1 // size), int(x2 // size) + 1):
+            for cy in xrange(int(y1 // size), int(y2 // size) + 1):
+                yield (cx, cy)
+
+
+    def insert(self, shape):
+        bounds = shape.get_bounds()
+        if not bounds:
+            return
+        self.bounds[shape] = bounds
+        for key in self.cells_for(bounds):
+            self.cells.setdefault(key, set()).add(shape)
+
+
+    def invalidate(self):
+        """Marks the index to be rebuilt before its next query"""
+        self.stale = True
+
+
+    def rebuild(self, shapes):
+        logger.debug("Rebuilding spatial index for %i shapes", len(shapes))
+        self.cells = {}
+        self.bounds = {}
+        self.stale = False
+        for shape in shapes:
+            self.insert(shape)
+
+
+    def query(self, rect, shapes):
+        """
+        Returns the shapes whose bounding box lies entirely inside the
+        (x1, y1, x2, y2) rectangle, in drawing order. shapes is the canvas'
+        shape list, used when the index needs rebuilding.
+        """
+        if self.stale:
+            self.rebuild(shapes)
+
+        x1, y1, x2, y2 = (min(rect[0], rect[2]), min(rect[1], rect[3]),
+                          max(rect[0], rect[2]), max(rect[1], rect[3]))
+        found = set()
+        for key in self.cells_for((x1, y1, x2, y2)):
+            for shape in self.cells.get(key, ()):
+                b = self.bounds[shape]
+                if b[0] >= x1 and b[1] >= y1 and b[2] <= x2 and b[3] <= y2:
+                    found.add(shape)
+
+        if not found:
+            return []
+        return [shape for shape in shapes if shape in found]
@@ -34,7 +34,7 @@ from whyteboard.core import Config
 from whyteboard.updater import Updater
 from whyteboard.gui import ExceptionHook, GUI
 from whyteboard.lib import ProgressBar
-from whyteboard.misc import meta, get_path, get_home_dir, is_exe, to_unicode
+from whyteboard.misc import meta, migrate, get_path, get_home_dir, is_exe, to_unicode
 
 logger = logging.getLogger('whyteboard')
 _ = wx.GetTranslation
@@ -59,6 +59,9 @@ class WhyteboardApp(wx.App):
         parser.add_option("-u", "--update", action="store_true", help="check for a newer version of whyteboard")
         parser.add_option("-l", "--lang", help="set language. can be a country code or language (e.g. fr, french; nl, dutch)")
         parser.add_option("-d", "--debug", action="store_true", help="debug mode. more information about the program is logged")
+        parser.add_option("-m", "--migrate", metavar="DIR", help="convert older save files in DIR and below to the current format, without opening a window. originals are kept as .bak files")
+        parser.add_option("--workers", type="int", help="number of processes to --migrate with. defaults to one per core")
+        parser.add_option("--no-backup", action="store_true", help="don't keep the originals of files converted by --migrate")
 
         (options, args) = parser.parse_args()
         self.setup_logging(options.debug)
@@ -70,6 +73,10 @@ class WhyteboardApp(wx.App):
         preferences_file = options.conf
 
         Config().init(preferences_file)
+        if options.migrate:
+            self.migrate(options)
+            return False
+
         self.set_language(options.lang)
 
         if options.update:
@@ -93,6 +100,7 @@ class WhyteboardApp(wx.App):
 
         # If everything goes well..
         wx.CallAfter(self.delete_temp_update_files)
+        wx.CallAfter(self.frame.recover)
 
         logger.info("Startup complete, time taken: %.3fms", (time.time() - startup_time))
         return True
@@ -177,6 +185,36 @@ class WhyteboardApp(wx.App):
         meta.types, meta.dialog_wildcard = meta.define_filetypes()
     
         
+    def migrate(self, options):
+        """
+        Converts the older save files under a directory (without launching the
+        GUI), printing each file's outcome. See misc/migrate.py
+        """
+        directory = os.path.abspath(to_unicode(options.migrate))
+        if not os.path.isdir(directory):
+            print "%s is not a directory" % directory
+            return
+
+        config = Config()
+        start = time.time()
+        results = migrate.migrate_directory(directory, options.workers or config.save_workers(),
+                                            config.save_compression(), config.fast_save(),
+                                            not options.no_backup,
+                                            (config.default_width(), config.default_height()),
+                                            self.print_migrated)
+
+        count = lambda status: len([r for r in results if r['status'] == status])
+        print "%i converted, %i up to date, %i failed in %.1fs. Report: %s" % (
+            count(migrate.CONVERTED), count(migrate.SKIPPED), count(migrate.FAILED),
+            time.time() - start, os.path.join(directory, migrate.REPORT))
+
+
+    def print_migrated(self, result):
+        print "%-10s %-15s %s %s" % (result['status'], result['format'],
+                                     result['file'], result['message'])
+        sys.stdout.flush()
+
+
     def update(self):
         """
         Prompts the user for confirmation whether to update (without launching the GUI)
@@ -32,16 +32,18 @@ larger than the client size, then scrollbars are displayed, and a slight
 """
 
 import os
-import copy
 import logging
 
 import wx
 #import wx.lib.wxcairo as wxcairo
 
+from whyteboard.core import SpatialIndex
 from whyteboard.lib import DragScroller, pub
 
 from whyteboard.misc import get_image_path
-from whyteboard.tools import (Highlighter, Image, Line, Media, Note, OverlayShape, Polygon,
+from whyteboard.misc.undo import (AddShapeUndo, ClearSheetUndo, RemoveShapesUndo,
+                                  ReorderUndo, ShapeUndo, UndoHistory)
+from whyteboard.tools import (Highlighter, Image, Line, Media, Note, Polygon,
                    Select, Text, TOP_LEFT, TOP_RIGHT, BOTTOM_LEFT,
                    BOTTOM_RIGHT, CENTER_TOP, CENTER_RIGHT, CENTER_BOTTOM,
                    CENTER_LEFT, HANDLE_ROTATE, EDGE_TOP, EDGE_RIGHT, EDGE_LEFT,
@@ -85,14 +87,21 @@ class Canvas(wx.ScrolledWindow):
         self.shapes = []  # list of shapes for re-drawing/saving
         self.shape = None  # currently selected shape *to draw with*
         self.medias = []  # list of Media panels
-        self.selected = None  # selected shape *with Select tool*
+        self.selected = None  # last selected shape *with Select tool*
+        self.selection = set()  # every selected shape, including self.selected
+        self.groups = []  # sets of shape uids that are selected/moved together
+        self.index = SpatialIndex()  # answers rubber-band selection queries
         self.text = None  # current Text object for redraw all
         self.copy = None  # BitmapSelect instance
         self.resizing = False
         self.cursor_control = False  # toggle resize canvas cursor on/off
         self.resize_direction = None
-        self.undo_list = []
+        self.undo_list = UndoHistory(self)  # spills old actions to disk
         self.redo_list = []
+        self.dirty = True  # changed since last saved, see Utility.save_file
+        self.chunk = None  # number of this sheet's data in the saved file
+        self.version = 0  # counts changes, see misc/autosave.py
+        self.stale = False  # buffer to be redrawn before it's shown
         self.drawing = False
         self.prev_drag = (0, 0)
 
@@ -137,7 +146,7 @@ class Canvas(wx.ScrolledWindow):
             self.resizing = True
             return
 
-        if not isinstance(self.shape, Select) and self.selected:
+        if not isinstance(self.shape, Select) and self.selection:
             logger.debug("Deselecting shape")
             self.deselect_shape()
 
@@ -213,8 +222,8 @@ class Canvas(wx.ScrolledWindow):
 
 
     def select_tool_cursor(self, x, y):
-        if self.selected:
-            if self.select_tool_cursor_change(self.selected, x, y):
+        for shape in self.selection:
+            if self.select_tool_cursor_change(shape, x, y):
                 return
 
         for shape in reversed(self.shapes):
@@ -316,7 +325,10 @@ class Canvas(wx.ScrolledWindow):
         self.area = size
         size = (size[0] + self.CANVAS_BORDER, size[1] + self.CANVAS_BORDER)
         self.SetVirtualSize(size)
-        self.redraw_all(resizing=True)
+        if self.stale:
+            self.Refresh()
+        else:
+            self.redraw_all(resizing=True)
 
 
     def redraw_dirty(self, dc):
@@ -328,18 +340,26 @@ class Canvas(wx.ScrolledWindow):
         self.RefreshRect(rect.Inflate(2, 2))
 
 
-    def redraw_all(self, update_thumb=False, dc=None, resizing=False):
+    def redraw_all(self, update_thumb=False, dc=None, resizing=False, skip_selected=False,
+                   high_res=False):
         """
         Redraws all shapes that have been drawn. self.text is used to show text
         characters as they're being typed, as new Text/Note objects have not
         been added to self.shapes at this point.
         dc is used as the DC for printing.
+        skip_selected leaves the selection out, to be drawn on the overlay
+        high_res draws converted pages from their high resolution renders
         """
         if not dc:
+            self.stale = False
             dc = wx.BufferedDC(None, self.buffer)
             dc.Clear()
 
         for s in self.shapes:
+            if skip_selected and s.selected:
+                continue
+            if high_res and isinstance(s, Image) and s.draw_high_res(dc):
+                continue
             if not resizing:
                 s.draw(dc, True)
             else:
@@ -355,6 +375,21 @@ class Canvas(wx.ScrolledWindow):
             pub.sendMessage('thumbs.update_current')
 
 
+    def defer_redraw(self):
+        """
+        Leaves redrawing the buffer until it's needed: the sheet is shown, or
+        its thumbnail is made. Used while loading, so that every sheet isn't
+        rendered up front
+        """
+        self.stale = True
+        self.Refresh()
+
+
+    def ensure_drawn(self):
+        if self.stale:
+            self.redraw_all()
+
+
     def change_tool(self):
         if self.HasCapture():
             self.ReleaseMouse()
@@ -368,10 +403,15 @@ class Canvas(wx.ScrolledWindow):
             self.SetCursor(wx.StockCursor(self.shape.cursor))
 
 
-    def add_shape(self, shape):
-        """ Adds a shape to the shape list managed by the canvas. """
-        self.add_undo()
+    def add_shape(self, shape, undoable=True):
+        """
+        Adds a shape to the shape list managed by the canvas. Shapes being
+        loaded from a file aren't undoable.
+        """
+        if undoable:
+            self.add_undo(AddShapeUndo(self, shape))
         self.shapes.append(shape)
+        self.index.insert(shape)
 
         if self.selected:
             self.deselect_shape()
@@ -385,53 +425,91 @@ class Canvas(wx.ScrolledWindow):
 
 
 
-    def clone_shapes(self):
-        return [copy.copy(x) for x in self.shapes]
-
-    def add_undo(self):
-        """Creates an undo point. NEED to change this for memory improvements"""
-        l = self.clone_shapes()
-        self.undo_list.append(l)
+    def add_undo(self, action):
+        """Creates an undo point from an action (see misc/undo.py)"""
+        self.undo_list.append(action)
 
         if self.redo_list:
             self.redo_list = []
+        self.mark_unsaved(action)
+
+
+    def mark_unsaved(self, action=None, performed=False):
+        """
+        This sheet will be written out again on the next save, and the change
+        journalled (see misc/journal.py)
+        """
+        self.dirty = True
+        self.version += 1
+        self.gui.journal.touch(self, action, performed)
         pub.sendMessage('gui.mark_unsaved')
 
 
+    def add_shape_undo(self, shapes=None):
+        """
+        Creates an undo point for changes about to be made to the given shapes
+        (by default, the selection)
+        """
+        if shapes is None:
+            shapes = self.selected_shapes()
+        self.add_undo(ShapeUndo(self, shapes))
+
+
     def undo(self):
         """ Undoes an action, and adds it to the redo list. """
-        self.perform(self.undo_list, self.redo_list)
+        self.perform(self.undo_list, self.redo_list, u"undo")
 
     def redo(self):
         """ Redoes an action, and adds it to the undo list. """
-        self.perform(self.redo_list, self.undo_list)
+        self.perform(self.redo_list, self.undo_list, u"redo")
 
 
-    def perform(self, list_a, list_b):
+    def perform(self, list_a, list_b, method):
         """ Perform undo/redo. list_a: to remove from / list b: append to """
         if not list_a:
             return
-        list_b.append(list(self.shapes))
-        self.shapes = list_a.pop()
+        action = list_a.pop()
         self.deselect_shape()
+        action.packed = None  # its undo record is made again, once it's back
+        getattr(action, method)()
+        list_b.append(action)
+        self.index.invalidate()
         self.redraw_all(True)
 
-        pub.sendMessage('note.delete_sheet_items')  # lazy way of doing things...
-        for x in self.shapes:
-            if isinstance(x, Note):
-                pub.sendMessage('note.add', note=x)
-        pub.sendMessage('gui.mark_unsaved')
+        self.mark_unsaved(action, True)
         pub.sendMessage('update_shape_viewer')
 
 
-    def restore_sheet(self, shapes, undo_list, redo_list, size, medias, viewport):
+    def release(self):
+        """
+        Lets go of the sheet's shapes and history, once they've been kept
+        elsewhere for re-opening the sheet (see sheets.ClosedSheet)
+        """
+        self.deselect_shape()
+        self.shapes = []
+        self.medias = []
+        self.groups = []
+        self.undo_list = UndoHistory(self)
+        self.redo_list = []
+        self.index.invalidate()
+
+
+    def restore_sheet(self, shapes, undo_list, redo_list, size, medias, viewport,
+                      groups=None):
         """
         Restores itself (e.g. from undoing closing a sheet.)
         """
         self.shapes = shapes
+        self.undo_list.close()
         self.undo_list = undo_list
         self.redo_list = redo_list
         self.medias = medias
+        self.groups = groups or []
+        self.index.invalidate()
+
+        undo_list.set_canvas(self)
+        for action in redo_list:
+            action.canvas = self
 
         for media in medias:
             media.canvas = self
@@ -450,34 +528,46 @@ class Canvas(wx.ScrolledWindow):
 
 
     def toggle_transparent(self):
-        """Toggles the selected item's transparency"""
-        if not self.selected or isinstance(self.selected, (Media, Image, Text)):
+        """
+        Toggles the selected items' transparency, taking the last selected
+        shape's transparency as the value to toggle from
+        """
+        if not self.can_swap_transparency():
             return
-        self.add_undo()
+        self.add_shape_undo(self.restylable_shapes())
         val = wx.TRANSPARENT
 
         if self.selected.background == wx.TRANSPARENT:
             val = self.gui.get_background_colour()
 
-        self.selected.background = val
-        self.selected.make_pen()
+        for shape in self.restylable_shapes():
+            shape.background = val
+            shape.make_pen()
         self.redraw_all(True)
 
 
     def delete_selected(self):
-        """Deletes the selected shape"""
-        if not self.selected:
+        """Deletes every selected shape as a single undoable action"""
+        if not self.selection:
             return
 
-        if isinstance(self.selected, Media):
-            self.selected.remove_panel()
-        else:
-            if isinstance(self.selected, Note):
-                self.gui.notes.tree.Delete(self.selected.tree_id)
-            self.add_undo()
-            self.shapes.remove(self.selected)
-        pub.sendMessage('update_shape_viewer')
+        removed = set()
+        for shape in self.selection:
+            if isinstance(shape, Media):
+                shape.remove_panel()
+            else:
+                if isinstance(shape, Note):
+                    pub.sendMessage('note.delete', note=shape)
+                removed.add(shape)
+
+        if removed:
+            self.add_undo(RemoveShapesUndo(self, removed))
+            self.shapes = [s for s in self.shapes if s not in removed]
+            self.remove_from_groups(removed)
+            self.index.invalidate()
+        self.selection.clear()
         self.selected = None
+        pub.sendMessage('update_shape_viewer')
         self.redraw_all(True)
 
 
@@ -492,13 +582,15 @@ class Canvas(wx.ScrolledWindow):
         images = []
 
         if self.shapes:
-            self.add_undo()
             if keep_images:
                 for x in self.shapes:
                     if isinstance(x, Image):
                         images.append(x)
+            self.add_undo(ClearSheetUndo(self, self.shapes, images))
 
         self.shapes = images
+        self.deselect_shape()
+        self.index.invalidate()
         pub.sendMessage('update_shape_viewer')
         self.redraw_all(update_thumb=True)
 
@@ -589,8 +681,8 @@ class Canvas(wx.ScrolledWindow):
 
     def do_move(self, shape):
         """ Performs the move, by popping the item to be moved """
-        self.add_undo()
         x = self.shapes.index(shape)
+        self.index.invalidate()
         return (x, self.shapes.pop(x))
 
 
@@ -598,6 +690,7 @@ class Canvas(wx.ScrolledWindow):
         def wrapper(self, shape, x=None, item=None):
             x, item = self.do_move(shape)
             fn(self, shape, x, item)
+            self.add_undo(ReorderUndo(self, shape, x, self.shapes.index(shape)))
             pub.sendMessage('update_shape_viewer')
             self.redraw_all(True)
         return wrapper
@@ -638,6 +731,7 @@ class Canvas(wx.ScrolledWindow):
         Called when the window is exposed. Paint the buffer, and then create a
         region, remove the buffer rectangle then clear it with grey.
         """
+        self.ensure_drawn()
         wx.BufferedPaintDC(self, self.buffer, wx.BUFFER_VIRTUAL_AREA)
 
         if os.name == "nt":
@@ -704,40 +798,203 @@ class Canvas(wx.ScrolledWindow):
 
 
     def deselect_shape(self):
-        """De-selects the currently selected shape"""
-        for x in self.shapes:
-            if isinstance(x, OverlayShape):
-                x.selected = False
+        """De-selects every selected shape"""
+        for shape in self.selection:
+            shape.selected = False
+        self.selection.clear()
         if self.selected:
             self.selected = None
             self.redraw_all()
 
 
-    def select_shape(self, shape):
-        """Selects the selected shape"""
+    def select_shape(self, shape, add=False):
+        """
+        Selects a shape along with the rest of its group. When add is set, the
+        shape is added to the current selection instead of replacing it.
+        The selected shapes are hidden from the buffer and drawn on the overlay
+        so that they can be dragged around.
+        """
         self.overlay = wx.Overlay()
-        if self.selected:
+        if self.selection and not add:
             self.deselect_shape()
 
+        self.set_selected(shape)
+        self.redraw_all(skip_selected=True)  # hide 'originals'
+        self.draw_selection(self.get_dc())  # draw 'new'
+
+
+    def set_selected(self, shape):
+        """Marks a shape and its group as selected, without redrawing"""
+        for member in self.group_members(shape):
+            member.selected = True
+            self.selection.add(member)
         self.selected = shape
-        shape.selected = True
-        x = self.shapes.index(shape)
-        self.shapes.pop(x)
-        self.redraw_all()  # hide 'original'
-        self.shapes.insert(x, shape)
-        shape.draw(self.get_dc(), False)  # draw 'new'
+
+
+    def unselect_shape(self, shape):
+        """Removes a shape (and its group) from the selection"""
+        for member in self.group_members(shape):
+            member.selected = False
+            self.selection.discard(member)
+        if self.selected in self.group_members(shape):
+            self.selected = None
+            if self.selection:
+                self.selected = self.selected_shapes()[-1]
+        self.redraw_all()
+
+
+    def toggle_selection(self, shape):
+        """Selects a shape by itself, or deselects it if it's already selected"""
+        if shape.selected:
+            self.deselect_shape()
+        else:
+            self.deselect_shape()
+            self.set_selected(shape)
+
+
+    def select_in_rect(self, rect):
+        """
+        Adds every shape lying inside the (x1, y1, x2, y2) rectangle to the
+        selection, by querying the spatial index rather than each shape
+        """
+        self.overlay.Reset()
+        found = self.index.query(rect, self.shapes)
+        logger.debug("Rubber-band selection found %i shapes", len(found))
+        if not found:
+            self.redraw_all()
+            return
+        for shape in found:
+            self.set_selected(shape)
+        self.selected = found[-1]
+        self.redraw_all()
+
+
+    def selected_shapes(self):
+        """The selected shapes, in the order they are drawn"""
+        if not self.selection:
+            return []
+        if len(self.selection) == 1:
+            return list(self.selection)
+        return [shape for shape in self.shapes if shape in self.selection]
+
+
+    def restylable_shapes(self):
+        """Selected shapes whose colour/transparency can be changed"""
+        return [x for x in self.selected_shapes() if not isinstance(x, (Media, Image, Text))]
+
+
+    def draw_selection(self, dc):
+        """Draws every selected shape onto the overlay in a single pass"""
+        overlay = wx.DCOverlay(self.overlay, dc)
+        overlay.Clear()
+        for shape in self.selected_shapes():
+            shape.draw(dc, True)
+        del overlay
+
+
+    def draw_selected(self):
+        """Redraws the selected shapes, refreshing only the area they cover"""
+        dc = self.get_dc()
+        self.draw_selection(dc)
+        self.redraw_dirty(dc)
+
+
+    def nudge_selection(self, x, y):
+        """Moves every selected shape by the given amount of pixels"""
+        for shape in self.selection:
+            shape.move(shape.x + x, shape.y + y, offset=shape.offset(shape.x, shape.y))
+        self.index.invalidate()
+        self.draw_selected()
+
+
+    def group_members(self, shape):
+        """The shapes in the given shape's group, or just the shape itself"""
+        uid = getattr(shape, "uid", None)
+        for group in self.groups:
+            if uid in group:
+                return [x for x in self.shapes if x.uid in group]
+        return [shape]
+
+
+    def group_selection(self):
+        """Groups the selected shapes together, merging any existing groups"""
+        shapes = [x for x in self.selection if not isinstance(x, Media)]
+        if len(shapes) < 2:
+            return
+        uids = set(x.uid for x in shapes)
+        self.groups = [g for g in self.groups if not g & uids]
+        self.groups.append(uids)
+        logger.debug("Grouped %i shapes", len(uids))
+        self.mark_unsaved()
+
+
+    def ungroup_selection(self):
+        uids = set(getattr(x, "uid", None) for x in self.selection)
+        self.groups = [g for g in self.groups if not g & uids]
+        self.mark_unsaved()
+
+
+    def is_selection_grouped(self):
+        uids = set(getattr(x, "uid", None) for x in self.selection)
+        for group in self.groups:
+            if group & uids:
+                return True
+        return False
+
+
+    def remove_from_groups(self, shapes):
+        """Drops deleted shapes from their groups, removing emptied groups"""
+        if not self.groups:
+            return
+        uids = set(x.uid for x in shapes)
+        groups = [g - uids for g in self.groups]
+        self.groups = [g for g in groups if len(g) > 1]
+
+
+    def group_indexes(self):
+        """Groups as lists of shape positions, for saving"""
+        if not self.groups:
+            return []
+        positions = dict((shape.uid, x) for x, shape in enumerate(self.shapes))
+        groups = []
+        for group in self.groups:
+            indexes = [positions[uid] for uid in group if uid in positions]
+            if len(indexes) > 1:
+                groups.append(sorted(indexes))
+        return groups
+
+
+    def restore_groups(self, groups, saved=None):
+        """
+        Recreates groups from lists of shape positions (when loading). The
+        positions are in saved, the shape list as it was saved, and are mapped
+        to uids; shapes that failed to load are left out of their group
+        """
+        if saved is None:
+            saved = self.shapes
+        loaded = set(shape.uid for shape in self.shapes)
+        self.groups = []
+        for group in groups:
+            uids = set(saved[x].uid for x in group if x < len(saved)) & loaded
+            if len(uids) > 1:
+                self.groups.append(uids)
 
 
     def change_colour(self):
         x = self.colour_data(self.selected.colour)
         if x:
-            self.selected.colour = x
+            self.add_shape_undo()
+            for shape in self.selected_shapes():
+                shape.colour = x
             self.redraw_all(True)
 
     def change_background(self,):
         x = self.colour_data(self.selected.background)
         if x:
-            self.selected.background = x
+            self.add_shape_undo(self.restylable_shapes())
+            for shape in self.restylable_shapes():
+                shape.background = x
+                shape.make_pen()
             self.redraw_all(True)
 
     def colour_data(self, colour):
@@ -749,7 +1006,6 @@ class Canvas(wx.ScrolledWindow):
         dlg = wx.ColourDialog(self.gui, data)
         if dlg.ShowModal() == wx.ID_OK:
             x = dlg.GetColourData()
-            self.add_undo()
             return x.GetColour().Get()
         return False
 
@@ -791,8 +1047,9 @@ class Canvas(wx.ScrolledWindow):
         return not self.drawing and not self.shape.drawing 
 
     def swap_colours(self):
-        """Swaps the selected shape's foreground and background"""
-        self.selected.colour, self.selected.background = self.selected.background, self.selected.colour
+        """Swaps the selected shapes' foreground and background"""
+        for shape in self.selected_shapes():
+            shape.colour, shape.background = shape.background, shape.colour
         self.redraw_all()
 
     def show_text_edit_dialog(self, text_shape):
@@ -43,6 +43,7 @@ from whyteboard.misc import meta
 from whyteboard.misc import (get_home_dir, bitmap_button, fix_std_sizer_tab_order, 
                              format_bytes, get_image_path, create_bold_font, button,
                              spinctrl)
+from whyteboard.misc.undo import ShapeListUndo
 
 _ = wx.GetTranslation
 logger = logging.getLogger("whyteboard.dialogs")
@@ -208,10 +209,12 @@ class ProgressDialog(wx.Dialog):
     Shows a Progres Gauge while an operation is taking place. May be cancellable
     which is possible when converting pdf/ps
     """
-    def __init__(self, gui, title, cancellable=False):
+    def __init__(self, gui, title, cancellable=False, converter=None):
         """Defines a gauge and a timer which updates the gauge."""
         wx.Dialog.__init__(self, gui, title=title, style=wx.CAPTION)
         self.gui = gui
+        self.title = title
+        self.converter = converter  # cancelled by the cancel button
         self.timer = wx.Timer(self)
         self.gauge = wx.Gauge(self, range=100, size=(180, 30))
         sizer = wx.BoxSizer(wx.VERTICAL)
@@ -238,13 +241,22 @@ class ProgressDialog(wx.Dialog):
         self.gauge.Pulse()
 
 
+    def set_progress(self, done, total):
+        """Shows how much is done, once that's known, instead of pulsing"""
+        self.timer.Stop()
+        self.gauge.SetRange(total)
+        self.gauge.SetValue(done)
+        self.SetTitle(u"%s %i/%i" % (self.title, done, total))
+
+
     def on_cancel(self, event):
-        """Cancels the conversion process"""
+        """Cancels the conversion process(es)"""
         self.SetTitle(_("Cancelling..."))
         self.FindWindowById(wx.ID_CANCEL).Disable()
         self.timer.Stop()
-        self.gui.convert_cancelled = True
-        if os.name == "nt":
+        if self.converter:
+            self.converter.cancel()
+        elif os.name == "nt":
             wx.Kill(self.gui.pid, wx.SIGKILL)
         else:
             wx.Kill(self.gui.pid)
@@ -1058,8 +1070,11 @@ class ShapeViewer(wx.Dialog):
         event.Skip()
 
     def apply(self, event=None):
-        self.gui.canvas.add_undo()
-        self.gui.canvas.shapes = self.shapes
+        canvas = self.gui.canvas
+        canvas.add_undo(ShapeListUndo(canvas, canvas.shapes, self.shapes))
+        canvas.deselect_shape()
+        canvas.shapes = list(self.shapes)
+        canvas.index.invalidate()
         self.gui.canvas.redraw_all(True)
 
 
@@ -1068,18 +1083,20 @@ class ShapeViewer(wx.Dialog):
 class PDFCacheDialog(wx.Dialog):
     """
     Views a list of all cached PDFs - showing the amount of pages, location,
-    conversion quality and date saved. Has options to remove items to re-convert
+    conversion quality, size and date saved, and how often the cache is used.
+    Has options to remove items to re-convert
     """
     def __init__(self, gui, cache):
         wx.Dialog.__init__(self, gui, title=_("PDF Cache Viewer"), size=(650, 300),
                            style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
         self.cache = cache
         self.files = cache.entries()
-        self.original_files = dict(cache.entries())
+        self.removed = []  # ids of entries to remove on OK
         self.list = WhyteboardList(self)
         self.SetSizeHints(450, 300)
 
         label = wx.StaticText(self, label=_("Whyteboard will load these files from its cache instead of re-converting them"))
+        self.usage = wx.StaticText(self)
         sizer = wx.BoxSizer(wx.VERTICAL)
         bsizer = wx.BoxSizer(wx.HORIZONTAL)
 
@@ -1097,7 +1114,8 @@ class PDFCacheDialog(wx.Dialog):
 
         sizer = wx.BoxSizer(wx.VERTICAL)
         sizer.Add(label, 0, wx.ALL, 15)
-        sizer.Add((10, 5))
+        sizer.Add(self.usage, 0, wx.LEFT | wx.RIGHT, 15)
+        sizer.Add((10, 10))
         sizer.Add(bsizer, 0, wx.LEFT | wx.EXPAND, 10)
         sizer.Add((10, 5))
         sizer.Add(self.list, 1, wx.LEFT | wx.RIGHT | wx.EXPAND, 10)
@@ -1126,25 +1144,39 @@ class PDFCacheDialog(wx.Dialog):
         self.list.InsertColumn(0, _("File Location"))
         self.list.InsertColumn(1, _("Quality"))
         self.list.InsertColumn(2, _("Pages"))
-        self.list.InsertColumn(3, _("Date Cached"))
+        self.list.InsertColumn(3, _("Size"))
+        self.list.InsertColumn(4, _("Date Cached"))
 
         if not self.files:
             index = self.list.InsertStringItem(sys.maxint, "")
             self.list.SetStringItem(index, 0, _("There are no cached items to display"))
         else:
-            for x, key in self.files.items():
-                f = self.files[x]
+            for x, f in enumerate(self.files):
                 index = self.list.InsertStringItem(sys.maxint, str(x + 1))
 
                 self.list.SetStringItem(index, 0, f['file'])
                 self.list.SetStringItem(index, 1, f['quality'].capitalize())
                 self.list.SetStringItem(index, 2, u"%s" % len(f['images']))
-                self.list.SetStringItem(index, 3, f.get('date', _("No Date Saved")))
+                self.list.SetStringItem(index, 3, format_bytes(f['bytes']))
+                self.list.SetStringItem(index, 4, f['date'])
 
         self.list.SetColumnWidth(0, wx.LIST_AUTOSIZE)
         self.list.SetColumnWidth(1, 70)
         self.list.SetColumnWidth(2, 60)
-        self.list.SetColumnWidth(3, wx.LIST_AUTOSIZE)
+        self.list.SetColumnWidth(3, 80)
+        self.list.SetColumnWidth(4, wx.LIST_AUTOSIZE)
+        self.show_usage()
+
+
+    def show_usage(self):
+        """The cache's hit rate, and its disk usage out of its budget"""
+        hits, misses = self.cache.stats()
+        rate = 100 * hits // (hits + misses) if hits + misses else 0
+        used = sum(f['bytes'] for f in self.files)
+        self.usage.SetLabel(_("Hit rate: %(rate)i%% (%(hits)i of %(total)i conversions)     Disk usage: %(used)s of %(budget)s")
+                            % {'rate': rate, 'hits': hits, 'total': hits + misses,
+                               'used': format_bytes(used),
+                               'budget': format_bytes(self.cache.get_budget())})
 
 
     def check_buttons(self):
@@ -1156,32 +1188,23 @@ class PDFCacheDialog(wx.Dialog):
 
 
     def ok(self, event):
-        self.cache.write_dict(self.files)
+        self.cache.remove(self.removed)
         self.Close()
 
 
     def delete_key(self, event):
-        if event.GetKeyCode() == wx.WXK_DELETE and self.files.items():
+        if event.GetKeyCode() == wx.WXK_DELETE and self.files:
             self.on_remove(None)
         event.Skip()
 
 
     def on_remove(self, event):
-        """Remove the dictionary item that matches the selected item's path"""
+        """Remove the selected entry; it's removed from the cache on OK"""
         item = self.list.GetFirstSelected()
-        if item == -1:
+        if item == -1 or not self.files:
             return
 
-        quality = self.list.GetItem(item, 1).GetText()
-        text = self.list.GetItemText(item)
-        files = dict(self.files)
-
-        for x, key in self.files.items():
-            if (self.files[x]['file'] == text and
-                self.files[x]['quality'].capitalize() == quality):
-                del files[x]
-
-        self.files = files
+        self.removed.append(self.files.pop(item)['id'])
         self.populate()
 
 
@@ -42,6 +42,7 @@ ID_FEEDBACK = wx.NewId()          # help->feedback
 ID_FOREGROUND = wx.NewId()        # change shape's foreground colour
 ID_EXPORT_PREF = wx.NewId()       # export->preferences
 ID_FULLSCREEN = wx.NewId()        # toggle fullscreen
+ID_GROUP = wx.NewId()             # group selected shapes
 ID_HISTORY = wx.NewId()           # history viewer
 ID_IMPORT_IMAGE = wx.NewId()      # import->Image
 ID_IMPORT_PDF = wx.NewId()        # import->PDF
@@ -68,5 +69,6 @@ ID_TOOL_PREVIEW = wx.NewId()      # toggle preview of tool
 ID_TOOLBAR = wx.NewId()           # toggle toolbar
 ID_TRANSPARENT = wx.NewId()       # toggle shape transparency
 ID_TRANSLATE = wx.NewId()         # open translation URL
+ID_UNGROUP = wx.NewId()           # ungroup selected shapes
 ID_UNDO_SHEET = wx.NewId()        # undo close sheet
 ID_UPDATE = wx.NewId()            # update self
\ No newline at end of file
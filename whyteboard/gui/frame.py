@@ -42,10 +42,12 @@ from wx.html import HtmlHelpController
 from whyteboard.core import Config
 from whyteboard.lib import icon, fnb, pub
 from whyteboard.misc import Utility, meta
+from whyteboard.misc.autosave import AutoSave
+from whyteboard.misc.journal import Journal
 from whyteboard.tools import Highlighter, EDGE_LEFT, EDGE_TOP
 
-from whyteboard.gui import (Canvas, CanvasDropTarget, ControlPanel, MediaPanel,
-                            Menu, Preferences, Print, SidePanel, ShapePopup,
+from whyteboard.gui import (Canvas, CanvasDropTarget, ClosedSheet, ControlPanel,
+                            MediaPanel, Menu, Preferences, Print, SidePanel, ShapePopup,
                             SheetsPopup, Toolbar)
 
 from whyteboard.gui import  (AboutDialog, Feedback, FindIM, History,
@@ -57,7 +59,7 @@ from whyteboard.gui import (ID_BACKGROUND, ID_CLOSE_ALL, ID_COLOUR_GRID, ID_DESE
                        ID_MOVE_TO_BOTTOM, ID_NEXT, ID_PASTE_NEW, ID_PREV,
                        ID_RECENTLY_CLOSED, ID_STATUSBAR, ID_SWAP_COLOURS,
                        ID_TOOL_PREVIEW, ID_TOOLBAR, ID_TRANSPARENT, ID_UNDO_SHEET,
-                       ID_CLOSE_OTHERS)
+                       ID_CLOSE_OTHERS, ID_GROUP, ID_UNGROUP)
 
 from whyteboard.misc import (get_home_dir, is_save_file, get_clipboard,
                              check_clipboard, download_help_files, file_dialog,
@@ -103,8 +105,8 @@ class GUI(wx.Frame):
         self.can_paste = check_clipboard()
         self.process = None
         self.pid = None
+        self.converters = []  # PDF/PS files converting, see misc/converter.py
         self.dialog = None
-        self.convert_cancelled = False
         self.shape_viewer_open = False
         self.help = None
         self.hotkey_pressed = False  # for hotkey timer
@@ -162,6 +164,8 @@ class GUI(wx.Frame):
         self.set_menu_from_config()
         self.do_bindings()
         self.find_help()
+        self.autosave = AutoSave(self)
+        self.journal = Journal(self)
         
         pub.sendMessage('thumbs.update_current')
         self.update_panels(True)
@@ -225,17 +229,17 @@ class GUI(wx.Frame):
                 getattr(self, u"on_" + config_key)(None, False)
 
 
-    def shape_selected(self, shape):
+    def shape_selected(self, shape, add=False):
         """
-        Shape getting selected (by Select tool)
+        Shape getting selected (by Select tool), add: add to the selection
         """
-        self.canvas.select_shape(shape)
+        self.canvas.select_shape(shape, add)
         change = (shape.background == wx.TRANSPARENT)
         self.util.transparent = change
         self.control.transparent.SetValue(change)
 
     def make_media_panel(self, size, media):
-        media.mc = MediaPanel(self.canvas, size, media)
+        media.mc = MediaPanel(media.canvas or self.canvas, size, media)
 
     def release_mouse(self):
         self.canvas.release_mouse()
@@ -355,6 +359,7 @@ class GUI(wx.Frame):
 
             names = []
             canvas = self.canvas
+            self.util.load_all_sheets()
             for x in range(self.tab_count):
                 self.canvas = self.tabs.GetPage(x)
                 name = u"%s-tempblahhahh-%s-.jpg" % (filename, x)
@@ -391,6 +396,7 @@ class GUI(wx.Frame):
         if filename:
             name = os.path.splitext(filename)
             canvas = self.canvas
+            self.util.load_all_sheets()
             for x in range(self.tab_count):
                 self.canvas = self.tabs.GetPage(x)
                 self.util.export(u"%s-%s%s" % (name[0], x + 1, name[1]))
@@ -436,6 +442,7 @@ class GUI(wx.Frame):
 
         new_config.write()
         Config().config = new_config
+        self.autosave.start()
 
         if new_config['bmp_select_transparent'] != old_config['bmp_select_transparent']:
             self.canvas.copy = None
@@ -545,6 +552,8 @@ class GUI(wx.Frame):
     def on_change_tab(self, event=None):
         """Updates tab vars, scrolls thumbnails and selects tree node"""
         self.canvas = self.tabs.GetCurrentPage()
+        self.util.load_sheet(self.canvas)
+        self.util.prioritise_page(self.canvas)
         self.update_panels(False)
         self.current_tab = self.tabs.GetSelection()
 
@@ -644,18 +653,14 @@ class GUI(wx.Frame):
         """
         Creates an undo entry for a tab that's being closed
         """
+        self.util.load_sheet(canvas)
         if len(self.closed_tabs) == UNDO_SHEET_COUNT:
+            self.closed_tabs[0].close()
             del self.closed_tabs[0]
 
-        item = {'shapes': canvas.shapes,
-                'undo': canvas.undo_list,
-                'redo': canvas.redo_list,
-                'size': canvas.area,
-                'name': self.tabs.GetPageText(tab_number),
-                'medias': canvas.medias,
-                'viewport': canvas.GetViewStart()}
-
-        self.closed_tabs.append(item)
+        name = self.tabs.GetPageText(tab_number)
+        self.closed_tabs.append(ClosedSheet(canvas, name))
+        canvas.release()
         if recreate_menu:
             self.menu.make_closed_tabs_menu()
 
@@ -730,9 +735,8 @@ class GUI(wx.Frame):
         else:
             tab = self.closed_tabs.pop(self.closed_tabs.index(tab))
 
-        self.on_new_tab(name=tab['name'], wb=True)
-        self.canvas.restore_sheet(tab['shapes'], tab['undo'], tab['redo'],
-                                  tab['size'], tab['medias'], tab['viewport'])
+        self.on_new_tab(name=tab.name, wb=True)
+        tab.restore(self.canvas)
         pub.sendMessage('update_shape_viewer')
         self.menu.make_closed_tabs_menu()
 
@@ -817,6 +821,10 @@ class GUI(wx.Frame):
             do = True
         elif _id in [wx.ID_DELETE, ID_DESELECT, ID_FOREGROUND] and canvas.selected:
             do = True
+        elif _id == ID_GROUP and len(canvas.selection) > 1:
+            do = True
+        elif _id == ID_UNGROUP and canvas.is_selection_grouped():
+            do = True
         elif _id == ID_MOVE_UP and canvas.check_move(u"up"):
             do = True
         elif _id == ID_MOVE_DOWN and canvas.check_move(u"down"):
@@ -844,6 +852,12 @@ class GUI(wx.Frame):
     def on_deselect_shape(self, event=None):
         self.canvas.deselect_shape()
 
+    def on_group(self, event=None):
+        self.canvas.group_selection()
+
+    def on_ungroup(self, event=None):
+        self.canvas.ungroup_selection()
+
     def on_copy(self, event):
         set_clipboard(self.canvas.get_selection_bitmap())
 
@@ -931,24 +945,21 @@ class GUI(wx.Frame):
                 self.on_fullscreen(None, False)
         elif code in [wx.WXK_DOWN, wx.WXK_LEFT, wx.WXK_RIGHT, wx.WXK_UP]:
             if self.canvas.selected:
-                shape = self.canvas.selected
-
-                _map = { wx.WXK_UP: (shape.x, shape.y - SCROLL_AMOUNT),
-                        wx.WXK_DOWN: (shape.x, shape.y + SCROLL_AMOUNT),
-                        wx.WXK_LEFT: (shape.x - SCROLL_AMOUNT, shape.y),
-                        wx.WXK_RIGHT: (shape.x + SCROLL_AMOUNT, shape.y) }
+                _map = { wx.WXK_UP: (0, -SCROLL_AMOUNT),
+                        wx.WXK_DOWN: (0, SCROLL_AMOUNT),
+                        wx.WXK_LEFT: (-SCROLL_AMOUNT, 0),
+                        wx.WXK_RIGHT: (SCROLL_AMOUNT, 0) }
 
                 if not self.hotkey_pressed:
                     self.hotkey_pressed = True
-                    self.canvas.add_undo()
-                    shape.start_select_action(0)
+                    self.canvas.add_shape_undo()
+                    for shape in self.canvas.selection:
+                        shape.start_select_action(0)
                     self.hotkey_timer = wx.CallLater(150, self.reset_hotkey)
                 else:
                     self.hotkey_timer.Restart(150)
 
-                shape.move(_map.get(code)[0], _map.get(code)[1],
-                           offset=shape.offset(shape.x, shape.y))
-                self.canvas.draw_shape(shape)
+                self.canvas.nudge_selection(*_map.get(code))
                 #shape.find_edges()
                 #self.canvas.shape_near_canvas_edge(shape.edges[EDGE_LEFT],
                 #                                   shape.edges[EDGE_TOP], True)
@@ -993,7 +1004,9 @@ class GUI(wx.Frame):
         self.hotkey_pressed = False
         if not self.canvas.selected:
             return
-        self.canvas.selected.end_select_action(0)
+        for shape in self.canvas.selection:
+            shape.end_select_action(0)
+        self.canvas.redraw_all()
         pub.sendMessage('update_shape_viewer')
 
 
@@ -1041,11 +1054,17 @@ class GUI(wx.Frame):
         pub.sendMessage('gui.preview.refresh')
 
 
-    def convert_dialog(self, cmd):
-        """Called when the PDF convert process begins"""
-        self.process = wx.Process(self)
-        self.pid = wx.Execute(cmd, wx.EXEC_ASYNC, self.process)
-        self.show_progress_dialog(_("Converting..."), True, True)
+    def convert_dialog(self, converter):
+        """
+        Called when the PDF convert processes begin. They carry on in the
+        background, with their own progress dialog; False if they couldn't start
+        """
+        if not converter.start():
+            return False
+        converter.dialog = ProgressDialog(self, _("Converting..."), True, converter)
+        converter.dialog.Show()
+        self.converters.append(converter)
+        return True
 
 
     def on_end_process(self, event=None):
@@ -1088,7 +1107,7 @@ class GUI(wx.Frame):
         self.dialog.SetTitle(_("Updating Thumbnails"))
         wx.MilliSleep(50)
         wx.SafeYield()
-        self.on_refresh()  # force thumbnails
+        self.thumbs.update_all(keep_saved=True)  # force thumbnails
         self.dialog.Destroy()
 
 
@@ -1111,6 +1130,27 @@ class GUI(wx.Frame):
         logger.info("User requested application to exit.")
         self.prompt_for_save(self.Destroy)
 
+    def Destroy(self):
+        """Quitting, having saved or not; either way, nothing's to recover"""
+        self.autosave.discard()
+        self.journal.stop()
+        self.util.discard_pending()  # closes the file they'd be loaded from
+        for converter in self.converters:
+            converter.cancel()
+        return wx.Frame.Destroy(self)
+
+
+    def recover(self):
+        """
+        Offers to restore work lost when Whyteboard last crashed. A journal is
+        more recent than an autosave, which is only offered if no journal was
+        recovered, and only removed once one was
+        """
+        if self.journal.recover():
+            self.autosave.remove_recovery_files()
+        else:
+            self.autosave.recover()
+
     def tab_popup(self, event):
         self.PopupMenu(SheetsPopup(self, self, event.GetSelection()))
 
@@ -1156,11 +1196,13 @@ class GUI(wx.Frame):
         self.thumbs.update_all()
 
     def on_clear_sheets(self, event=None):
+        self.util.load_all_sheets()
         for tab in range(self.tab_count):
             self.tabs.GetPage(tab).clear(keep_images=True)
 
 
     def on_clear_all_sheets(self, event=None):
+        self.util.load_all_sheets()
         for tab in range(self.tab_count):
             self.tabs.GetPage(tab).clear()
         self.thumbs.update_all()
@@ -1185,9 +1227,11 @@ class GUI(wx.Frame):
         self._print.page_setup()
 
     def on_print_preview(self, event):
+        self.util.load_all_sheets()
         self._print.print_preview()
 
     def on_print(self, event):
+        self.util.load_all_sheets()
         self._print.do_print()
 
     def on_new_win(self, event=None):
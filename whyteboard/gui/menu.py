@@ -37,7 +37,7 @@ from whyteboard.gui import (ID_CLEAR_ALL, ID_CLEAR_ALL_SHEETS, ID_CLEAR_SHEETS,
        ID_RENAME, ID_REPORT_BUG, ID_RESIZE, ID_SHAPE_VIEWER, ID_STATUSBAR,
        ID_SWAP_COLOURS, ID_TOOL_PREVIEW, ID_TOOLBAR, ID_TRANSPARENT,
        ID_TRANSLATE, ID_UNDO_SHEET, ID_UPDATE, ID_BACKGROUND, ID_FOREGROUND,
-       ID_CLOSE_OTHERS)
+       ID_CLOSE_OTHERS, ID_GROUP, ID_UNGROUP)
 
 _ = wx.GetTranslation
 logger = logging.getLogger("whyteboard.menu")
@@ -131,6 +131,9 @@ class Menu(object):
         shapes.Append(wx.ID_DELETE, _("&Delete Shape") + "\tDelete", _("Delete the currently selected shape"))
         shapes.Append(ID_DESELECT, _("&Deselect Shape") + "\tCtrl-D", _("Deselects the currently selected shape"))
         shapes.AppendSeparator()
+        shapes.Append(ID_GROUP, _("&Group Shapes") + "\tCtrl-G", _("Groups the selected shapes so they are selected and moved together"))
+        shapes.Append(ID_UNGROUP, _("U&ngroup Shapes") + "\tCtrl-Shift-G", _("Ungroups the selected shapes"))
+        shapes.AppendSeparator()
         shapes.AppendCheckItem(ID_TRANSPARENT, " " + _("T&ransparent"), _("Toggles the selected shape's transparency"))
         shapes.Append(ID_FOREGROUND, _("&Color..."), _("Change the selected shape's color"))
         shapes.Append(ID_BACKGROUND, _("&Background Color..."), _("Change the selected shape's background color"))
@@ -187,10 +190,10 @@ class Menu(object):
 
 
         # idle event handlers
-        ids = [ID_BACKGROUND, ID_CLOSE_ALL, ID_CLOSE_OTHERS, ID_DESELECT, ID_FOREGROUND, ID_MOVE_DOWN,
+        ids = [ID_BACKGROUND, ID_CLOSE_ALL, ID_CLOSE_OTHERS, ID_DESELECT, ID_FOREGROUND, ID_GROUP, ID_MOVE_DOWN,
                ID_MOVE_TO_BOTTOM, ID_MOVE_TO_TOP, ID_MOVE_UP, ID_NEXT, ID_PASTE_NEW, ID_PREV,
                ID_RECENTLY_CLOSED, ID_SWAP_COLOURS, ID_TRANSPARENT, ID_UNDO_SHEET,
-               wx.ID_CLOSE, wx.ID_COPY, wx.ID_DELETE, wx.ID_PASTE, wx.ID_REDO, wx.ID_UNDO]
+               ID_UNGROUP, wx.ID_CLOSE, wx.ID_COPY, wx.ID_DELETE, wx.ID_PASTE, wx.ID_REDO, wx.ID_UNDO]
         [self.gui.Bind(wx.EVT_UPDATE_UI, self.gui.update_menus, id=x) for x in ids]
 
         # menu items
@@ -209,6 +212,7 @@ class Menu(object):
         self.gui.Bind(wx.EVT_MENU, self.gui.on_feedback, id=ID_FEEDBACK)
         self.gui.Bind(wx.EVT_MENU, self.gui.on_foreground, id=ID_FOREGROUND)
         self.gui.Bind(wx.EVT_MENU, self.gui.on_fullscreen, id=ID_FULLSCREEN)
+        self.gui.Bind(wx.EVT_MENU, self.gui.on_group, id=ID_GROUP)
         self.gui.Bind(wx.EVT_MENU, self.gui.on_history, id=ID_HISTORY)
         self.gui.Bind(wx.EVT_MENU, self.gui.on_import_preferences, id=ID_IMPORT_PREF)
         self.gui.Bind(wx.EVT_MENU, self.gui.on_move_down, id=ID_MOVE_DOWN)
@@ -232,6 +236,7 @@ class Menu(object):
         self.gui.Bind(wx.EVT_MENU, self.gui.on_translate, id=ID_TRANSLATE)
         self.gui.Bind(wx.EVT_MENU, self.gui.on_transparent, id=ID_TRANSPARENT)
         self.gui.Bind(wx.EVT_MENU, self.gui.on_undo_tab, id=ID_UNDO_SHEET)
+        self.gui.Bind(wx.EVT_MENU, self.gui.on_ungroup, id=ID_UNGROUP)
         self.gui.Bind(wx.EVT_MENU, self.gui.on_update, id=ID_UPDATE)
         self.gui.Bind(wx.EVT_MENU, self.gui.on_about, id=wx.ID_ABOUT)
         self.gui.Bind(wx.EVT_MENU, self.gui.on_clear, id=wx.ID_CLEAR)
@@ -264,7 +269,7 @@ class Menu(object):
 
         for x, tab in enumerate(reversed(self.gui.closed_tabs)):
             _id = wx.NewId()
-            name = tab['name']
+            name = tab.name
             self.closed_tabs_menu.Append(_id, u"&%i: %s" % (x + 1, name),
                                          _('Restore sheet "%s"') % name)
             func = lambda evt, tab=tab: self.gui.on_undo_tab(tab=tab)
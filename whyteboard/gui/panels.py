@@ -25,6 +25,7 @@ This module contains classes for the GUI side panels and pop-up menus.
 from __future__ import division, with_statement
 import os
 import logging
+import cStringIO
 
 import wx
 import wx.media
@@ -288,11 +289,12 @@ class ControlPanel(wx.Panel):
 
         if self.gui.canvas.selected:
             if add_undo:
-                self.gui.canvas.add_undo()
-            if var_name == u"background" and not self.transparent.IsChecked():
-                self.gui.canvas.selected.background = value
-            elif var_name != u"background":
-                setattr(self.gui.canvas.selected, var_name, value)
+                self.gui.canvas.add_shape_undo()
+            for shape in self.gui.canvas.selected_shapes():
+                if var_name == u"background" and not self.transparent.IsChecked():
+                    shape.background = value
+                elif var_name != u"background":
+                    setattr(shape, var_name, value)
             self.gui.canvas.redraw_all(True)
             pub.sendMessage('update_shape_viewer')
 
@@ -424,8 +426,9 @@ class MediaPanel(wx.Panel):
 
     def left_down(self, event):
         """Grab the mouse offset of the window relative the the top-left"""
-        self.gui.canvas.selected = self.tool
-        self.tool.selected = True
+        if not self.tool.selected:
+            self.gui.canvas.deselect_shape()
+            self.gui.canvas.set_selected(self.tool)
         self.CaptureMouse()
         pos = self.Parent.ScreenToClient(self.ClientToScreen(event.Position))
 
@@ -634,6 +637,7 @@ class Notes(wx.Panel):
         self.tree.Bind(wx.EVT_TREE_ITEM_ACTIVATED, self.on_click)
         self.tree.Bind(wx.EVT_TREE_ITEM_RIGHT_CLICK, self.pop_up)
         pub.subscribe(self.add_note, 'note.add')
+        pub.subscribe(self.delete_note, 'note.delete')
         pub.subscribe(self.edit_note, 'note.edit')
         pub.subscribe(self.rename, 'sheet.rename')
         pub.subscribe(self.sheet_moved, 'sheet.move')
@@ -653,18 +657,28 @@ class Notes(wx.Panel):
 
     def add_note(self, note, _id=None):
         """
-        Adds a note to the current tab tree element. The notes' text is the
-        element's text in the tree - newlines are replaced to stop the tree's
-        formatting becoming too wide.
+        Adds a note to its sheet's tree element (usually the current tab). The
+        notes' text is the element's text in the tree - newlines are replaced
+        to stop the tree's formatting becoming too wide.
         """
         text = note.text.replace(u"\n", u" ")[:15]
-        tree_id = self.tabs[self.gui.tabs.GetSelection()]
+        tab = self.gui.tabs.GetPageIndex(note.canvas)
+        if tab == -1:
+            tab = self.gui.tabs.GetSelection()
+        tree_id = self.tabs[tab]
 
         data = wx.TreeItemData(note)
         note.tree_id = self.tree.AppendItem(tree_id, text, data=data)
         self.tree.Expand(tree_id)
 
 
+    def delete_note(self, note):
+        """Removes a note's tree element (the note has been deleted)"""
+        if note.tree_id:
+            self.tree.Delete(note.tree_id)
+            note.tree_id = None
+
+
     def remove_tab(self, note):
         """Removes a tab and its children."""
         item = self.tabs[note]
@@ -719,12 +733,7 @@ class Notes(wx.Panel):
         """
         note_shape = self.tree.GetPyData(event.GetItem())
 
-        if not note_shape.selected:
-            self.gui.canvas.deselect_shape()
-            note_shape.selected = True
-            self.gui.canvas.selected = note_shape
-        else:
-            self.gui.canvas.deselect_shape()
+        self.gui.canvas.toggle_selection(note_shape)
 
         if draw:
             self.gui.canvas.redraw_all()
@@ -815,6 +824,7 @@ class Thumbs(scrolled.ScrolledPanel):
         pub.subscribe(self.rename, 'sheet.rename')
         pub.subscribe(self.sheet_moved, 'sheet.move')
         pub.subscribe(self.update_current, 'thumbs.update_current')
+        self.Bind(wx.EVT_IDLE, self.on_idle)
 
 
     def highlight_current(self, tab, select):
@@ -909,6 +919,7 @@ class Thumbs(scrolled.ScrolledPanel):
         displayed on the button as the thumbnail.
         """
         canvas = self.gui.tabs.GetPage(_id)
+        canvas.ensure_drawn()
         img = wx.ImageFromBitmap(canvas.buffer)
         img.Rescale(150, 150)
         bitmap = wx.BitmapFromImage(img)
@@ -923,6 +934,25 @@ class Thumbs(scrolled.ScrolledPanel):
         return bitmap
 
 
+    def load_thumbnail(self, _id, data):
+        """Shows a thumbnail saved in a .wtbd file, given as PNG data"""
+        image = wx.ImageFromStream(cStringIO.StringIO(data), wx.BITMAP_TYPE_PNG)
+        bmp = wx.BitmapFromImage(image)
+        thumb = self.thumbs[_id]
+        thumb.SetBitmapLabel(bmp)
+        thumb.buffer = bmp
+        thumb.stale = False
+        thumb.saved = True
+
+
+    def thumbnail(self, _id):
+        """A sheet's thumbnail to save, without the current one's highlight"""
+        thumb = self.thumbs[_id]
+        if thumb.stale or thumb.current and meta.transparent:
+            return self.redraw(_id)
+        return thumb.buffer
+
+
     def sheet_moved(self, event, tab_count):
         for x in range(tab_count):
             self.text[x].SetLabel(self.gui.tabs.GetPageText(x))
@@ -945,18 +975,44 @@ class Thumbs(scrolled.ScrolledPanel):
         bmp = self.redraw(_id)
         thumb = self.thumbs[_id]
         thumb.SetBitmapLabel(bmp)
-        self.thumbs[_id].buffer = bmp
+        thumb.buffer = bmp
+        thumb.stale = False
+        thumb.saved = False
 
         if thumb.current and meta.transparent:
             thumb.highlight()
 
 
-    def update_all(self):
+    def update_all(self, keep_saved=False):
+        """
+        Updates all thumbnails (i.e. upon loading a Whyteboard file), when idle.
+        keep_saved keeps those showing the thumbnail saved in the file
+        """
+        for thumb in self.thumbs:
+            if not (keep_saved and thumb.saved):
+                thumb.stale = True
+
+
+    def schedule(self, _id):
+        """Updates a thumbnail when idle"""
+        self.thumbs[_id].stale = True
+
+
+    def on_idle(self, event):
         """
-        Updates all thumbnails (i.e. upon loading a Whyteboard file).
+        Updates one out of date thumbnail at a time, so the user isn't kept
+        waiting: the current sheet's first, then those scrolled into view
         """
-        for count, item in enumerate(self.thumbs):
-            self.update(count)
+        stale = [thumb for thumb in self.thumbs if thumb.stale]
+        if not stale:
+            return
+        view = self.GetClientRect()
+        stale.sort(key=lambda thumb: (not thumb.current,
+                                      not view.Intersects(thumb.GetRect()),
+                                      thumb.thumb_id))
+        self.update(stale[0].thumb_id)
+        if len(stale) > 1:
+            event.RequestMore()
 
 
 #----------------------------------------------------------------------
@@ -974,6 +1030,8 @@ class ThumbButton(wx.BitmapButton):
         self.SetBitmapLabel(bitmap)
         self.buffer = bitmap
         self.current = False  # active thumb?
+        self.stale = False  # to be updated when idle, see Thumbs.on_idle
+        self.saved = False  # showing the thumbnail saved in the .wtbd file
         self.Bind(wx.EVT_BUTTON, self.on_press)
         self.SetBackgroundColour(wx.WHITE)
         self.Bind(wx.EVT_RIGHT_UP, self.tab_popup)
@@ -994,16 +1052,17 @@ class ThumbButton(wx.BitmapButton):
     def update(self):
         """
         Iterates over each thumb and unhighlights the previously selected thumb
-        Then, sets this thumb as the currently highlighted one and redraws
+        Then, sets this thumb as the currently highlighted one; both are
+        redrawn when idle
         """
         for thumb in self.parent.thumbs:
             if thumb.thumb_id != self.thumb_id:
                 if thumb.current:
                     thumb.current = False
-                    self.parent.update(thumb.thumb_id)
+                    thumb.stale = True
 
         self.current = True
-        self.parent.update(self.thumb_id)
+        self.stale = True
 
 
     def highlight(self):
@@ -197,19 +197,14 @@ class ShapePopup(Popup):
         self.item.edit()
 
     def select(self, draw=True):
-        if not self.item.selected:
-            self.gui.canvas.deselect_shape()
-            self.item.selected = True
-            self.gui.canvas.selected = self.item
-        else:
-            self.gui.canvas.deselect_shape()
+        self.gui.canvas.toggle_selection(self.item)
 
         if draw:
             self.gui.canvas.redraw_all()
 
 
     def add_point(self):
-        self.gui.canvas.add_undo()
+        self.gui.canvas.add_shape_undo([self.item])
         self.item.points = list(self.item.points)
         x, y = self.gui.canvas.ScreenToClient(wx.GetMousePosition())
         x, y = self.gui.canvas.CalcUnscrolledPosition(x, y)
@@ -41,6 +41,7 @@ from whyteboard.gui import FindIM
 from whyteboard.lib import pub
 from whyteboard.misc import (meta, create_colour_bitmap, create_bold_font, label,
                              checkbox, button, spinctrl)
+from whyteboard.misc.rasterizers import BACKENDS
 
 _ = wx.GetTranslation
 logger = logging.getLogger("whyteboard.preferences")
@@ -65,6 +66,7 @@ class Preferences(wx.Dialog):
         self.tabs.AddPage(General(*params), _("General"))
         self.tabs.AddPage(View(*params), _("View"))
         self.tabs.AddPage(PDF(*params), _("PDF Conversion"))
+        self.tabs.AddPage(Saving(*params), _("Saving"))
         
         okay = button(self, wx.ID_OK, _("&OK"), self.on_okay)
         cancel = button(self, wx.ID_CANCEL, _("&Cancel"), self.on_cancel)
@@ -317,7 +319,7 @@ class View(BasePanel):
 
 class PDF(BasePanel):
     """
-    PDF conversion quality
+    PDF conversion quality, and the program converting
     """
     def setup_gui(self):
         self.im_result = None
@@ -341,6 +343,23 @@ class PDF(BasePanel):
         self.sizer.Add((10, 10))
         self.sizer.Add(note, 0, wx.LEFT | wx.BOTTOM, 30)
 
+        self.backends = [(u"auto", _("Automatic"))]
+        self.backends.extend([(b.name, b.label) for b in BACKENDS])
+        self.backend = wx.ComboBox(self, choices=[b[1] for b in self.backends],
+                                   style=wx.CB_READONLY, size=(240, 30))
+        for name, value in self.backends:
+            if self.config.pdf_backend() == name:
+                self.backend.SetValue(value)
+        self.backend.Bind(wx.EVT_COMBOBOX, self.on_backend)
+        self.sizer.Add(label(self, _("Convert With:")), 0, wx.LEFT, 15)
+        self.sizer.Add((10, 5))
+        self.sizer.Add(self.backend, 0, wx.LEFT | wx.BOTTOM, 30)
+
+        self.cache_size = spinctrl(self, 65536, self.config.pdf_cache_size(), self.on_cache_size, 16)
+        self.sizer.Add(label(self, _("Converted Files Cache (MB):")), 0, wx.LEFT, 15)
+        self.sizer.Add((10, 5))
+        self.sizer.Add(self.cache_size, 0, wx.LEFT | wx.BOTTOM, 30)
+
         if os.name == "nt":
             self.im_button = button(self, wx.NewId(), "", self.on_im)
             self.set_im_button()
@@ -353,6 +372,12 @@ class PDF(BasePanel):
     def on_quality(self, event, value):
         self.config.convert_quality(value)
 
+    def on_cache_size(self, event):
+        self.config.pdf_cache_size(self.cache_size.GetValue())
+
+    def on_backend(self, event):
+        self.config.pdf_backend(self.backends[self.backend.GetSelection()][0])
+
 
     def set_im_button(self):
         """Sets the label to IM's path"""        
@@ -382,3 +407,29 @@ class PDF(BasePanel):
         return True
 
 #----------------------------------------------------------------------
+
+
+class Saving(BasePanel):
+    """
+    How much save files are compressed
+    """
+    def setup_gui(self):
+        self.level = spinctrl(self, 9, self.config.save_compression(), self.on_level, 0)
+        fast = checkbox(self, _("Faster saving (larger files)"), self.config.fast_save(), self.on_fast)
+        note = wx.StaticText(self, label=wordwrap(_("Note: 0 doesn't compress drawings at all, 9 makes the smallest files but saves slowest. Images are never re-compressed"), 350, wx.ClientDC(self.gui)))
+
+        self.sizer.Add(label(self, _("Compression Level:")), 0, wx.ALL, 15)
+        self.sizer.Add(self.level, 0, wx.LEFT, 30)
+        self.sizer.Add((10, 15))
+        self.sizer.Add(fast, 0, wx.LEFT, 10)
+        self.sizer.Add((10, 10))
+        self.sizer.Add(note, 0, wx.LEFT | wx.BOTTOM, 30)
+
+
+    def on_level(self, event):
+        self.config.save_compression(self.level.GetValue())
+
+    def on_fast(self, event):
+        self.config.fast_save(event.Checked())
+
+#----------------------------------------------------------------------
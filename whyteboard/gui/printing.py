@@ -53,6 +53,7 @@ class Print(object):
 
 
     def print_preview(self):
+        self.gui.util.render_high_res(self.gui.get_canvases())
         data = wx.PrintDialogData(self.printData)
         printout = PrintOut(self.gui)
         printout2 = PrintOut(self.gui)
@@ -71,6 +72,8 @@ class Print(object):
 
 
     def do_print(self):
+        """Converted pages render at print resolution while the dialog's open"""
+        self.gui.util.render_high_res(self.gui.get_canvases())
         pdd = wx.PrintDialogData(self.printData)
         pdd.SetToPage(2)
         printer = wx.Printer(pdd)
@@ -162,12 +165,11 @@ class PrintOut(wx.Printout):
         Due to a bug in wx 2.8, we must remove any highlighter tools
         as they cannot be printed due to the way the tool uses GraphicsContext
         http://trac.wxwidgets.org/ticket/11761
+        Converted pages are printed from their high resolution renders, if
+        they're done
         """
-        shapes = canvas.clone_shapes()
+        shapes = canvas.shapes
+        canvas.shapes = [x for x in shapes if not isinstance(x, Highlighter)]
 
-        for shape in canvas.shapes:
-            if isinstance(shape, Highlighter):
-                canvas.shapes.remove(shape)
-
-        canvas.redraw_all(dc=dc)
+        canvas.redraw_all(dc=dc, high_res=True)
         canvas.shapes = shapes
\ No newline at end of file
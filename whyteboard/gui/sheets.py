@@ -22,8 +22,16 @@
 Classes for managing Whyteboard's sheets.
 """
 
+import logging
+
 import wx
 
+from whyteboard.misc import codec, format_bytes
+
+logger = logging.getLogger("whyteboard.gui.sheets")
+
+#----------------------------------------------------------------------
+
 class SheetManager(object):
     def __init__(self):
         self.sheets = []
@@ -34,4 +42,54 @@ class UndoSheetManager(object):
     """
     def __init__(self, gui):
         self.gui= gui
-        self.sheets = []
\ No newline at end of file
+        self.sheets = []
+
+#----------------------------------------------------------------------
+
+class ClosedSheet(object):
+    """
+    A sheet that's been closed and can be re-opened. Its shapes, media and
+    undo/redo actions are packed into one compressed blob, so the memory held
+    by its bitmaps is released until the sheet is restored. Undo actions that
+    were already moved to disk stay in the sheet's undo history's journal.
+    """
+    def __init__(self, canvas, name):
+        self.name = name
+        self.size = canvas.area
+        self.viewport = canvas.GetViewStart()
+        self.history = canvas.undo_list
+        self.sheet = {'shapes': canvas.shapes,
+                      'undo': self.history.detach(),
+                      'redo': canvas.redo_list,
+                      'medias': canvas.medias,
+                      'groups': canvas.groups}
+        self.data = None
+
+        try:
+            self.data = codec.pack_objects(self.sheet, canvas)
+            self.sheet = None
+            logger.debug("Packed closed sheet [%s] into %s", name,
+                         format_bytes(len(self.data)))
+        except Exception:
+            logger.exception("Couldn't pack closed sheet [%s]; keeping it as-is", name)
+
+
+    def restore(self, canvas):
+        """Re-creates the sheet on a new canvas"""
+        sheet = self.sheet
+        if self.data:
+            sheet = codec.unpack_objects(self.data, canvas)
+
+        canvas.restore_sheet(sheet['shapes'], self.history, sheet['redo'],
+                             self.size, sheet['medias'], self.viewport,
+                             sheet['groups'])
+        self.history.attach(sheet['undo'])
+        self.data = None
+        self.sheet = None
+
+
+    def close(self):
+        """Discards the sheet, once it can no longer be restored"""
+        self.history.close()
+        self.data = None
+        self.sheet = None
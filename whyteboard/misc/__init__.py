@@ -7,7 +7,7 @@ from functions import (bitmap_button, button, check_clipboard, checkbox, convert
                        get_clipboard, get_home_dir, get_image_path, get_path,
                        get_time, get_version_int, get_wx_image_type,
                        help_file_path, is_exe, is_save_file, label, load_image,
-                       make_filename, open_url, set_clipboard, show_dialog, spinctrl, 
+                       make_filename, open_url, process_exists, replace_file, set_clipboard, show_dialog, spinctrl, 
                        transparent_supported, version_is_greater,
                        versions_are_equal, is_new_version, to_unicode)
 from utility import Utility
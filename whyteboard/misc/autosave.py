@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+"""
+Periodically writes the open sheets to a recovery file, in the background,
+which is offered back to the user if Whyteboard didn't close properly.
+
+On the GUI thread, only a snapshot of the sheets changed since the last
+autosave is taken: a shallow copy of each shape, with its colours as plain
+values so the worker never calls into wx. That's enough, as shapes replace
+their lists rather than change them (see Tool.get_state). Everything else -
+encoding shapes as records, compressing and encoding images - happens on a
+worker thread, in small steps that let go of the interpreter lock between
+them, so the GUI thread keeps drawing while it works. Sheets that haven't
+changed since the file was loaded or saved are copied over from it.
+
+The recovery file is an ordinary .wtbd file whose manifest also holds the
+filename the work was being saved to; it has no undo history.
+"""
+
+from __future__ import with_statement
+
+import copy
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import zipfile
+
+import wx
+
+from whyteboard.core import Config
+from whyteboard.misc import (get_home_dir, make_filename, meta, png, process_exists,
+                             replace_file)
+from whyteboard.misc import codec, records, utility
+
+import whyteboard.tools as tools
+
+_ = wx.GetTranslation
+logger = logging.getLogger("whyteboard.autosave")
+
+RECOVERY_FILE = u"recovery-%i.wtbd"
+RECOVERED_FILE = u"recovered-%i.wtbd"  # by process ID, as it's then in use
+
+#----------------------------------------------------------------------
+
+def pause():
+    """Lets go of the interpreter lock between the worker's steps"""
+    time.sleep(0)
+
+
+def recovery_pid(path):
+    """The process ID a recovery file was written by"""
+    try:
+        return int(os.path.basename(path)[len(u"recovery-"):-len(u".wtbd")])
+    except ValueError:
+        return 0
+
+
+class AutoSave(object):
+    def __init__(self, gui):
+        self.gui = gui
+        self.util = gui.util
+        self.thread = None
+        self.sheets = {}  # canvas: ((version, level), chunk, images) of the last autosave
+        self.directory = get_home_dir(u"recovery")
+        self.filename = os.path.join(self.directory, RECOVERY_FILE % os.getpid())
+        self.timer = wx.Timer(gui)
+        gui.Bind(wx.EVT_TIMER, self.on_timer, self.timer)
+        self.start()
+
+
+    def start(self):
+        """(Re)starts the timer, after the interval's been changed"""
+        minutes = Config().autosave_interval()
+        self.timer.Stop()
+        if minutes:
+            self.timer.Start(minutes * 60 * 1000)
+
+
+    def on_timer(self, event=None):
+        if self.util.saved or self.thread and self.thread.is_alive():
+            return
+        snapshot = self.snapshot()
+        logger.debug("Autosaving %i sheets in the background", len(snapshot['sheets']))
+        self.thread = threading.Thread(target=self.write, args=(snapshot,))
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def wait(self):
+        """Waits for an autosave that's in progress"""
+        if self.thread:
+            self.thread.join()
+
+
+    def discard(self):
+        """Once the work has been saved, or deliberately not saved"""
+        self.wait()
+        self.sheets = {}
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    #----------------------------------------------------------------------
+
+    def snapshot(self):
+        """What the worker thread needs to write the recovery file"""
+        util = self.util
+        settings = utility.manifest_settings(util, self.gui.current_tab, meta.version)
+        compression = utility.Compression()
+
+        sheets = []
+        images = {}  # name: encoded data, or None to copy it from the source
+        encode = {}  # digest: (name, pixels)
+        source = util.source and os.path.exists(util.source)
+        canvases = self.gui.get_canvases()
+        for canvas, name in zip(canvases, self.gui.get_tab_names()):
+            sheet = {'name': name, 'size': canvas.area, 'canvas': canvas,
+                     'count': len(canvas.shapes)}
+            if canvas in util.pending:
+                sheet['count'] = util.sheet_shapes.get(canvas.chunk)
+            sheets.append(sheet)
+            cached = self.sheets.get(canvas)
+            version = (canvas.version, compression.chunk_level)
+
+            if canvas in util.pending or (not canvas.dirty and canvas.chunk is not None
+                                          and source):
+                sheet['copy'] = canvas.chunk
+                sheet['images'] = util.sheet_images.get(canvas.chunk)
+                if sheet['images'] is None:
+                    sheet['images'] = self.image_names(canvas.shapes)
+            elif cached and cached[0] == version and self.kept(cached[2]):
+                sheet['chunk'], sheet['images'] = cached[1:]
+            else:
+                sheet['version'] = version
+                sheet['shapes'] = [self.copy_shape(x, encode) for x in canvas.shapes]
+                sheet['medias'] = [self.copy_shape(x, encode) for x in canvas.medias]
+                sheet['groups'] = canvas.group_indexes()
+                sheet['images'] = self.image_names(sheet['shapes'])
+
+            for image in sheet['images']:
+                images[image] = util.images.data(image) or util.image_files.data(image)
+        for name, pixels in encode.values():
+            images.pop(name, None)
+
+        return {'settings': settings, 'filename': util.filename, 'source': util.source,
+                'sheets': sheets, 'images': images, 'encode': encode,
+                'compression': compression}
+
+
+    def copy_shape(self, shape, encode):
+        """
+        A copy of a shape, for the worker to write. Its colours are taken as
+        (r, g, b, a), and images that have never been saved have their pixels
+        taken, to be encoded by the worker
+        """
+        clone = copy.copy(shape)
+        for name, kind in type(shape).fields:
+            value = getattr(shape, name, None)
+            if kind == "colour" and value and not isinstance(value, (int, long)):
+                setattr(clone, name, records.colour_ints(value))
+
+        if isinstance(shape, tools.Image) and not shape.filename:
+            digest = shape.get_digest()
+            image = self.util.image_files.get(digest)
+            if image:
+                clone.filename = image[0]
+            elif digest in encode:
+                clone.filename = encode[digest][0]
+            else:
+                clone.filename = make_filename() + u".png"
+                encode[digest] = (clone.filename, codec.bitmap_pixels(shape.image))
+        return clone
+
+
+    def kept(self, images):
+        """
+        Whether a sheet's images can all still be written: those encoded for an
+        earlier autosave may have been let go of since
+        """
+        saved = set()
+        for names in self.util.sheet_images.values():
+            saved.update(names)
+        return all(name in saved or name in self.util.images
+                   or self.util.image_files.data(name) for name in images)
+
+
+    def image_names(self, shapes):
+        return sorted(set(shape.filename for shape in shapes
+                          if isinstance(shape, tools.Image) and shape.filename))
+
+    #----------------------------------------------------------------------
+
+    def write(self, snapshot):
+        """Writes the recovery file; runs on the worker thread"""
+        tmp_file = self.filename + u".tmp"
+        source = None
+        try:
+            if snapshot['source'] and os.path.exists(snapshot['source']):
+                source = zipfile.ZipFile(snapshot['source'])
+            _zip = zipfile.ZipFile(tmp_file, "w")
+            self.write_images(_zip, snapshot, source)
+            self.write_sheets(_zip, snapshot, source)
+            _zip.close()
+        except Exception:
+            logger.exception("Autosave failed")
+            return
+        finally:
+            if source:
+                source.close()
+
+        replace_file(tmp_file, self.filename)
+        logger.debug("Autosaved to [%s]", self.filename)
+
+
+    def write_images(self, _zip, snapshot, source):
+        for name, data in snapshot['images'].items():
+            if data is not None:
+                _zip.writestr(u"data/" + name, data)
+            elif source and u"data/" + name in source.NameToInfo:
+                utility.copy_member(source, u"data/" + name, _zip)
+
+        for digest, (name, pixels) in snapshot['encode'].items():
+            data = png.encode_png(*pixels, pause=pause)
+            self.util.image_files.add(digest, name, data)
+            _zip.writestr(u"data/" + name, data)
+
+
+    def write_sheets(self, _zip, snapshot, source):
+        compression = snapshot['compression']
+        sheets = []
+        for x, sheet in enumerate(snapshot['sheets']):
+            sheets.append({'name': sheet['name'], 'size': sheet['size'],
+                           'shapes': sheet['count'], 'images': sheet['images'],
+                           'thumbnail': None})
+            if 'copy' in sheet:
+                utility.copy_member(source, utility.SHEET_CHUNK % sheet['copy'],
+                                    _zip, utility.SHEET_CHUNK % x)
+                continue
+
+            if 'shapes' in sheet:
+                sheet['chunk'] = compression.chunk({'shapes': sheet['shapes'],
+                                                    'medias': sheet['medias'],
+                                                    'groups': sheet['groups']}, pause)
+                self.sheets[sheet['canvas']] = (sheet['version'], sheet['chunk'],
+                                                sheet['images'])
+            compression.write(_zip, utility.SHEET_CHUNK % x, sheet['chunk'])
+
+        manifest = dict(snapshot['settings'], sheets=sheets,
+                        filename=snapshot['filename'])
+        compression.write(_zip, utility.MANIFEST, json.dumps(manifest))
+
+    #----------------------------------------------------------------------
+
+    def recovery_files(self):
+        """
+        Those left behind by Whyteboards that didn't close properly; not those
+        of Whyteboards that are still running
+        """
+        return [x for x in glob.glob(os.path.join(self.directory, u"recovery-*.wtbd"))
+                if x != self.filename and not process_exists(recovery_pid(x))]
+
+
+    def remove_recovery_files(self):
+        for x in self.recovery_files():
+            os.remove(x)
+
+
+    def recover(self):
+        """
+        Offers to restore the work from a recovery file left behind by a
+        Whyteboard that didn't close properly
+        """
+        files = self.recovery_files()
+        if not files:
+            return
+        files.sort(key=os.path.getmtime)
+        logger.info("Found recovery files %s", files)
+
+        answer = wx.MessageBox(_("Whyteboard didn't close properly last time.\n"
+                                 "Would you like to recover your unsaved work?"),
+                               u"Whyteboard", wx.YES_NO | wx.ICON_QUESTION)
+        path = os.path.join(self.directory, RECOVERED_FILE % os.getpid())
+        if answer == wx.YES:
+            replace_file(files.pop(), path)
+        for x in files:
+            os.remove(x)
+        if answer != wx.YES:
+            return
+
+        try:
+            filename = utility.read_manifest(path)['filename']
+        except Exception:
+            logger.exception("Recovery file is corrupt")
+            wx.MessageBox(_("Your work couldn't be recovered."), u"Whyteboard")
+            return
+
+        self.util.load_wtbd(path)
+        self.util.filename = filename
+        self.gui.mark_unsaved()
+        self.gui.journal.start()
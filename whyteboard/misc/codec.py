@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+"""
+Turns a closed sheet's shapes and undo actions into a compressed, pickled
+byte string that can be kept off the heap, and back again. These strings never
+leave memory: whatever is written to disk is made with records.py instead.
+Image bitmaps are carried along as pixel data rather than looked up on disk.
+
+pack_objects() packs a whole structure - a sheet's shapes and undo actions -
+in one go, so shapes shared between them are still shared once unpacked. Pens'
+points and times are packed with strokes.encode(), rather than as lists.
+"""
+
+import cPickle
+import cStringIO
+import zlib
+
+import wx
+
+import whyteboard.tools as tools
+
+from whyteboard.misc import strokes
+
+#----------------------------------------------------------------------
+
+ATTRIBUTE_BYTES = 48  # rough cost of one attribute in a shape's __dict__
+POINT_BYTES = 16  # ...and of one (x, y) point
+PIXEL_BYTES = 4
+
+# wx objects that can't be pickled; shapes re-create them after unpacking
+UNPICKLABLE = (wx.Brush, wx.Cursor, wx.Font, wx.Image, wx.Pen, wx.TreeItemId,
+               wx.Window)
+
+
+def dumps(obj, level=6):
+    return zlib.compress(cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL), level)
+
+
+def loads(data):
+    return cPickle.loads(zlib.decompress(data))
+
+
+def encode_bitmap(bitmap):
+    """
+    A bitmap's raw pixels, alpha channel and mask colour. Quicker to produce
+    than a PNG, and compresses about as well with the rest of the data
+    """
+    image = bitmap.ConvertToImage()
+    alpha = image.GetAlphaData() if image.HasAlpha() else None
+    mask = None
+    if image.HasMask():
+        mask = (image.GetMaskRed(), image.GetMaskGreen(), image.GetMaskBlue())
+    return (image.GetWidth(), image.GetHeight(), image.GetData(), alpha, mask)
+
+
+def decode_bitmap(data):
+    width, height, pixels, alpha, mask = data
+    image = wx.ImageFromData(width, height, pixels)
+    if alpha:
+        image.SetAlphaData(alpha)
+    if mask:
+        image.SetMaskColour(*mask)
+    return wx.BitmapFromImage(image)
+
+
+def bitmap_pixels(bitmap):
+    """
+    A bitmap's (width, height, pixels, alpha) for png.encode_png; any mask is
+    turned into alpha
+    """
+    image = bitmap.ConvertToImage()
+    if image.HasMask():
+        image.InitAlpha()
+    alpha = image.GetAlphaData() if image.HasAlpha() else None
+    return (image.GetWidth(), image.GetHeight(), image.GetData(), alpha)
+
+
+def estimate_size(obj):
+    """
+    A rough count of the bytes a shape, or a shape's state, holds in memory;
+    used to budget the undo history rather than to be exact
+    """
+    attrs = obj if isinstance(obj, dict) else obj.__dict__
+    size = ATTRIBUTE_BYTES * len(attrs)
+    size += POINT_BYTES * len(attrs.get("points") or ())
+    size += 2 * len(attrs.get("text") or u"")
+
+    image = attrs.get("bitmap")
+    if isinstance(image, wx.Bitmap):
+        size += image.GetWidth() * image.GetHeight() * PIXEL_BYTES
+    return size
+
+#----------------------------------------------------------------------
+
+def refresh_shape(shape):
+    """Re-creates the wx objects of a shape that weren't packed"""
+    shape.make_pen()
+    if isinstance(shape, tools.Text) and not shape.font:
+        shape.restore_font()
+
+
+#----------------------------------------------------------------------
+
+def pack_objects(obj, canvas, level=1):
+    """
+    Packs any structure of shapes, states and undo actions. References to the
+    canvas are replaced by a placeholder, and unpicklable wx objects are
+    dropped; each bitmap is only packed once, however often it's referenced.
+    The default compression level favours speed over size.
+    """
+    bitmaps = []
+    seen = {}
+    shapes = {}
+    stroke_lists = {}  # id: "points" or "time", for pens' lists
+
+    def persistent_id(value):
+        if value is canvas:
+            return ("canvas",)
+        if type(value) is list and id(value) in stroke_lists:
+            if stroke_lists[id(value)] == "points":
+                return ("points", strokes.encode(value, []))
+            return ("time", strokes.encode([], value))
+        if isinstance(value, wx.Bitmap):
+            if id(value) not in seen:
+                seen[id(value)] = len(bitmaps)
+                bitmaps.append(encode_bitmap(value))
+            return ("bitmap", seen[id(value)])
+        if isinstance(value, UNPICKLABLE):
+            return ("none",)
+        if isinstance(value, tools.Tool):
+            shapes[id(value)] = value
+            if isinstance(value, tools.Pen):  # its lists are pickled next
+                stroke_lists[id(value.points)] = "points"
+                stroke_lists[id(value.time)] = "time"
+        return None
+
+    stream = cStringIO.StringIO()
+    pickler = cPickle.Pickler(stream, cPickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = persistent_id
+    pickler.dump(obj)
+    pickler.dump(shapes.values())  # shares the memo: only references shapes
+    return dumps((bitmaps, stream.getvalue()), level)
+
+
+def unpack_objects(data, canvas):
+    """The reverse of pack_objects(), attaching everything to a canvas"""
+    encoded, payload = loads(data)
+    bitmaps = {}
+
+    def persistent_load(pid):
+        if pid[0] == "canvas":
+            return canvas
+        if pid[0] == "bitmap":
+            if pid[1] not in bitmaps:
+                bitmaps[pid[1]] = decode_bitmap(encoded[pid[1]])
+            return bitmaps[pid[1]]
+        if pid[0] == "points":
+            return strokes.decode(pid[1])[0]
+        if pid[0] == "time":
+            return strokes.decode(pid[1])[1]
+        return None
+
+    unpickler = cPickle.Unpickler(cStringIO.StringIO(payload))
+    unpickler.persistent_load = persistent_load
+    obj = unpickler.load()
+    for shape in unpickler.load():
+        refresh_shape(shape)
+    return obj
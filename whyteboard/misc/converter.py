@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+
+"""
+Converts a PDF/PS file into images with one of the rasterizers.py backends, a
+range of pages per process, running as many processes at once as there are CPU
+cores.
+
+Each conversion writes into a directory of its own, so any number can run at
+once, even of the same file. Page N is always written to that directory's
+page-000N.png, whichever process converts it, and is recorded once its
+process ends: the pages are an exact, ordered list, and the directory is never
+listed. Files whose page count can't be read are converted by a single
+process, as a whole; their pages are then looked for by number.
+
+Conversion runs in the background: each page is handed over as soon as its
+range is done, so the first pages can be used while the rest convert. The
+page being viewed, and the one after it, are converted next (see prioritise).
+"""
+
+from __future__ import with_statement
+
+import logging
+import math
+import os
+import re
+import shutil
+import zlib
+
+from multiprocessing import cpu_count
+
+import wx
+
+
+logger = logging.getLogger("whyteboard.converter")
+
+MAX_RANGE = 10  # pages per process; fewer keeps the progress moving
+RANGES_PER_WORKER = 3
+PAGE_NAME = u"page-%04d.png"
+
+PDF_PAGE = re.compile(r"/Type\s*/Page(?![a-zA-Z])")
+PDF_OBJECT_STREAM = re.compile(r"/Type\s*/ObjStm.*?stream\r?\n", re.S)
+PDF_ROOT = re.compile(r"/Root\s+(\d+)\s+\d+\s+R")
+PDF_PAGES = re.compile(r"/Pages\s+(\d+)\s+\d+\s+R")
+PDF_COUNT = re.compile(r"/Count\s+(\d+)")
+PDF_FIRST = re.compile(r"/First\s+(\d+)")
+PS_PAGES = re.compile(r"%%Pages:\s*(\d+)")
+NUMBER = r"\s*(-?[\d.]+)"
+PDF_MEDIA_BOX = re.compile(r"/MediaBox\s*\[" + NUMBER * 4)
+PS_BOUNDING_BOX = re.compile(r"%%BoundingBox:" + NUMBER * 4)
+
+#----------------------------------------------------------------------
+
+def read_file(path):
+    """
+    A file's contents, or None if it can't be read; read once, they can be
+    shared by page_count(), page_size() and the PDF cache's digest
+    """
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except IOError:
+        return None
+
+
+def page_count(path, data=None):
+    """
+    A PDF or PostScript file's number of pages, or None if it can't be told
+    without rendering it - e.g. a PDF whose page objects are compressed.
+    data is the file's contents, if they've been read already
+    """
+    if data is None:
+        data = read_file(path)
+    if data is None:
+        return None
+    if data.startswith("%PDF"):
+        try:
+            packed = packed_objects(data)
+        except (zlib.error, ValueError):
+            return None
+        count = pdf_page_count(data, packed)
+        if count is None and data.count("%%EOF") <= 1:
+            # no page tree to be read, but no incremental updates either:
+            # every page object is one of its pages
+            count = len(PDF_PAGE.findall(data))
+            count += sum(len(PDF_PAGE.findall(text)) for offset, text, objects in packed)
+    else:
+        counts = PS_PAGES.findall(data)  # the last, for "%%Pages: (atend)"
+        count = int(counts[-1]) if counts else 0
+    return count or None
+
+
+def pdf_page_count(data, packed):
+    """
+    The /Count of a PDF's page tree, found from the /Root of its last trailer
+    (or cross-reference stream). Incremental updates append new versions of
+    objects, so their page objects can't just be counted. None if the tree
+    can't be found
+    """
+    roots = PDF_ROOT.findall(data)
+    if not roots:
+        return None
+    catalog = pdf_object(data, int(roots[-1]), packed)
+    pages = catalog and PDF_PAGES.search(catalog)
+    tree = pages and pdf_object(data, int(pages.group(1)), packed)
+    count = tree and PDF_COUNT.search(tree)
+    if not count:
+        return None
+    return int(count.group(1))
+
+
+def pdf_object(data, number, packed):
+    """
+    A PDF object's text, from its last definition in the file or its object
+    streams; None if it isn't defined
+    """
+    found, text = -1, None
+    for match in re.finditer(r"(?<!\d)%i\s+\d+\s+obj\b" % number, data):
+        found = match.start()
+    if found >= 0:
+        start = data.index("obj", found) + 3
+        end = data.find("endobj", start)
+        text = data[start:end if end >= 0 else len(data)]
+    for offset, stream, objects in packed:
+        if offset > found and number in objects:
+            found, text = offset, objects[number]
+    return text
+
+
+def packed_objects(data):
+    """
+    The objects packed in a PDF's object streams (PDF 1.5), as (offset,
+    decompressed text, {number: object's text}) for each stream. Raises
+    zlib.error for a stream that can't be decompressed, or ValueError for one
+    that can't be read
+    """
+    streams = []
+    for match in PDF_OBJECT_STREAM.finditer(data):
+        end = data.find("endstream", match.end())
+        text = zlib.decompressobj().decompress(data[match.end():end])
+        header = data[data.rfind("obj", 0, match.start()):match.end()]
+        first = PDF_FIRST.search(header)
+        objects = {}
+        if first:
+            first = int(first.group(1))
+            pairs = [int(x) for x in text[:first].split()]
+            starts = pairs[1::2]
+            for number, start, end in zip(pairs[::2], starts, starts[1:] + [len(text) - first]):
+                objects[number] = text[first + start:first + end]
+        streams.append((match.start(), text, objects))
+    return streams
+
+
+def page_size(path, data=None):
+    """
+    The (width, height), in points, of a PDF's first MediaBox or a
+    PostScript file's BoundingBox; None if there isn't one to be seen
+    """
+    if data is None:
+        data = read_file(path)
+    if data is None:
+        return None
+    match = (PDF_MEDIA_BOX if data.startswith("%PDF") else PS_BOUNDING_BOX).search(data)
+    if not match:
+        return None
+    x1, y1, x2, y2 = [float(x) for x in match.groups()]
+    return (abs(x2 - x1), abs(y2 - y1))
+
+
+def page_ranges(pages, workers):
+    """Splits pages into (first, last) ranges, a few for each worker"""
+    size = int(math.ceil(pages / float(workers * RANGES_PER_WORKER)))
+    size = max(1, min(MAX_RANGE, size))
+    return [(first, min(first + size, pages) - 1) for first in range(0, pages, size)]
+
+
+def prioritise(ranges, page):
+    """
+    Moves a page and the one after it to the front of a list of ranges, each
+    as a range of its own, splitting the ranges they were in
+    """
+    ranges = list(ranges)
+    for x in (page + 1, page):
+        for index, (first, last) in enumerate(ranges):
+            if first <= x <= last:
+                rest = [(a, b) for a, b in [(first, x - 1), (x + 1, last)] if a <= b]
+                ranges[index:index + 1] = rest
+                ranges.insert(0, (x, x))
+                break
+    return ranges
+
+#----------------------------------------------------------------------
+
+class Converter(wx.EvtHandler):
+    """
+    Runs the convert processes for a file, starting another range as each one
+    ends. directory is the conversion's own, empty, directory; dpi is the
+    pages', if not the quality's. on_page is called with (converter, page,
+    image) as each page is converted, and on_done with the converter once
+    every process has ended
+    """
+    def __init__(self, backend, location, source, quality, directory, pages=None,
+                 workers=0, on_page=None, on_done=None, dpi=None):
+        wx.EvtHandler.__init__(self)
+        self.backend = backend
+        self.location = location  # the backend's program
+        self.source = source
+        self.quality = quality
+        self.dpi = dpi
+        self.directory = directory
+        self.output = os.path.join(directory, PAGE_NAME)
+        self.pages = pages
+        self.converted = {}  # page: its image
+        self.workers = min(workers or cpu_count(), pages or 1)
+        self.jobs = prioritise(page_ranges(pages, self.workers), 0) if pages else [None]
+        self.running = {}  # pid: (process, range)
+        self.on_page = on_page
+        self.on_done = on_done
+        self.dialog = None  # shows the progress; see GUI.convert_dialog
+        self.cancelled = False
+        self.Bind(wx.EVT_END_PROCESS, self.on_end_process)
+
+
+    def start(self):
+        """Starts the first processes; False if none could be started"""
+        logger.info("Converting %s pages with %i processes",
+                    self.pages or "all", self.workers)
+        while self.jobs and len(self.running) < self.workers:
+            self.launch(self.jobs.pop(0))
+        return bool(self.running)
+
+
+    def prioritise(self, page):
+        """Converts a page, and the next, before the other remaining pages"""
+        if self.pages and not self.cancelled:
+            self.jobs = prioritise(self.jobs, page)
+
+
+    def launch(self, pages):
+        process = wx.Process(self)
+        cmd = self.backend.command(self.location, self.quality, self.source,
+                                   self.output, pages, self.dpi)
+        logger.debug("%s command: [%s]", self.backend.label, cmd)
+        pid = wx.Execute(cmd, wx.EXEC_ASYNC, process)
+        if not pid:
+            logger.warning("Couldn't start convert for pages %s", pages)
+            process.Destroy()
+            return
+        self.running[pid] = (process, pages)
+
+
+    def on_end_process(self, event):
+        process, pages = self.running.pop(event.GetPid())
+        process.Destroy()
+        self.backend.collect(self.output, pages)
+        while not self.cancelled and self.jobs and len(self.running) < self.workers:
+            self.launch(self.jobs.pop(0))
+
+        if not self.cancelled:
+            for x in self.written(pages):
+                self.converted[x] = self.output % x
+                if self.on_page:
+                    self.on_page(self, x, self.output % x)
+            if self.dialog and self.pages:
+                self.dialog.set_progress(len(self.converted), self.pages)
+
+        if not self.running:
+            logger.info("Conversion finished: %i of %s pages", len(self.converted), self.pages)
+            if self.dialog:
+                self.dialog.Destroy()
+            if self.on_done:
+                self.on_done(self)
+
+
+    def cancel(self):
+        """Kills every convert process; the dialog closes once they've ended"""
+        self.cancelled = True
+        self.jobs = []
+        for pid in self.running:
+            if os.name == "nt":
+                wx.Kill(pid, wx.SIGKILL)
+            else:
+                wx.Kill(pid)
+
+
+    def written(self, pages):
+        """The pages a process wrote, of its range, or of the whole file"""
+        if pages:
+            return [x for x in range(pages[0], pages[1] + 1)
+                    if os.path.exists(self.output % x)]
+        written = []
+        while os.path.exists(self.output % len(written)):
+            written.append(len(written))
+        return written
+
+
+    def images(self):
+        """The converted pages' files, in page order"""
+        return [self.converted[x] for x in sorted(self.converted)]
+
+
+    def remove_output(self):
+        """Removes the conversion's directory, e.g. once cancelled"""
+        shutil.rmtree(self.directory, True)
@@ -23,6 +23,7 @@ Contains generic functions for the program that are not dependent on any other
 classes, only Python and wx functionality.
 """
 
+import errno
 import os
 import logging
 import random
@@ -37,6 +38,7 @@ from wx.lib.buttons import GenBitmapButton, GenBitmapToggleButton
 from distutils.dir_util import copy_tree, remove_tree
 
 from whyteboard.lib import pub
+from whyteboard.misc.rasterizers import imagemagick_command
 
 _ = wx.GetTranslation
 logger = logging.getLogger("whyteboard.functions")
@@ -80,6 +82,7 @@ def load_image(path, canvas, image_class):
     logger.debug("Loading [%s] and creating an Image object", path)
     image = wx.Bitmap(path)
     shape = image_class(canvas, image, path)
+    canvas.gui.util.keep_image_file(shape, path)
     shape.left_down(0, 0)  # renders, updates scrollbars
     pub.sendMessage('thumbs.update_current')
 
@@ -98,20 +101,12 @@ def get_wx_image_type(filename):
     return types[_name]  # grab the right image type from dict. above
 
 
-def convert_quality(quality, im_location, _file, path):
-    """Returns a string for controlling the convert quality"""
-    density = 200
-    resample = 88
-
-    if quality == 'highest':
-        density = 300
-        resample = 120
-    if quality == 'high':
-        density = 250
-        resample = 100
-    cmd = (u'"%s" -density %i "%s" -resample %i -unsharp 0x.5 -trim +repage -bordercolor white -border 20 "%s"'
-           % (im_location, density, _file, resample, path))
-    
+def convert_quality(quality, im_location, _file, path, scene=None):
+    """
+    Returns a string for controlling the convert quality. scene numbers the
+    output's pages from that number, for a path with a %d in it
+    """
+    cmd = imagemagick_command(im_location, quality, _file, path, scene)
     logger.debug("ImageMagick convert command: [%s]", cmd)
     return cmd
 
@@ -129,6 +124,48 @@ def make_filename():
     return string + u"-temp-%s" % (random.randrange(0, 999999))
 
 
+def replace_file(source, target):
+    """
+    Moves a newly written file over another in one step, once its contents are
+    on disk, so the target is never missing or half-written. Both files must
+    be on the same drive
+    """
+    f = open(source, "r+b")
+    try:
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+
+    if os.name == "nt":
+        import ctypes
+        flags = 0x1 | 0x8  # MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH
+        if not ctypes.windll.kernel32.MoveFileExW(unicode(source), unicode(target), flags):
+            raise ctypes.WinError()
+    else:
+        os.rename(source, target)
+
+
+def process_exists(pid):
+    """Whether a process is running, e.g. the Whyteboard a file belongs to"""
+    if not pid or pid < 0:
+        return False  # kill() would signal a whole process group
+    if os.name == "nt":
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno == errno.EPERM  # someone else's process
+    return True
+
+
 def get_clipboard():
     """
     Gets the clipboard's contents, or False for any valid image/text data
@@ -421,11 +458,11 @@ def show_dialog(_class, modal=True):
     else:
         _class.Show()
         
-def spinctrl(parent, max_value, default_value, event_handler):
+def spinctrl(parent, max_value, default_value, event_handler, min_value=1):
     """
     Creates a spin control with a bound event and a default value
     """
-    spinctrl = wx.SpinCtrl(parent, min=1, max=max_value)
+    spinctrl = wx.SpinCtrl(parent, min=min_value, max=max_value)
     spinctrl.SetValue(default_value)
     spinctrl.Bind(wx.EVT_SPINCTRL, event_handler)
     return spinctrl    
\ No newline at end of file
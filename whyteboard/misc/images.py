@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+"""
+Keeps the images of loaded save files in their encoded form, decoding each one
+into a bitmap only when it's first drawn. Once the decoded bitmaps take up more
+memory than allowed, the least recently used are let go of, to be decoded
+again when they're next needed.
+
+Images encoded this session, to be saved, are kept the same way: the least
+recently used are let go of once over budget, and encoded again if needed.
+"""
+
+import cStringIO
+import logging
+import threading
+
+import wx
+
+from whyteboard.core import Config
+
+logger = logging.getLogger("whyteboard.images")
+
+PIXEL_BYTES = 4
+
+#----------------------------------------------------------------------
+
+class RecentlyUsed(object):
+    """
+    A dictionary that remembers when each key was last set, so that the least
+    recently used can be let go of first (OrderedDict needs Python 2.7)
+    """
+    def __init__(self):
+        self.items = {}  # key: (use, value)
+        self.uses = 0
+
+    def __setitem__(self, key, value):
+        self.uses += 1
+        self.items[key] = (self.uses, value)
+
+    def __getitem__(self, key):
+        return self.items[key][1]
+
+    def pop(self, key, default=None):
+        if key in self.items:
+            return self.items.pop(key)[1]
+        return default
+
+    def keys(self):
+        """Least recently used first"""
+        return sorted(self.items, key=lambda key: self.items[key][0])
+
+    def oldest(self):
+        """The least recently set key"""
+        return min(self.items, key=lambda key: self.items[key][0])
+
+    def pop_oldest(self):
+        key = self.oldest()
+        return key, self.pop(key)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+
+class ImageStore(object):
+    def __init__(self, memory=None):
+        self.memory = memory  # in bytes; defaults to the user's preference
+        self.files = {}  # name in the save file: encoded data
+        self.bitmaps = RecentlyUsed()  # name: bitmap
+        self.used = 0
+
+
+    def budget(self):
+        if self.memory is not None:
+            return self.memory
+        return Config().image_memory() * 1024 * 1024
+
+
+    def add(self, name, data):
+        """Keeps an image's encoded data; nothing is decoded yet"""
+        self.files.setdefault(name, data)
+
+
+    def data(self, name):
+        return self.files.get(name)
+
+
+    def get(self, name):
+        """The decoded bitmap of an image, decoding it if needed"""
+        bitmap = self.bitmaps.pop(name, None)
+        if bitmap is None:
+            bitmap = self.decode(name)
+            self.used += bitmap.GetWidth() * bitmap.GetHeight() * PIXEL_BYTES
+        self.bitmaps[name] = bitmap
+        self.evict()
+        return bitmap
+
+
+    def decode(self, name):
+        logger.debug("Decoding image [%s]", name)
+        data = self.files.get(name)
+        if data is None:
+            logger.warning("Image [%s] isn't in the store", name)
+            return wx.EmptyBitmap(1, 1)
+        return wx.BitmapFromImage(wx.ImageFromStream(cStringIO.StringIO(data)))
+
+
+    def evict(self):
+        """Lets go of bitmaps until within budget, keeping the newest one"""
+        budget = self.budget()
+        while self.used > budget and len(self.bitmaps) > 1:
+            name, bitmap = self.bitmaps.pop_oldest()
+            self.used -= bitmap.GetWidth() * bitmap.GetHeight() * PIXEL_BYTES
+            logger.debug("Evicted decoded image [%s]", name)
+
+
+    def clear(self):
+        self.files = {}
+        self.bitmaps = RecentlyUsed()
+        self.used = 0
+
+
+    def __contains__(self, name):
+        return name in self.files
+
+
+class EncodedImages(object):
+    """
+    Images encoded this session, by a hash of their pixels (see
+    Image.get_digest), with their name in the save file. Autosaves add to it
+    from their worker thread.
+    """
+    def __init__(self, memory=None):
+        self.memory = memory  # in bytes; defaults to the user's preference
+        self.files = RecentlyUsed()  # digest: (name, data)
+        self.names = {}  # name: digest
+        self.used = 0
+        self.lock = threading.RLock()
+
+
+    def budget(self):
+        if self.memory is not None:
+            return self.memory
+        return Config().image_memory() * 1024 * 1024
+
+
+    def add(self, digest, name, data):
+        with self.lock:
+            self.discard(digest)
+            self.files[digest] = (name, data)
+            self.names[name] = digest
+            self.used += len(data)
+            self.evict()
+
+
+    def get(self, digest):
+        """An image's name and encoded data, or None if it's not kept"""
+        with self.lock:
+            image = self.files.pop(digest, None)
+            if image is not None:
+                self.files[digest] = image
+            return image
+
+
+    def data(self, name):
+        with self.lock:
+            digest = self.names.get(name)
+            if digest is None:
+                return None
+            return self.get(digest)[1]
+
+
+    def discard(self, digest):
+        name, data = self.files.pop(digest, (None, ""))
+        self.names.pop(name, None)
+        self.used -= len(data)
+
+
+    def evict(self):
+        """Lets go of images until within budget, keeping the newest one"""
+        budget = self.budget()
+        while self.used > budget and len(self.files) > 1:
+            digest = self.files.oldest()
+            logger.debug("Evicted encoded image [%s]", self.files[digest][0])
+            self.discard(digest)
+
+
+    def __contains__(self, digest):
+        return digest in self.files
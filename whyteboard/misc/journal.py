@@ -0,0 +1,637 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+
+"""
+An append-only journal of the changes made to a document since it was last
+loaded or saved, so that a crash loses at most a second or so of work.
+
+Changes aren't encoded as they're made: the canvas only notes which shapes an
+action touched (see Journal.touch), which costs next to nothing. Once a second
+the touched shapes are written as records (see records.py), along with the
+sheets' shape order, groups, names and sizes if they've changed, and the file
+is fsynced. Saving starts a new journal, as the save file then holds
+everything in it.
+
+The journal sits beside its document, as <file>.journal, or in the recovery
+directory for a document that's never been saved. Its header notes the
+process writing it, so other running Whyteboards leave it alone. After a
+crash, rebuild() replays it over the save file it started from, into a new
+save file that's loaded in the document's place.
+
+Journal layout: MAGIC, then entries of (varint length, CRC-32, payload).
+Reading stops at the first torn or corrupt entry.
+"""
+
+from __future__ import with_statement
+
+import copy
+import cStringIO
+import glob
+import json
+import logging
+import os
+import struct
+import zipfile
+import zlib
+
+import wx
+
+from whyteboard.misc import (get_home_dir, make_filename, meta, png, process_exists,
+                             replace_file)
+from whyteboard.misc import codec, records, utility
+from whyteboard.misc.undo import AddShapeUndo, ShapeUndo
+
+import whyteboard.tools as tools
+
+_ = wx.GetTranslation
+logger = logging.getLogger("whyteboard.journal")
+
+MAGIC = "WBJ\x01"
+SUFFIX = u".journal"
+UNSAVED_FILE = u"journal-%i.wbj"  # by process ID, for documents never saved
+RECOVERED_FILE = u"journal-recovered-%i.wtbd"  # by process ID, as it's then in use
+SYNC_INTERVAL = 1000  # ms between writing out the touched shapes
+
+# entry kinds
+HEADER, SHEETS, SHAPE, ORDER, GROUPS, MEDIAS, IMAGE = range(7)
+CRC = struct.Struct("<I")
+
+#----------------------------------------------------------------------
+
+def action_shapes(action):
+    """The shapes an undo action refers to"""
+    action = getattr(action, "action", None) or action  # a PackedUndo
+    if action is None:
+        return []
+    shapes = [getattr(action, "shape", None)]
+    shapes.extend(getattr(action, "shapes", None) or [])
+    shapes.extend(shape for index, shape in getattr(action, "removed", None) or [])
+    shapes.extend(getattr(action, "old", None) or [])
+    shapes.extend(getattr(action, "new", None) or [])
+    return [shape for shape in shapes if isinstance(shape, tools.Tool)]
+
+
+def signature(filename):
+    """Tells apart versions of the save file a journal starts from"""
+    if not filename or not os.path.exists(filename):
+        return 0
+    stat = os.stat(filename)
+    return int(stat.st_mtime) << 32 | stat.st_size & 0xffffffff
+
+
+def write_entry(out, writer):
+    """Appends an entry, written by a records.Writer, to a file"""
+    payload = writer.getvalue()
+    records.write_varint(out, len(payload))
+    out.write(CRC.pack(zlib.crc32(payload) & 0xffffffff))
+    out.write(payload)
+
+
+def read_entries(data):
+    """Each entry's (kind, reader), up to the first torn or corrupt entry"""
+    if not data.startswith(MAGIC):
+        raise ValueError("Not a journal")
+    reader = records.Reader(data, len(MAGIC))
+    entries = []
+    while reader.offset < len(data):
+        try:
+            length = reader.varint()
+            crc, = CRC.unpack(reader.read(CRC.size))
+            payload = reader.read(length)
+        except (ValueError, TypeError):
+            logger.warning("Journal ends with a torn entry")
+            break
+        if zlib.crc32(payload) & 0xffffffff != crc:
+            logger.warning("Journal entry %i is corrupt", len(entries))
+            break
+        entry = records.Reader(payload)
+        entries.append((entry.varint(), entry))
+    return entries
+
+
+def read_header(path):
+    """A journal's header, or None if it can't be read"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        kind, reader = read_entries(data)[0]
+    except (IOError, ValueError, IndexError):
+        logger.exception("Couldn't read journal [%s]", path)
+        return None
+    if kind != HEADER:
+        return None
+    header = {'document': reader.text(), 'base': reader.text(),
+              'signature': reader.varint(), 'sheets': bool(reader.varint()),
+              'settings': json.loads(reader.text()), 'pid': 0}
+    if reader.offset < len(reader.data):  # older journals didn't note it
+        header['pid'] = reader.varint()
+    return header
+
+
+def write_shapes(writer, shapes):
+    writer.varint(len(shapes))
+    for shape in shapes:
+        writer.text(type(shape).__name__)
+        records.write_shape(writer, shape, {type(shape).__name__: 0})
+
+
+def read_shapes(reader):
+    shapes = []
+    for x in range(reader.varint()):
+        name = reader.text()
+        if name not in records.TYPES:
+            raise ValueError("Unknown shape type %r" % name)
+        shapes.append(records.read_shape(reader, [records.TYPES[name]]))
+    return shapes
+
+#----------------------------------------------------------------------
+
+
+class Journal(object):
+    def __init__(self, gui):
+        self.gui = gui
+        self.util = gui.util
+        self.file = None
+        self.path = None
+        self.timer = wx.Timer(gui)
+        gui.Bind(wx.EVT_TIMER, self.on_timer, self.timer)
+        self.start()
+
+
+    def start(self):
+        """
+        Begins a new journal, once a document has been loaded or saved. The
+        file's only created once there's something to write
+        """
+        self.discard()
+        self.document = self.util.filename
+        self.base = self.util.source if self.util.source and os.path.exists(self.util.source) else None
+        self.images = set()  # in the base file, or written to the journal
+        self.has_sheets = False
+        if self.base:
+            self.read_base()
+
+        self.ids = {}  # canvas: sheet ID, its position in the base file
+        self.known = {}  # canvas: uids of its shapes as the journal has them
+        self.groups = {}  # canvas: its groups as the journal has them
+        self.touched = {}  # canvas: [shapes to write, order or medias changed]
+        self.recent = {}  # shape: the entry last written for it, see write_recent
+        self.changed = False
+        if self.has_sheets:
+            for x, canvas in enumerate(self.gui.get_canvases()):
+                self.ids[canvas] = x
+                self.groups[canvas] = list(canvas.groups)
+                if canvas not in self.util.pending:
+                    self.known[canvas] = set(shape.uid for shape in canvas.shapes)
+        self.next_id = len(self.ids)
+        self.sheets = self.sheet_list()
+        self.timer.Start(SYNC_INTERVAL)
+
+
+    def read_base(self):
+        """What the journal needn't repeat from the file it starts from"""
+        try:
+            _zip = zipfile.ZipFile(self.base)
+        except (IOError, zipfile.BadZipfile):
+            logger.exception("Can't read [%s]; journalling every sheet", self.base)
+            return
+        names = _zip.namelist()
+        self.images = set(name[5:] for name in names if name.startswith(u"data/"))
+        self.has_sheets = utility.MANIFEST in names
+        _zip.close()
+
+
+    def stop(self):
+        """Stops journalling the document, which is being closed"""
+        self.timer.Stop()
+        self.discard()
+
+
+    def discard(self):
+        """Deletes the journal, once it's no longer needed"""
+        if self.file:
+            self.file.close()
+            self.file = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+
+    def journal_path(self):
+        if self.document:
+            return self.document + SUFFIX
+        return os.path.join(get_home_dir(u"recovery"), UNSAVED_FILE % os.getpid())
+
+    #----------------------------------------------------------------------
+
+    def touch(self, canvas, action=None, performed=False):
+        """
+        Notes the shapes a change affects, to be written on the next flush:
+        usually an undo action as it's added, or once it's been performed
+        (undone or redone). Without an action, the sheet's order, groups and
+        medias are written again
+        """
+        shapes = action_shapes(action)
+        if canvas not in self.known:
+            ignore = set(shape.uid for shape in shapes)
+            self.known[canvas] = set(shape.uid for shape in canvas.shapes
+                                     if shape.uid not in ignore)
+
+        entry = self.touched.setdefault(canvas, [set(), False])
+        entry[0].update(shapes)
+        if performed or not isinstance(action, (AddShapeUndo, ShapeUndo)):
+            entry[1] = True
+        if isinstance(action, ShapeUndo) and not performed:
+            self.recent = dict((shape, None) for shape in shapes)
+        self.changed = True
+
+
+    def sheet_list(self):
+        """Each sheet's (ID, name, width, height), in order"""
+        sheets = []
+        for canvas, name in zip(self.gui.get_canvases(), self.gui.get_tab_names()):
+            if canvas not in self.ids:
+                self.ids[canvas] = self.next_id
+                self.next_id += 1
+                self.known[canvas] = set()
+                self.groups[canvas] = None
+                self.touched.setdefault(canvas, [set(), True])
+            sheets.append((self.ids[canvas], name, canvas.area[0], canvas.area[1]))
+        return sheets
+
+
+    def on_timer(self, event=None):
+        if self.gui.canvas and self.gui.canvas.HasCapture():
+            return  # mid-stroke; the shape's not finished
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Couldn't write to the journal; stopping it")
+            self.timer.Stop()
+
+
+    def flush(self):
+        """
+        Writes the touched shapes and changed sheets, then fsyncs. Nothing's
+        written until the document's first changed
+        """
+        out = cStringIO.StringIO()
+        sheets = self.sheet_list()
+        if sheets != self.sheets:
+            self.sheets = sheets
+            self.changed = True
+            write_entry(out, self.sheets_entry())
+        if not self.changed:
+            return
+
+        canvases = self.gui.get_canvases()
+        for canvas, (shapes, reorder) in self.touched.items():
+            if canvas in canvases and canvas not in self.util.pending:
+                self.write_canvas(out, canvas, shapes, reorder)
+        self.touched = {}
+        self.write_recent(out)
+
+        data = out.getvalue()
+        if not data:
+            return
+        if not self.file:
+            self.create()
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+
+    def create(self):
+        self.path = self.journal_path()
+        logger.debug("Starting journal [%s]", self.path)
+        self.file = open(self.path, "wb")
+        self.file.write(MAGIC)
+
+        header = records.Writer()
+        header.varint(HEADER)
+        header.text(self.document)
+        header.text(self.base)
+        header.varint(signature(self.base))
+        header.varint(self.has_sheets)
+        settings = utility.manifest_settings(self.util, self.gui.current_tab, meta.version)
+        header.text(json.dumps(settings))
+        header.varint(os.getpid())
+        write_entry(self.file, header)
+        write_entry(self.file, self.sheets_entry())
+
+
+    def sheets_entry(self):
+        entry = records.Writer()
+        entry.varint(SHEETS)
+        entry.varint(len(self.sheets))
+        for _id, name, width, height in self.sheets:
+            entry.varint(_id)
+            entry.text(name)
+            entry.varint(width)
+            entry.varint(height)
+        return entry
+
+
+    def write_canvas(self, out, canvas, shapes, reorder):
+        """
+        Writes the touched shapes that are still on the sheet, and any the
+        journal doesn't have yet (e.g. restored by undoing a deletion); then
+        the shape order if it's changed, which drops any removed shapes
+        """
+        _id = self.ids[canvas]
+        known = self.known[canvas]
+        for index, shape in enumerate(canvas.shapes):
+            if shape in shapes or shape.uid not in known:
+                self.write_shape(out, _id, index, shape)
+                known.add(shape.uid)
+
+        if reorder:
+            entry = records.Writer()
+            entry.varint(ORDER)
+            entry.varint(_id)
+            entry.varint(len(canvas.shapes))
+            for shape in canvas.shapes:
+                entry.varint(shape.uid)
+            write_entry(out, entry)
+            self.known[canvas] = set(shape.uid for shape in canvas.shapes)
+
+            entry = records.Writer()
+            entry.varint(MEDIAS)
+            entry.varint(_id)
+            write_shapes(entry, canvas.medias)
+            write_entry(out, entry)
+
+        if canvas.groups != self.groups.get(canvas):
+            self.groups[canvas] = list(canvas.groups)
+            entry = records.Writer()
+            entry.varint(GROUPS)
+            entry.varint(_id)
+            entry.varint(len(canvas.groups))
+            for group in canvas.groups:
+                entry.varint(len(group))
+                for uid in group:
+                    entry.varint(uid)
+            write_entry(out, entry)
+
+
+    def shape_entry(self, out, _id, index, shape):
+        if isinstance(shape, tools.Image):
+            shape = self.image_copy(out, shape)
+        entry = records.Writer()
+        entry.varint(SHAPE)
+        entry.varint(_id)
+        entry.varint(index)
+        write_shapes(entry, [shape])
+        return entry
+
+
+    def write_shape(self, out, _id, index, shape):
+        entry = self.shape_entry(out, _id, index, shape)
+        write_entry(out, entry)
+        if shape in self.recent:
+            self.recent[shape] = entry.getvalue()
+
+
+    def write_recent(self, out):
+        """
+        Writes the shapes of the latest change again if they've changed since:
+        its undo point is made before the change, which may not be finished
+        when the shapes are first written (e.g. while a dialog is open)
+        """
+        for shape, written in self.recent.items():
+            canvas = shape.canvas
+            if written is None or canvas not in self.ids or shape not in canvas.shapes:
+                continue
+            index = canvas.shapes.index(shape)
+            entry = self.shape_entry(out, self.ids[canvas], index, shape)
+            if entry.getvalue() != written:
+                write_entry(out, entry)
+                self.recent[shape] = entry.getvalue()
+
+
+    def image_copy(self, out, shape):
+        """
+        An image shape naming the file its image is saved as. Images that
+        aren't in the base file are written to the journal, once
+        """
+        clone = shape
+        name = shape.filename
+        if name not in self.images:
+            data = None
+            digest = shape.get_digest()
+            image = self.util.image_files.get(digest)
+            if image:
+                name, data = image
+            elif name and name in self.util.images:
+                data = self.util.images.data(name)
+            if data is None:
+                name = make_filename() + u".png"
+                data = png.encode_png(*codec.bitmap_pixels(shape.image))
+                self.util.image_files.add(digest, name, data)
+
+            entry = records.Writer()
+            entry.varint(IMAGE)
+            entry.text(name)
+            entry.varint(len(data))
+            entry.out.write(data)
+            write_entry(out, entry)
+            self.images.add(name)
+
+        if name != shape.filename:
+            clone = copy.copy(shape)
+            clone.filename = name
+        return clone
+
+    #----------------------------------------------------------------------
+
+    def find(self):
+        """
+        Journals left behind by Whyteboards that didn't close properly, newest
+        first; not those of Whyteboards that are still running
+        """
+        paths = glob.glob(os.path.join(get_home_dir(u"recovery"), u"journal-*.wbj"))
+        for x in range(self.gui.filehistory.GetCount()):
+            path = self.gui.filehistory.GetHistoryFile(x) + SUFFIX
+            if os.path.exists(path):
+                paths.append(path)
+
+        found = []
+        for path in paths:
+            header = read_header(path)
+            if path != self.path and not (header and process_exists(header['pid'])):
+                found.append(path)
+        found.sort(key=os.path.getmtime, reverse=True)
+        return found
+
+
+    def recover(self):
+        """
+        Offers to rebuild each crashed document in turn, newest first, until
+        one is recovered. Declined journals are deleted; one that can't be
+        replayed is kept, and offered again next time. Returns whether a
+        document was recovered
+        """
+        paths = self.find()
+        if paths:
+            logger.info("Found journals %s", paths)
+        target = os.path.join(get_home_dir(u"recovery"), RECOVERED_FILE % os.getpid())
+
+        for path in paths:
+            header = read_header(path)
+            name = _("an unsaved document")
+            if header and header['document']:
+                name = os.path.basename(header['document'])
+
+            answer = wx.MessageBox(_("Whyteboard didn't close properly last time.\n"
+                                     "Would you like to recover your unsaved work on %s?") % name,
+                                   u"Whyteboard", wx.YES_NO | wx.ICON_QUESTION)
+            if answer != wx.YES:
+                os.remove(path)
+                continue
+            try:
+                document = rebuild(path, target)
+            except Exception:
+                logger.exception("Journal [%s] couldn't be replayed", path)
+                wx.MessageBox(_("Your work on %s couldn't be recovered.") % name, u"Whyteboard")
+                continue
+
+            os.remove(path)
+            self.util.load_wtbd(target)
+            self.util.filename = document
+            self.gui.mark_unsaved()
+            self.start()
+            return True
+        return False
+
+#----------------------------------------------------------------------
+
+
+def read_base(header):
+    """The sheets of the save file a journal starts from, by ID"""
+    sheets = {}
+    if not header['base']:
+        return sheets, None
+    if signature(header['base']) != header['signature']:
+        raise ValueError("[%s] has changed since the journal began" % header['base'])
+
+    _zip = zipfile.ZipFile(header['base'])
+    if not header['sheets']:
+        return sheets, _zip
+
+    manifest = utility.parse_manifest(_zip)
+    for x, sheet in enumerate(manifest['sheets']):
+        data = records.loads(_zip.read(utility.SHEET_CHUNK % x))
+        shapes = data['shapes']
+        groups = [set(shapes[i].uid for i in group if i < len(shapes))
+                  for group in data['groups']]
+        sheets[x] = {'name': sheet['name'], 'size': tuple(sheet['size']),
+                     'shapes': shapes, 'medias': data['medias'], 'groups': groups}
+    return sheets, _zip
+
+
+def replay(entries, sheets):
+    """Applies a journal's entries to its base file's sheets"""
+    order = sorted(sheets)
+    images = {}
+    for kind, reader in entries:
+        if kind == SHEETS:
+            order = []
+            for x in range(reader.varint()):
+                _id, name = reader.varint(), reader.text()
+                sheet = sheets.setdefault(_id, {'shapes': [], 'medias': [], 'groups': []})
+                sheet['name'] = name
+                sheet['size'] = (reader.varint(), reader.varint())
+                order.append(_id)
+
+        elif kind == SHAPE:
+            shapes = sheets[reader.varint()]['shapes']
+            index = reader.varint()
+            shape = read_shapes(reader)[0]
+            shapes[:] = [x for x in shapes if getattr(x, "uid", None) != shape.uid]
+            shapes.insert(index, shape)
+
+        elif kind == ORDER:
+            sheet = sheets[reader.varint()]
+            uids = dict((getattr(x, "uid", None), x) for x in sheet['shapes'])
+            sheet['shapes'] = [uids[uid] for uid in
+                               [reader.varint() for x in range(reader.varint())]
+                               if uid in uids]
+
+        elif kind == GROUPS:
+            sheet = sheets[reader.varint()]
+            sheet['groups'] = [set(reader.varint() for y in range(reader.varint()))
+                               for x in range(reader.varint())]
+
+        elif kind == MEDIAS:
+            sheet = sheets[reader.varint()]
+            sheet['medias'] = read_shapes(reader)
+
+        elif kind == IMAGE:
+            name = reader.text()
+            images[name] = reader.read(reader.varint())
+    return [sheets[_id] for _id in order], images
+
+
+def rebuild(path, target):
+    """
+    Replays a journal over the save file it started from, writing the result
+    to target as an ordinary save file. Returns the journal's document name
+    """
+    header = read_header(path)
+    if not header:
+        raise ValueError("[%s] has no header" % path)
+    with open(path, "rb") as f:
+        entries = read_entries(f.read())[1:]
+
+    base, source = read_base(header)
+    sheets, images = replay(entries, base)
+    logger.debug("Replayed %i journal entries over %i sheets", len(entries), len(sheets))
+
+    compression = utility.Compression()
+    tmp_file = target + u".tmp"
+    _zip = zipfile.ZipFile(tmp_file, "w")
+    written = set()
+    for name, data in images.items():
+        _zip.writestr(u"data/" + name, data)
+        written.add(u"data/" + name)
+    if source:
+        for name in source.namelist():
+            if name.startswith(u"data/") and name not in written:
+                utility.copy_member(source, name, _zip)
+        source.close()
+
+    manifest = dict(header['settings'], sheets=[], filename=header['document'])
+    for x, sheet in enumerate(sheets):
+        positions = dict((shape.uid, i) for i, shape in enumerate(sheet['shapes']))
+        groups = [sorted(positions[uid] for uid in group if uid in positions)
+                  for group in sheet['groups']]
+        compression.write(_zip, utility.SHEET_CHUNK % x, compression.chunk(
+            {'shapes': sheet['shapes'], 'medias': sheet['medias'],
+             'groups': [group for group in groups if len(group) > 1]}))
+        manifest['sheets'].append({'name': sheet['name'], 'size': sheet['size'],
+                                   'shapes': len(sheet['shapes']), 'thumbnail': None,
+                                   'images': sorted(set(shape.filename for shape in sheet['shapes']
+                                                        if isinstance(shape, tools.Image)
+                                                        and shape.filename))})
+    compression.write(_zip, utility.MANIFEST, json.dumps(manifest))
+    _zip.close()
+    replace_file(tmp_file, target)
+    return header['document']
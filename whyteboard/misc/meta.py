@@ -124,6 +124,16 @@ print_title = boolean(default=True)
 statusbar = boolean(default=True)
 tool_preview = boolean(default=True)
 toolbar = boolean(default=True)
+undo_limit = integer(min=1, max=10000, default=250)
+undo_memory = integer(min=1, max=4096, default=32)
+undo_save_depth = integer(min=0, max=10000, default=100)
+save_workers = integer(min=0, max=64, default=0)
+image_memory = integer(min=16, max=8192, default=256)
+autosave_interval = integer(min=0, max=120, default=5)
+save_compression = integer(min=0, max=9, default=6)
+fast_save = boolean(default=False)
+pdf_cache_size = integer(min=16, max=65536, default=1024)
+pdf_backend = option('auto', 'poppler', 'ghostscript', 'imagemagick', default='auto')
 """
 config_scheme = config_scheme.split("\n")
 
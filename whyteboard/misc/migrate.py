@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+
+"""
+Converts every .wtbd file under a directory, written by an older version, to
+the current format, without loading anything into the GUI. Run from the
+command line with --migrate DIR.
+
+Two generations of file are converted (see utility.py): a single pickle,
+possibly written in text mode, and a zip holding that pickle as save.data.
+Files with a manifest are already current. Files are converted in parallel, by a pool of worker processes - unpickling is CPU-bound.
+
+Each file is converted into <file>.tmp, and read back: its sheets must have the
+same number of each kind of shape, media and group, and every image, before
+it replaces the file. The original is kept as <file>.bak, unless told not to.
+The outcome for every file is written to a CSV report in the directory.
+
+Only migrate files you trust: their pickles have to be unpickled.
+"""
+
+from __future__ import with_statement
+
+import csv
+import json
+import logging
+import multiprocessing
+import ntpath
+import os
+import shutil
+import time
+import zipfile
+import zlib
+
+from whyteboard.misc import meta, records, replace_file
+from whyteboard.misc.utility import (CORRUPT_PICKLE, MANIFEST, SHEET_CHUNK,
+                                     Compression, parse_manifest,
+                                     unpickle_save)
+
+import whyteboard.tools as tools
+
+logger = logging.getLogger("whyteboard.migrate")
+
+REPORT = u"migration-report.csv"
+BACKUP = u".bak"
+COLUMNS = ["file", "format", "status", "sheets", "shapes", "bytes before",
+           "bytes after", "seconds", "message"]
+
+# formats
+PICKLE, TEXT_PICKLE, ZIPPED_PICKLE, CURRENT = (
+    u"pickle", u"text pickle", u"zipped pickle", u"current")
+
+# outcomes
+CONVERTED, SKIPPED, FAILED = u"converted", u"up to date", u"failed"
+
+#----------------------------------------------------------------------
+
+class MigrationError(Exception):
+    pass
+
+
+def find_saves(directory):
+    """Every .wtbd file under a directory, in order"""
+    found = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        found.extend(os.path.join(root, name) for name in sorted(files)
+                     if name.lower().endswith(u".wtbd"))
+    return found
+
+
+def sheet_summary(sheet):
+    """What verification compares: counts of each shape kind, medias, groups"""
+    kinds = {}
+    for shape in sheet['shapes']:
+        kinds[type(shape).__name__] = kinds.get(type(shape).__name__, 0) + 1
+    return (sorted(kinds.items()), len(sheet['medias']), len(sheet['groups']))
+
+
+def prepare_shape(shape):
+    """
+    Gives a pickled shape what Tool.load() would: attributes added since it was
+    saved, and a uid. Images of the oldest saves only have a path; they're named
+    after it, as Image.load() does
+    """
+    tools.Tool.load(shape)
+    if isinstance(shape, tools.Pen) and not hasattr(shape, "time"):
+        shape.time = []
+    if isinstance(shape, tools.Image) and not getattr(shape, "filename", None):
+        shape.filename = ntpath.basename(shape.path)  # either separator
+
+
+#----------------------------------------------------------------------
+
+def read_pickle(filename):
+    """
+    A single-pickle file's save data, whether zipped (as save.data) or not, and
+    its format
+    """
+    try:
+        _zip = zipfile.ZipFile(filename)
+    except zipfile.BadZipfile:
+        save_data, text = unpickle_save(filename)
+        return save_data, TEXT_PICKLE if text else PICKLE, None
+    try:
+        data = _zip.read("save.data")
+    except KeyError:
+        _zip.close()
+        raise MigrationError("missing save.data")
+    return unpickle_save(filename, data)[0], ZIPPED_PICKLE, _zip
+
+
+def pickle_sheets(save_data, default_size):
+    """A single pickle's sheets, as {'name', 'size', 'shapes', 'medias', 'groups'}"""
+    names, sizes = save_data[3], save_data.get(4, {})
+    medias, groups = save_data.get(5, {}), save_data.get(6, {})
+    sheets = []
+    for x in sorted(save_data[1]):
+        try:
+            size = tuple(sizes[x])
+        except (KeyError, IndexError):
+            size = default_size
+        sheet = {'name': names[x], 'size': size,
+                 'shapes': save_data[1][x], 'medias': medias.get(x, []),
+                 'groups': groups.get(x, [])}
+        for shape in sheet['shapes'] + sheet['medias']:
+            prepare_shape(shape)
+        sheets.append(sheet)
+    return sheets
+
+
+def pickle_images(sheets, source):
+    """
+    The image files that the sheets' shapes use, as {name: data}, and the
+    names of any that are missing. Zipped saves hold their images; the oldest
+    saves refer to them on disk, where they're read from, and renamed if two
+    images share a name
+    """
+    images, missing, paths = {}, [], {}
+    for sheet in sheets:
+        for shape in sheet['shapes']:
+            if not isinstance(shape, tools.Image):
+                continue
+            if source:
+                if shape.filename in images:
+                    continue
+                try:
+                    images[shape.filename] = source.read(u"data/" + shape.filename)
+                except KeyError:
+                    missing.append(shape.filename)
+                continue
+
+            if shape.path in paths:
+                shape.filename = paths[shape.path]
+                continue
+            name = shape.filename
+            while name in images:
+                base, ext = os.path.splitext(shape.filename)
+                name = u"%s-%i%s" % (base, len(images), ext)
+            try:
+                with open(shape.path, "rb") as f:
+                    images[name] = f.read()
+                shape.filename = paths[shape.path] = name
+            except (IOError, TypeError):
+                missing.append(shape.path)
+    return images, missing
+
+
+def write_pickle(target, save_data, sheets, images, compression):
+    """Writes a single pickle's contents in the current format"""
+    settings = save_data[0]
+    font = settings[5] if len(settings) > 5 else None
+    manifest = {'version': meta.version, 'colour': records.colour_ints(settings[0]),
+                'thickness': settings[1], 'tool': settings[2], 'tab': settings[3],
+                'font': font,
+                'sheets': [{'name': sheet['name'], 'size': sheet['size'],
+                            'shapes': len(sheet['shapes']),
+                            'images': sorted(set(shape.filename for shape in sheet['shapes']
+                                                 if isinstance(shape, tools.Image))),
+                            'thumbnail': None}  # made once it's opened
+                           for sheet in sheets]}
+
+    _zip = zipfile.ZipFile(target, "w")
+    try:
+        compression.write(_zip, MANIFEST, json.dumps(manifest))
+        for x, sheet in enumerate(sheets):
+            compression.write(_zip, SHEET_CHUNK % x, compression.chunk(sheet))
+        for name, data in sorted(images.items()):
+            compression.write(_zip, u"data/" + name, data)
+    finally:
+        _zip.close()
+
+
+def detect(filename):
+    """Which of the formats (see above) a save file is in"""
+    try:
+        _zip = zipfile.ZipFile(filename)
+    except zipfile.BadZipfile:
+        return PICKLE  # or TEXT_PICKLE, found once it's read
+    try:
+        if parse_manifest(_zip) is None:
+            return ZIPPED_PICKLE
+        return CURRENT
+    finally:
+        _zip.close()
+
+
+def convert(filename, target, kind, compression, default_size):
+    """
+    Writes a save file in the current format into target. Returns its format,
+    the summaries of its sheets and the images it's missing
+    """
+    save_data, kind, source = read_pickle(filename)
+    try:
+        sheets = pickle_sheets(save_data, default_size)
+        images, missing = pickle_images(sheets, source)
+    finally:
+        if source:
+            source.close()
+    write_pickle(target, save_data, sheets, images, compression)
+    return kind, [sheet_summary(sheet) for sheet in sheets], missing
+
+
+def verify(target, summaries, missing):
+    """
+    Reads a converted file back, checking that its sheets match the summaries
+    of the originals and that it has their images. Returns its shape count
+    """
+    _zip = zipfile.ZipFile(target)
+    try:
+        corrupt = _zip.testzip()
+        if corrupt:
+            raise MigrationError("%s is corrupt once written" % corrupt)
+        manifest = parse_manifest(_zip)
+        if len(manifest['sheets']) != len(summaries):
+            raise MigrationError("has %i sheets once converted, not %i"
+                                 % (len(manifest['sheets']), len(summaries)))
+        names = set(_zip.namelist())
+        count = 0
+        for x, summary in enumerate(summaries):
+            sheet = records.loads(_zip.read(SHEET_CHUNK % x))
+            if sheet_summary(sheet) != summary or manifest['sheets'][x]['shapes'] != len(sheet['shapes']):
+                raise MigrationError("sheet %i has different shapes once converted" % (x + 1))
+            for shape in sheet['shapes']:
+                if (isinstance(shape, tools.Image) and u"data/" + shape.filename not in names
+                    and shape.filename not in missing and shape.path not in missing):
+                    raise MigrationError("image %s is lost once converted" % shape.filename)
+            count += len(sheet['shapes'])
+        return count
+    finally:
+        _zip.close()
+
+#----------------------------------------------------------------------
+
+def migrate_file(filename, level=6, fast=False, backup=True, default_size=(640, 480)):
+    """
+    Converts one save file in place, if it's not up to date; level and fast are
+    as Compression's. Never raises: returns the file's row of the report
+    """
+    start = time.time()
+    result = dict((column, 0) for column in COLUMNS)
+    result.update({'file': filename, 'format': u"", 'status': FAILED, 'message': u"",
+                   'bytes before': os.path.getsize(filename)})
+    target = filename + u".tmp"
+    try:
+        result['format'] = detect(filename)
+        if result['format'] == CURRENT:
+            result['status'] = SKIPPED
+        else:
+            kind, summaries, missing = convert(filename, target, result['format'],
+                                               Compression(level, fast), default_size)
+            result['format'] = kind
+            result['shapes'] = verify(target, summaries, missing)
+            result['sheets'] = len(summaries)
+            if backup:
+                shutil.copy2(filename, filename + BACKUP)
+            replace_file(target, filename)
+            result['status'] = CONVERTED
+            result['bytes after'] = os.path.getsize(filename)
+            if missing:
+                result['message'] = u"missing images: " + u", ".join(missing)
+    except CORRUPT_PICKLE + (MigrationError, EnvironmentError, zipfile.BadZipfile,
+                             KeyError, IndexError, zlib.error), e:
+        logger.exception("Couldn't migrate [%s]", filename)
+        result['message'] = u"%s: %s" % (type(e).__name__, e)
+        if os.path.exists(target):
+            os.remove(target)
+    result['seconds'] = time.time() - start
+    return result
+
+
+def _migrate(job):
+    return migrate_file(*job)
+
+
+def migrate_directory(directory, workers=0, level=6, fast=False, backup=True,
+                      default_size=(640, 480), callback=None):
+    """
+    Migrates every save file under a directory across a pool of processes;
+    workers is their number, 0 meaning one per core. callback is given each
+    file's result as it's done. Writes the report, and returns the results in
+    the order of the files
+    """
+    files = find_saves(directory)
+    jobs = [(filename, level, fast, backup, default_size) for filename in files]
+    workers = min(workers or multiprocessing.cpu_count(), len(jobs))
+    logger.info("Migrating %i files under [%s] with %i workers", len(jobs), directory, workers)
+
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        done = pool.imap_unordered(_migrate, jobs)
+    else:
+        done = (_migrate(job) for job in jobs)
+
+    results = {}
+    try:
+        for result in done:
+            results[result['file']] = result
+            if callback:
+                callback(result)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    results = [results[filename] for filename in files]
+    write_report(os.path.join(directory, REPORT), results)
+    return results
+
+
+def write_report(path, results):
+    with open(path, "wb") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for result in results:
+            row = []
+            for column in COLUMNS:
+                value = result[column]
+                if isinstance(value, float):
+                    value = "%.3f" % value
+                elif isinstance(value, unicode):
+                    value = value.encode("utf-8")
+                row.append(value)
+            writer.writerow(row)
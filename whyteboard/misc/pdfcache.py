@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+
+"""
+A cache of converted PDF/PS files, so that a file is only converted once per
+quality. It's an SQLite database in the user's home directory, indexed so a
+lookup doesn't read the rest of the cache.
+
+Entries are keyed by a hash of the file's contents and the quality: a renamed
+or copied file is still found, and a changed one isn't. So that a file isn't
+hashed on every lookup, entries also keep the path, size and modification time
+the file last had; a file that still matches them is known without hashing.
+
+The converted images are only kept up to a disk budget (the pdf_cache_size
+preference): the least recently used entries are removed, with their images,
+to make room. An entry whose images have gone is removed once it's looked up.
+"""
+
+from __future__ import with_statement
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from whyteboard.core import Config
+from whyteboard.misc import get_home_dir
+
+logger = logging.getLogger("whyteboard.pdfcache")
+
+CACHE_FILE = u"pdfcache.db"  # in the home directory
+LEGACY_FILE = u"library.known"  # the pickled dictionary it replaces
+HASH_BLOCK = 1024 * 1024
+NEXT_USE = "(SELECT COALESCE(MAX(used), 0) + 1 FROM entries)"  # an LRU clock
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY, digest TEXT NOT NULL,
+                                    quality TEXT NOT NULL, file TEXT NOT NULL,
+                                    size INTEGER, mtime REAL, images TEXT NOT NULL,
+                                    bytes INTEGER NOT NULL, created REAL, used INTEGER,
+                                    UNIQUE (digest, quality));
+CREATE INDEX IF NOT EXISTS entries_file ON entries (file, size, mtime, quality);
+CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+#----------------------------------------------------------------------
+
+def file_digest(path, data=None):
+    """
+    A hash of a file's contents, read in blocks; or of data, the contents if
+    they've been read already
+    """
+    if data is not None:
+        return hashlib.sha1(data).hexdigest()
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), ""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def remove_images(images):
+    """Deletes images, and their conversion's directory once it's empty"""
+    for image in images:
+        try:
+            os.remove(image)
+        except OSError:
+            pass
+    for directory in set(os.path.dirname(image) for image in images):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass
+
+#----------------------------------------------------------------------
+
+class PDFCache(object):
+    """
+    Represents a cache of any converted PDF files
+    """
+    def __init__(self, filename=None, budget=None):
+        self.path = filename or os.path.join(get_home_dir(), CACHE_FILE)
+        self.budget = budget  # in bytes; defaults to the user's preference
+        self.known = {}  # (path, size, mtime): digest, of files hashed
+        logger.debug("Using PDF cache at [%s]", self.path)
+        try:
+            self.db = self.connect()
+        except sqlite3.DatabaseError:
+            logger.exception("PDF cache is corrupt - creating it again")
+            os.remove(self.path)
+            self.db = self.connect()
+
+        legacy = os.path.join(os.path.dirname(self.path), LEGACY_FILE)
+        if os.path.exists(legacy):
+            self.import_legacy(legacy)
+
+
+    def connect(self):
+        db = sqlite3.connect(self.path)
+        db.row_factory = sqlite3.Row
+        db.executescript(SCHEMA)
+        return db
+
+
+    def import_legacy(self, legacy):
+        """Moves the entries of the old, pickled cache whose files still exist"""
+        logger.info("Importing the old PDF cache [%s]", legacy)
+        try:
+            with open(legacy) as f:
+                files = pickle.load(f)
+        except Exception:
+            logger.exception("Couldn't read the old PDF cache")
+            files = {}
+
+        for entry in files.values():
+            try:
+                if os.path.exists(entry['file']) and not self.missing(entry['images']):
+                    self.write(entry['file'], entry['images'], entry['quality'])
+            except (KeyError, EnvironmentError):
+                logger.exception("Couldn't import PDF cache entry %s", entry)
+        os.remove(legacy)
+
+
+    def get_budget(self):
+        if self.budget is not None:
+            return self.budget
+        return Config().pdf_cache_size() * 1024 * 1024
+
+
+    def identify(self, _file, data=None):
+        """
+        A file's (digest, size, mtime). The file's only hashed if no entry
+        knows it by its current path, size and modification time; data is
+        its contents, if they've been read already
+        """
+        stat = os.stat(_file)
+        key = (_file, stat.st_size, stat.st_mtime)
+        if key not in self.known:
+            row = self.db.execute("SELECT digest FROM entries WHERE file = ? AND size = ? "
+                                  "AND mtime = ? LIMIT 1", key).fetchone()
+            self.known[key] = row['digest'] if row else file_digest(_file, data)
+        return self.known[key], stat.st_size, stat.st_mtime
+
+
+    def missing(self, images):
+        return [image for image in images if not os.path.exists(image)]
+
+
+    def lookup(self, _file, quality, data=None):
+        """
+        The converted images of a file at a quality, or False. Updates the
+        entry's path (the file may have moved) and when it was last used
+        """
+        digest, size, mtime = self.identify(_file, data)
+        row = self.db.execute("SELECT id, images FROM entries WHERE digest = ? AND quality = ?",
+                              (digest, quality)).fetchone()
+        images = json.loads(row['images']) if row else None
+
+        with self.db:
+            if row and self.missing(images):
+                logger.info("Cached images of [%s] have gone - removing entry", _file)
+                self.remove([row['id']])
+                row = None
+            if not row:
+                self.count("misses")
+                return False
+
+            self.count("hits")
+            self.db.execute("UPDATE entries SET file = ?, size = ?, mtime = ?, used = %s "
+                            "WHERE id = ?" % NEXT_USE, (_file, size, mtime, row['id']))
+        return images
+
+
+    def write(self, location, images, quality):
+        """Adds a newly converted file to the library"""
+        logger.debug("Adding [%s] at [%s] quality to cache", os.path.basename(location), quality)
+        digest, size, mtime = self.identify(location)
+        total = sum(os.path.getsize(image) for image in images if os.path.exists(image))
+        row = self.db.execute("SELECT images FROM entries WHERE digest = ? AND quality = ?",
+                              (digest, quality)).fetchone()
+        if row:  # the same file was converted twice at once
+            old = json.loads(row['images'])
+            remove_images([image for image in old if image not in images])
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO entries (digest, quality, file, size, "
+                            "mtime, images, bytes, created, used) VALUES (?, ?, ?, ?, ?, ?, ?, ?, %s)"
+                            % NEXT_USE, (digest, quality, location, size, mtime,
+                                         json.dumps(images), total, time.time()))
+            self.evict()
+
+
+    def evict(self):
+        """Removes the least recently used entries, until they fit the budget"""
+        budget = self.get_budget()
+        used = self.disk_usage()
+        if used <= budget:
+            return
+        removed = []
+        rows = self.db.execute("SELECT id, bytes FROM entries ORDER BY used")
+        for row in rows.fetchall()[:-1]:  # always keeps the newest
+            if used <= budget:
+                break
+            removed.append(row['id'])
+            used -= row['bytes']
+        logger.info("Evicting %i entries from the PDF cache", len(removed))
+        self.remove(removed)
+
+
+    def remove(self, ids):
+        """Removes entries by their id, deleting their images"""
+        for _id in ids:
+            row = self.db.execute("SELECT images FROM entries WHERE id = ?", (_id,)).fetchone()
+            if row:
+                remove_images(json.loads(row['images']))
+        with self.db:
+            self.db.executemany("DELETE FROM entries WHERE id = ?", [(_id,) for _id in ids])
+
+
+    def count(self, name):
+        self.db.execute("INSERT OR IGNORE INTO stats VALUES (?, 0)", (name,))
+        self.db.execute("UPDATE stats SET value = value + 1 WHERE name = ?", (name,))
+
+
+    def stats(self):
+        """(hits, misses) of every lookup so far"""
+        values = dict((row['name'], row['value']) for row in
+                      self.db.execute("SELECT name, value FROM stats"))
+        return values.get("hits", 0), values.get("misses", 0)
+
+
+    def disk_usage(self):
+        return self.db.execute("SELECT COALESCE(SUM(bytes), 0) FROM entries").fetchone()[0]
+
+
+    def entries(self):
+        """Every entry, as a dictionary, oldest first"""
+        rows = self.db.execute("SELECT id, file, quality, images, bytes, created "
+                               "FROM entries ORDER BY created")
+        return [{'id': row['id'], 'file': row['file'], 'quality': row['quality'],
+                 'images': json.loads(row['images']), 'bytes': row['bytes'],
+                 'date': time.asctime(time.localtime(row['created']))}
+                for row in rows]
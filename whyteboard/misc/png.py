@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+"""
+A small PNG writer that only needs the standard library, so that images can be
+encoded away from the GUI thread: wx's own image handlers aren't thread safe.
+Nearly all the work is done by zlib, which lets go of the interpreter lock
+while it compresses, so encoding several images at once with a thread pool
+uses as many cores as there are workers.
+
+Rows are filtered before they're compressed: the Sub and Up filters store each
+byte as its difference from the pixel to its left, or above it, which makes
+photos around a third smaller. The differences are taken a whole image at a
+time with long integer arithmetic, rather than byte by byte in Python. Each
+image uses whichever filter compresses a sample of its rows best, as flat
+drawings compress best unfiltered.
+"""
+
+import binascii
+import struct
+import zlib
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+#----------------------------------------------------------------------
+
+SIGNATURE = "\x89PNG\r\n\x1a\n"
+RGB, RGBA = 2, 6  # PNG colour types
+NONE, SUB, UP = 0, 1, 2  # PNG row filters
+SAMPLE = 8  # every nth row is compressed to choose an image's filter
+BAND = 64  # rows filtered and compressed at a time
+
+
+def chunk(kind, data):
+    return (struct.pack(">I", len(data)) + kind + data +
+            struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+
+def subtract(a, b):
+    """
+    Subtracts each byte of b from a's, modulo 256. The borrow from each byte is
+    kept out of the next by setting its high bit first, then fixing the bit.
+    """
+    if not a:
+        return ""
+    digits = len(a) * 2
+    high = int("80" * len(a), 16)
+    a = int(binascii.hexlify(a), 16)
+    b = int(binascii.hexlify(b), 16)
+    diff = ((a | high) - (b & ~high)) ^ ((a ^ ~b) & high)
+    return binascii.unhexlify("%0*x" % (digits, diff & ((1 << digits * 4) - 1)))
+
+
+def filter_rows(pixels, above, stride, bpp, kind):
+    """
+    Rows of pixels, each prefixed with the filter it's stored with. above is
+    the row above each row, for the Up filter.
+    """
+    rows = xrange(0, len(pixels), stride)
+    if kind == SUB:
+        left = "".join("\x00" * bpp + pixels[y:y + stride - bpp] for y in rows)
+        pixels = subtract(pixels, left)
+    elif kind == UP:
+        pixels = subtract(pixels, above)
+    return "".join(chr(kind) + pixels[y:y + stride] for y in rows)
+
+
+def choose_filter(pixels, above, stride, bpp):
+    """The filter that compresses every SAMPLEth row the smallest"""
+    rows = xrange(0, len(pixels), stride * SAMPLE)
+    pixels = "".join(pixels[y:y + stride] for y in rows)
+    above = "".join(above[y:y + stride] for y in rows)
+    return min((NONE, SUB, UP), key=lambda kind: len(
+        zlib.compress(filter_rows(pixels, above, stride, bpp, kind), 1)))
+
+
+def encode_png(width, height, pixels, alpha=None, level=6, pause=None):
+    """
+    Encodes RGB pixel data, plus an optional alpha channel (as given by
+    wx.Image's GetData/GetAlphaData) as a PNG. The rows are encoded in bands;
+    pause, if given, is called after each one.
+    """
+    colour = RGB
+    if alpha:
+        rgba = bytearray(width * height * 4)
+        rgba[0::4] = pixels[0::3]
+        rgba[1::4] = pixels[1::3]
+        rgba[2::4] = pixels[2::3]
+        rgba[3::4] = alpha
+        pixels = str(rgba)
+        colour = RGBA
+
+    bpp = 4 if alpha else 3
+    stride = width * bpp
+    above = "\x00" * stride + pixels[:-stride]
+    kind = choose_filter(pixels, above, stride, bpp)
+
+    compressor = zlib.compressobj(level)
+    data = []
+    band = stride * BAND
+    for start in xrange(0, len(pixels), band):
+        rows = filter_rows(pixels[start:start + band], above[start:start + band],
+                           stride, bpp, kind)
+        data.append(compressor.compress(rows))
+        if pause:
+            pause()
+    data.append(compressor.flush())
+
+    header = struct.pack(">IIBBBBB", width, height, 8, colour, 0, 0, 0)
+    return "".join([SIGNATURE, chunk("IHDR", header),
+                    chunk("IDAT", "".join(data)), chunk("IEND", "")])
+
+
+def image_size(data):
+    """A PNG's (width, height), read from its header; None if it's not a PNG"""
+    if data[:8] != SIGNATURE or data[12:16] != "IHDR":
+        return None
+    return struct.unpack(">II", data[16:24])
+
+
+def _encode(image):
+    return encode_png(*image)
+
+
+def encode_all(images, workers=0):
+    """
+    Encodes a list of (width, height, pixels, alpha) tuples, returning the PNGs
+    in the same order. workers is the number of threads to use; 0 means one
+    per core.
+    """
+    workers = min(workers or cpu_count(), len(images))
+    if workers <= 1:
+        return [_encode(image) for image in images]
+
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(_encode, images)
+    finally:
+        pool.close()
+        pool.join()
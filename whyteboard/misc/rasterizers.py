@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+
+"""
+The programs that rasterize PDF/PS pages into PNG images: ImageMagick (which
+runs Ghostscript, then sharpens, trims and borders each page), Ghostscript
+itself, and Poppler's pdftoppm. Each backend builds the command for a range of
+pages, and puts the images it wrote under the names converter.py expects.
+
+Pages are first rendered at a resolution that fits the canvas (screen_dpi), and
+only re-rendered at the quality's full density when they're printed; each
+resolution is cached under its own key. Which backend is used is the
+pdf_backend preference; "auto" picks the first one installed, in the order of
+BACKENDS. Only needs the standard library, so
+buildfiles/scripts/benchmark-rasterizers.py can load it without wx.
+"""
+
+import logging
+import os
+
+logger = logging.getLogger("whyteboard.rasterizers")
+
+# convert quality: (density to render at, dpi of the final image)
+QUALITY = {'highest': (300, 120),
+           'high': (250, 100),
+           'normal': (200, 88)}
+MIN_DPI = 36  # for pages much bigger than the canvas
+BORDER = 20  # ImageMagick's border around a trimmed page, at the quality's dpi
+
+MAX_DIGITS = 6  # pdftoppm pads page numbers to the length of the page count
+
+#----------------------------------------------------------------------
+
+def imagemagick_command(location, quality, source, output, scene=None, dpi=None):
+    """
+    ImageMagick's convert command. scene numbers the output's pages from that
+    number, for an output with a %d in it. dpi is the final image's, if not
+    the quality's; the border grows with it, so every resolution of a page
+    has the same proportions
+    """
+    density, resample = QUALITY[quality]
+    border = int(round(BORDER * float(dpi or resample) / resample))
+    resample = dpi or resample
+    density = max(density, resample)
+    scene = u"" if scene is None else u"-scene %i " % scene
+    return (u'"%s" -density %i "%s" -resample %i -unsharp 0x.5 -trim +repage -bordercolor white -border %i %s"%s"'
+            % (location, density, source, resample, border, scene, output))
+
+
+def screen_dpi(quality, page_size, width):
+    """
+    The dpi that fits a page of page_size points into width pixels; at most
+    the quality's own dpi, so pages are never bigger than they were
+    """
+    dpi = QUALITY[quality][1]
+    if page_size and page_size[0] > 0:
+        dpi = min(dpi, int(width * 72 / page_size[0]))
+    return max(MIN_DPI, dpi)
+
+
+def print_dpi(quality):
+    return QUALITY[quality][0]
+
+
+def resolution_key(quality, dpi=None):
+    """A quality, and the dpi its pages were rendered at, if not its own"""
+    if not dpi or dpi == QUALITY[quality][1]:
+        return quality
+    return u"%s@%i" % (quality, dpi)
+
+
+def partial_output(output, first):
+    """
+    A name pattern for a process' pages, for programs that number their
+    pages themselves; % is escaped, as they treat it as a format
+    """
+    name = os.path.splitext(output % first)[0].replace(u"%", u"%%")
+    return name + u"-%d.png"
+
+
+def move(source, destination):
+    if os.path.exists(destination):
+        os.remove(destination)
+    os.rename(source, destination)
+
+#----------------------------------------------------------------------
+
+class Rasterizer(object):
+    """
+    A program that converts PDF/PS pages. pages are (first, last), counting
+    from 0, or None for the whole file; output is a pattern with a %d that
+    page N's image is written to. dpi defaults to the quality's
+    """
+    name = None
+    label = None
+    executables = ()  # its program's names, in order of preference
+    formats = (u".pdf", u".ps", u".eps")
+
+    def find(self, directory=None):
+        """The program's path, in directory or on the PATH; None if it's not"""
+        directories = os.environ.get("PATH", "").split(os.pathsep)
+        if directory:
+            directories.insert(0, directory)
+        for name in self.executables:
+            for path in directories:
+                _file = os.path.join(path.strip('"'), name)
+                if os.path.isfile(_file) and os.access(_file, os.X_OK):
+                    return _file
+        return None
+
+
+    def supports(self, source):
+        return os.path.splitext(source)[1].lower() in self.formats
+
+
+    def cache_key(self, quality, dpi=None):
+        """
+        What the PDF cache keeps this backend's pages of a quality, at a
+        resolution, under
+        """
+        return u"%s-%s" % (self.name, resolution_key(quality, dpi))
+
+
+    def command(self, location, quality, source, output, pages=None, dpi=None):
+        raise NotImplementedError
+
+
+    def collect(self, output, pages=None):
+        """
+        Renames the images a process wrote, if its program can't name them as
+        output does itself
+        """
+        pass
+
+#----------------------------------------------------------------------
+
+class ImageMagick(Rasterizer):
+    """The original backend: slowest, but trims and sharpens each page"""
+    name = u"imagemagick"
+    label = u"ImageMagick"
+    executables = (u"convert.exe",) if os.name == "nt" else (u"convert",)
+    formats = Rasterizer.formats + (u".svg",)
+
+    def find(self, directory=None):
+        """Windows has its own convert.exe, so only looks in IM's directory"""
+        if os.name == "nt":
+            _file = os.path.join(directory or u"", u"convert.exe")
+            return _file if directory and os.path.exists(_file) else None
+        return Rasterizer.find(self, directory)
+
+
+    def cache_key(self, quality, dpi=None):
+        return resolution_key(quality, dpi)  # as before there were other backends
+
+
+    def command(self, location, quality, source, output, pages=None, dpi=None):
+        if not pages:
+            return imagemagick_command(location, quality, source, output, 0, dpi)
+        source = u"%s[%i-%i]" % (source, pages[0], pages[1])
+        return imagemagick_command(location, quality, source, output, pages[0], dpi)
+
+
+
+class Ghostscript(Rasterizer):
+    """
+    Renders straight to the final resolution, anti-aliased; Ghostscript
+    numbers each process' pages from 1
+    """
+    name = u"ghostscript"
+    label = u"Ghostscript"
+    if os.name == "nt":
+        executables = (u"gswin64c.exe", u"gswin32c.exe")
+    else:
+        executables = (u"gs",)
+
+    def command(self, location, quality, source, output, pages=None, dpi=None):
+        pages = pages or (0, None)
+        last = u"" if pages[1] is None else u"-dLastPage=%i " % (pages[1] + 1)
+        return (u'"%s" -q -dSAFER -dBATCH -dNOPAUSE -sDEVICE=png16m -r%i '
+                u'-dTextAlphaBits=4 -dGraphicsAlphaBits=4 -dFirstPage=%i %s'
+                u'-sOutputFile="%s" "%s"'
+                % (location, dpi or QUALITY[quality][1], pages[0] + 1, last,
+                   partial_output(output, pages[0]), source))
+
+
+    def collect(self, output, pages=None):
+        first, last = pages or (0, None)
+        partial = partial_output(output, first).replace(u"%%", u"%")
+        partial = partial[:-len(u"%d.png")]
+        x = first
+        while last is None or x <= last:
+            written = u"%s%i.png" % (partial, x - first + 1)
+            if not os.path.exists(written):
+                break
+            move(written, output % x)
+            x += 1
+
+
+
+class Poppler(Rasterizer):
+    """
+    Poppler's pdftoppm: the quickest, but only reads PDFs. It names pages by
+    their number in the file, padded to the length of the page count
+    """
+    name = u"poppler"
+    label = u"Poppler"
+    executables = (u"pdftoppm.exe",) if os.name == "nt" else (u"pdftoppm",)
+    formats = (u".pdf",)
+
+    def prefix(self, output, first):
+        return os.path.splitext(output % first)[0] + u"-p"
+
+
+    def command(self, location, quality, source, output, pages=None, dpi=None):
+        pages = pages or (0, None)
+        last = u"" if pages[1] is None else u"-l %i " % (pages[1] + 1)
+        return (u'"%s" -png -r %i -aa yes -aaVector yes -f %i %s"%s" "%s"'
+                % (location, dpi or QUALITY[quality][1], pages[0] + 1, last, source,
+                   self.prefix(output, pages[0])))
+
+
+    def collect(self, output, pages=None):
+        first, last = pages or (0, None)
+        prefix = self.prefix(output, first)
+        x = first
+        while last is None or x <= last:
+            for digits in range(1, MAX_DIGITS + 1):
+                written = u"%s-%0*i.png" % (prefix, digits, x + 1)
+                if os.path.exists(written):
+                    move(written, output % x)
+                    break
+            else:
+                break
+            x += 1
+
+#----------------------------------------------------------------------
+
+BACKENDS = [ImageMagick(), Ghostscript(), Poppler()]  # "auto"'s preference
+
+
+def get_backend(name):
+    for backend in BACKENDS:
+        if backend.name == name:
+            return backend
+    return None
+
+
+def choose(name, source, directory=None):
+    """
+    The named backend and its program, if it's installed and reads source;
+    otherwise, the first that does. None if none do. directory is where
+    ImageMagick was told to be
+    """
+    backends = list(BACKENDS)
+    chosen = get_backend(name)
+    if chosen:
+        backends.remove(chosen)
+        backends.insert(0, chosen)
+
+    for backend in backends:
+        if not backend.supports(source):
+            continue
+        location = backend.find(directory)
+        if location:
+            if chosen and backend is not chosen:
+                logger.info("%s isn't available; using %s", chosen.label, backend.label)
+            return backend, location
+    logger.warning("No program was found to convert [%s]", source)
+    return None
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+
+"""
+Writes a sheet's shapes as typed binary records, and reads them back without
+unpickling anything.
+
+Each saveable tool declares its record schema in tools.py: `fields`, the
+(attribute, kind) pairs that are written, in order, and `transient`, the
+values its other attributes take once loaded. A chunk starts with the table of
+tool names it uses, so records refer to their tool by a small index, and only
+the tools listed in TYPES can ever be created. Each record carries its field
+count and length: fields may be appended to a schema, and older records load
+with the kind's default for them; newer records' extra fields are skipped.
+Changing a schema's existing fields needs a new MAGIC.
+"""
+
+import copy
+import cStringIO
+import struct
+import sys
+import zlib
+
+from array import array
+
+import wx
+
+import whyteboard.tools as tools
+
+from whyteboard.misc import strokes
+
+#----------------------------------------------------------------------
+
+MAGIC = "WBR\x01"  # starts every chunk of records
+
+TYPES = dict((cls.__name__, cls) for cls in
+             [tools.Pen, tools.Highlighter, tools.Eraser, tools.Rectangle,
+              tools.RoundedRect, tools.Ellipse, tools.Circle, tools.Polygon,
+              tools.Line, tools.Arrow, tools.Text, tools.Note, tools.Image,
+              tools.Media])
+
+# colours: no colour, a style constant (wx.TRANSPARENT), or RGBA
+NO_COLOUR, STYLE_COLOUR, RGBA_COLOUR = range(3)
+INTEGERS, FLOATS = "i", "d"  # array typecodes: 32-bit ints, doubles
+SWAP = sys.byteorder == "big"  # records are little-endian
+
+STEP = 100  # shapes written between calls to dumps()' pause
+
+DEFAULTS = {"int": 0, "num": 0, "colour": None, "text": None, "nums": [],
+            "pair": None, "points": [], "stroke": ([], [])}
+
+
+def write_varint(out, value):
+    """An unsigned integer, 7 bits per byte"""
+    while value > 0x7f:
+        out.write(chr(value & 0x7f | 0x80))
+        value >>= 7
+    out.write(chr(value))
+
+
+def zigzag(value):
+    """Maps signed integers to unsigned ones: 0, -1, 1, -2... to 0, 1, 2, 3..."""
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def pack_array(values):
+    """Numbers as an array of 32-bit ints if they're all ints, else doubles"""
+    try:
+        packed = array(INTEGERS, values)
+    except (TypeError, OverflowError):
+        packed = array(FLOATS, values)
+    if SWAP:
+        packed.byteswap()
+    return packed
+
+
+class Reader(object):
+    """Reads the values written by a Writer from a string"""
+    def __init__(self, data, offset=0):
+        self.data = data
+        self.offset = offset
+
+    def read(self, count):
+        start = self.offset
+        self.offset += count
+        if self.offset > len(self.data):
+            raise ValueError("Record data is truncated")
+        return self.data[start:self.offset]
+
+    def unpack(self, fmt):
+        return struct.unpack(fmt, self.read(struct.calcsize(fmt)))
+
+    def varint(self):
+        value = shift = 0
+        while True:
+            byte = ord(self.read(1))
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def int(self):
+        return unzigzag(self.varint())
+
+    def num(self):
+        if self.read(1) == FLOATS:
+            return self.unpack("<d")[0]
+        return self.int()
+
+    def nums(self):
+        count = self.varint()
+        if not count:
+            return []
+        typecode = self.read(1)
+        if typecode not in (INTEGERS, FLOATS):
+            raise ValueError("Unknown number type %r" % typecode)
+        values = array(typecode)
+        values.fromstring(self.read(count * values.itemsize))
+        if SWAP:
+            values.byteswap()
+        return values.tolist()
+
+    def pair(self):
+        values = self.nums()
+        return tuple(values) if values else None
+
+    def points(self):
+        """Polygons' (x, y) points as tuples; pen segments as lists"""
+        width = self.varint()
+        values = self.nums()
+        if width == 2:
+            return zip(values[::2], values[1::2])
+        return [values[i:i + width] for i in xrange(0, len(values), width)]
+
+    def stroke(self):
+        """A pen's (points, time); see strokes.py"""
+        return strokes.decode(self.blob())
+
+    def blob(self):
+        return self.read(self.varint())
+
+    def colour(self):
+        kind = self.varint()
+        if kind == STYLE_COLOUR:
+            return self.varint()
+        if kind == RGBA_COLOUR:
+            return wx.Colour(*self.unpack("<4B"))
+        return None
+
+    def text(self):
+        length = self.varint()
+        if not length:
+            return None
+        return self.read(length - 1).decode("utf-8")
+
+
+class Writer(object):
+    def __init__(self):
+        self.out = cStringIO.StringIO()
+
+    def getvalue(self):
+        return self.out.getvalue()
+
+    def varint(self, value):
+        write_varint(self.out, value)
+
+    def int(self, value):
+        self.varint(zigzag(int(value)))
+
+    def num(self, value):
+        if isinstance(value, (int, long)):
+            self.out.write(INTEGERS)
+            self.int(value)
+        else:
+            self.out.write(FLOATS)
+            self.out.write(struct.pack("<d", value))
+
+    def nums(self, values):
+        self.varint(len(values))
+        if values:
+            packed = pack_array(values)
+            self.out.write(packed.typecode)
+            self.out.write(packed.tostring())
+
+    def pair(self, value):
+        self.nums(value or ())
+
+    def points(self, points):
+        width = len(points[0]) if points else 2
+        self.varint(width)
+        self.nums([value for point in points for value in point])
+
+    def stroke(self, stroke):
+        self.blob(strokes.encode(*stroke))
+
+    def blob(self, data):
+        """Raw bytes, e.g. an image's pixels"""
+        self.varint(len(data))
+        self.out.write(data)
+
+    def colour(self, colour):
+        if colour is None:
+            self.varint(NO_COLOUR)
+        elif isinstance(colour, (int, long)):
+            self.varint(STYLE_COLOUR)
+            self.varint(colour)
+        else:
+            self.varint(RGBA_COLOUR)
+            self.out.write(struct.pack("<4B", *colour_ints(colour)))
+
+    def text(self, text):
+        if text is None:
+            self.varint(0)
+            return
+        if not isinstance(text, unicode):
+            text = text.decode("utf-8")
+        data = text.encode("utf-8")
+        self.varint(len(data) + 1)
+        self.out.write(data)
+
+
+def colour_ints(colour):
+    """A wx.Colour or (r, g, b[, a]) tuple's red, green, blue and alpha"""
+    if isinstance(colour, (tuple, list)):
+        return tuple(colour[:4]) + (255,) * (4 - len(colour))
+    alpha = colour.Alpha() if hasattr(colour, "Alpha") else 255
+    return (colour.Red(), colour.Green(), colour.Blue(), alpha)
+
+#----------------------------------------------------------------------
+
+
+def write_shape(out, shape, names):
+    """Appends a shape's record; names maps tool names to their index"""
+    cls = type(shape)
+    if cls.__name__ not in TYPES:
+        raise TypeError("%s has no record schema" % cls.__name__)
+    if cls.__name__ not in names:
+        names[cls.__name__] = len(names)
+
+    record = Writer()
+    for name, kind in cls.fields:
+        getattr(record, kind)(getattr(shape, name, DEFAULTS[kind]))
+    data = record.getvalue()
+    out.varint(names[cls.__name__])
+    out.varint(len(cls.fields))
+    out.varint(len(data))
+    out.out.write(data)
+
+
+def read_shape(reader, types):
+    """
+    A shape from its record, with its transient attributes set; it must still
+    be attached to a canvas and load()ed, as for an unpickled shape
+    """
+    cls = types[reader.varint()]
+    count = reader.varint()
+    end = reader.varint() + reader.offset
+
+    shape = cls.__new__(cls)
+    for name, value in cls.transient.iteritems():
+        shape.__dict__[name] = copy.copy(value)
+    for x, (name, kind) in enumerate(cls.fields):
+        if x < count:
+            value = getattr(reader, kind)()
+        else:
+            value = copy.deepcopy(DEFAULTS[kind])
+        setattr(shape, name, value)
+
+    if reader.offset > end:
+        raise ValueError("%s record overran its length" % cls.__name__)
+    reader.offset = end  # skips any fields added after this version
+    return shape
+
+
+def dumps(sheet, level=6, pause=None):
+    """
+    Encodes a sheet's {'shapes', 'medias', 'groups'}: a list of shapes, a list
+    of medias, and groups as lists of shape indexes. pause, if given, is called
+    every STEP shapes
+    """
+    names = {}
+    body = Writer()
+    for key in ("shapes", "medias"):
+        body.varint(len(sheet[key]))
+        for x, shape in enumerate(sheet[key]):
+            write_shape(body, shape, names)
+            if pause and x % STEP == STEP - 1:
+                pause()
+
+    body.varint(len(sheet['groups']))
+    for group in sheet['groups']:
+        body.varint(len(group))
+        for index in group:
+            body.varint(index)
+
+    table = Writer()
+    table.varint(len(names))
+    for name in sorted(names, key=names.get):
+        table.text(name)
+    return MAGIC + zlib.compress(table.getvalue() + body.getvalue(), level)
+
+
+def loads(data):
+    """The reverse of dumps(); raises ValueError on a corrupt chunk"""
+    if not is_records(data):
+        raise ValueError("Not a sheet of records")
+    try:
+        reader = Reader(zlib.decompress(data[len(MAGIC):]))
+    except zlib.error, e:
+        raise ValueError("Corrupt sheet data: %s" % e)
+
+    types = []
+    for x in range(reader.varint()):
+        name = reader.text()
+        if name not in TYPES:
+            raise ValueError("Unknown shape type %r" % name)
+        types.append(TYPES[name])
+
+    sheet = {}
+    for key in ("shapes", "medias"):
+        sheet[key] = [read_shape(reader, types) for x in range(reader.varint())]
+    sheet['groups'] = [[reader.varint() for y in range(reader.varint())]
+                       for x in range(reader.varint())]
+    return sheet
+
+
+def is_records(data):
+    return data.startswith(MAGIC)
+
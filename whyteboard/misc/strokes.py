@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+
+"""
+A compact encoding for pen strokes and their timestamps.
+
+A Pen stores its stroke as line segments, [x1, y1, x2, y2], each starting
+where the last one ended, and the time.time() each was drawn. Here, a stroke
+is stored as its points instead - a new run of points begins wherever a
+segment doesn't start at the previous one's end - and each coordinate as the
+zig-zag varint of its difference from the previous one. Coordinates are
+integers when every one is whole, otherwise fixed-point in 1/FIXED_SCALE of a
+pixel. Times are kept as the first time, then milliseconds since the last.
+
+Pure Python, without wx, so that scripts can use it too.
+"""
+
+import struct
+import zlib
+
+#----------------------------------------------------------------------
+
+FLAG_FIXED = 1  # coordinates are fixed-point
+FLAG_ZLIB = 2  # the rest of the data is zlib compressed
+FIXED_SCALE = 1000
+
+
+def write_varint(out, value):
+    """An unsigned integer, 7 bits per byte, onto a bytearray"""
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, offset):
+    """The varint at an offset in a bytearray, and the offset after it"""
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def write_deltas(out, values):
+    """Each value's difference from the previous, as zig-zag varints"""
+    previous = 0
+    for value in values:
+        delta = value - previous
+        previous = value
+        write_varint(out, delta << 1 if delta >= 0 else (-delta << 1) - 1)
+
+
+def read_deltas(data, offset, count):
+    """The reverse of write_deltas(); read_varint() is inlined, for speed"""
+    values = []
+    append = values.append
+    value = 0
+    for x in xrange(count):
+        delta = shift = 0
+        while True:
+            byte = data[offset]
+            offset += 1
+            delta |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        value += delta >> 1 if not delta & 1 else -((delta + 1) >> 1)
+        append(value)
+    return values, offset
+
+#----------------------------------------------------------------------
+
+
+def stroke_points(segments):
+    """A stroke's points, and the segment indexes where a new run begins"""
+    points = []
+    breaks = []
+    end = None
+    for x, (x1, y1, x2, y2) in enumerate(segments):
+        if end != (x1, y1):
+            if x:
+                breaks.append(x)
+            points.append(x1)
+            points.append(y1)
+        points.append(x2)
+        points.append(y2)
+        end = (x2, y2)
+    return points, breaks
+
+
+def stroke_segments(points, breaks):
+    """The reverse of stroke_points()"""
+    segments = []
+    starts = set(breaks)
+    index = 2
+    x1, y1 = points[0:2]
+    count = len(points) // 2 - len(breaks) - 1
+    for x in xrange(count):
+        if x in starts:
+            x1, y1 = points[index:index + 2]
+            index += 2
+        x2, y2 = points[index:index + 2]
+        index += 2
+        segments.append([x1, y1, x2, y2])
+        x1, y1 = x2, y2
+    return segments
+
+
+def encode(segments, times, compress=False):
+    """Encodes a Pen's points and time lists; either may be empty"""
+    points, breaks = stroke_points(segments)
+    flags = FLAG_ZLIB if compress else 0
+    try:
+        if points != [int(x) for x in points]:
+            raise ValueError
+        coords = [int(x) for x in points]
+    except (ValueError, OverflowError):
+        flags |= FLAG_FIXED
+        coords = [int(round(x * FIXED_SCALE)) for x in points]
+
+    out = bytearray()
+    write_varint(out, len(segments))
+    write_varint(out, len(breaks))
+    write_deltas(out, breaks)
+    write_deltas(out, coords[0::2])
+    write_deltas(out, coords[1::2])
+
+    write_varint(out, len(times))
+    if times:
+        out.extend(struct.pack("<d", times[0]))
+        write_deltas(out, [int(round((t - times[0]) * 1000)) for t in times])
+
+    data = str(out)
+    if compress:
+        data = zlib.compress(data)
+    return chr(flags) + data
+
+
+def decode(data):
+    """The reverse of encode(): (segments, times)"""
+    flags = ord(data[0])
+    data = data[1:]
+    if flags & FLAG_ZLIB:
+        data = zlib.decompress(data)
+    data = bytearray(data)
+
+    count, offset = read_varint(data, 0)
+    segments = []
+    if count:
+        total, offset = read_varint(data, offset)
+        breaks, offset = read_deltas(data, offset, total)
+        size = count + 1 + len(breaks)
+        xs, offset = read_deltas(data, offset, size)
+        ys, offset = read_deltas(data, offset, size)
+        if flags & FLAG_FIXED:
+            xs = [x / float(FIXED_SCALE) for x in xs]
+            ys = [y / float(FIXED_SCALE) for y in ys]
+        points = [None] * (size * 2)
+        points[0::2] = xs
+        points[1::2] = ys
+        segments = stroke_segments(points, breaks)
+    else:
+        total, offset = read_varint(data, offset)  # no breaks, nor points
+
+    times = []
+    count, offset = read_varint(data, offset)
+    if count:
+        base = struct.unpack("<d", str(data[offset:offset + 8]))[0]
+        millis, offset = read_deltas(data, offset + 8, count)
+        times = [base + ms / 1000.0 for ms in millis]
+    return segments, times
@@ -137,6 +137,11 @@ class WhyteboardTopicTree(TopicTreeDefnSimple):
             _id = 'wx.TreeId'
             _required = 'note'
 
+        class delete:
+            '''when a note is deleted'''
+            note = 'the Note instance'
+            _required = 'note'
+
         class edit:
             '''when a note is edited'''
             tree_id = 'wx.TreeId'
@@ -164,6 +169,7 @@ class WhyteboardTopicTree(TopicTreeDefnSimple):
         class selected:
             '''shape has been select'''
             shape = 'selected shape'
+            add = 'add the shape to the current selection'
             _required = 'shape'
 
         class add:
@@ -19,24 +19,228 @@
 
 
 """
-Classes representing undo actions that can be performed
+Classes representing undo actions that can be performed. Each action records
+only what it changed (a shape added/removed, its position in the drawing
+order, its attributes before and after) rather than a copy of every shape, so
+an undo point costs as much as the change it's undoing.
+
+The canvas keeps a list of these, calling undo()/redo() as needed. The undo
+list is an UndoHistory, which holds a limited number (and size) of actions in
+memory: older actions are packed into a compressed journal on disk, and only
+unpacked if the user undoes that far back. The same packed records make up
+the undo log kept in a save file (see encode_log).
+
+A record is the action's name and its fields, written with records.Writer:
+shapes are referred to by uid, or written as shape records when they aren't
+on the canvas, so undoing never unpickles anything read from disk.
 """
 
 import os
+import logging
+import struct
+import tempfile
+import zlib
+
 import wx
 
+from whyteboard.core import Config
 from whyteboard.lib import pub
+from whyteboard.misc import codec, format_bytes, get_home_dir, records
+from whyteboard.tools import Image, Media, Note, OverlayShape
 
 _ = wx.GetTranslation
+logger = logging.getLogger("whyteboard.undo")
+
+#----------------------------------------------------------------------
+
+def add_notes(shapes):
+    """Re-creates any Notes' tree items in the Notes panel"""
+    for shape in shapes:
+        if isinstance(shape, Note):
+            pub.sendMessage('note.add', note=shape)
+
+
+def delete_notes(shapes):
+    for shape in shapes:
+        if isinstance(shape, Note):
+            pub.sendMessage('note.delete', note=shape)
+
+
+def affected_groups(canvas, shapes):
+    """Copies of only the groups that some shapes are in"""
+    uids = set(shape.uid for shape in shapes)
+    return [set(group) for group in canvas.groups if group & uids]
+
+
+def restore_groups(canvas, groups):
+    """
+    Puts back groups copied by affected_groups(), replacing whatever is left
+    of them; groups never share shapes, so other groups aren't touched
+    """
+    if not groups:
+        return
+    members = set().union(*groups)
+    canvas.groups = [g for g in canvas.groups if not g & members]
+    canvas.groups.extend(set(group) for group in groups)
+
+
+def make_action(cls, canvas, attrs):
+    """Creates an action from its attributes, without calling __init__"""
+    action = cls.__new__(cls)
+    action.canvas = canvas
+    action.__dict__.update(attrs)
+    return action
+
+
+def shapes_by_uid(canvas):
+    return dict((shape.uid, shape) for shape in canvas.shapes)
+
+
+def write_bitmap(out, bitmap):
+    """An image's pixels, alpha channel and mask colour, if it has a bitmap"""
+    if not bitmap:
+        out.varint(0)
+        return
+    width, height, pixels, alpha, mask = codec.encode_bitmap(bitmap)
+    out.varint(1)
+    out.varint(width)
+    out.varint(height)
+    out.blob(pixels)
+    out.blob(alpha or "")
+    out.nums(mask or ())
+
+
+def read_bitmap(reader):
+    if not reader.varint():
+        return None
+    width, height = reader.varint(), reader.varint()
+    pixels, alpha = reader.blob(), reader.blob()
+    mask = tuple(reader.nums()) or None
+    return codec.decode_bitmap((width, height, pixels, alpha, mask))
+
+
+def write_shape(out, shape):
+    """
+    A shape's tool name and record; an image's bitmap follows, unless it's in
+    the image store
+    """
+    name = type(shape).__name__
+    out.text(name)
+    records.write_shape(out, shape, {name: 0})
+    if isinstance(shape, Image):
+        write_bitmap(out, shape.__dict__.get("bitmap"))
+
+
+def read_shape(reader):
+    """A shape written by write_shape(), not yet attached to a canvas"""
+    name = reader.text()
+    if name not in records.TYPES:
+        raise ValueError("Unknown shape type %r" % name)
+    shape = records.read_shape(reader, [records.TYPES[name]])
+    if isinstance(shape, Image):
+        shape.bitmap = read_bitmap(reader)
+    return shape
+
+
+def load_shape(shape, canvas):
+    """Attaches a shape that was off the canvas, re-creating its wx objects"""
+    if isinstance(shape, Media):
+        raise ValueError("Media shapes cannot be restored")
+    shape.canvas = canvas
+
+    if isinstance(shape, Image):
+        OverlayShape.load(shape)  # Image.load() reads from the save file
+        shape.sort_handles()
+    elif isinstance(shape, Note):
+        shape.load(False)  # its note is added when the action is undone
+    else:
+        shape.load()
+    codec.refresh_shape(shape)
+    return shape
+
+
+def write_state(out, shape, state):
+    """A shape's get_state(), as a record of the shape's tool"""
+    stand_in = type(shape).__new__(type(shape))
+    stand_in.__dict__.update(state)
+    write_shape(out, stand_in)
+
+
+def read_state(reader):
+    """
+    The reverse of write_state(). Pens, brushes, fonts and handles aren't in
+    the state, and must be re-made once it's been applied
+    """
+    shape = read_shape(reader)
+    transient = type(shape).transient
+    return dict((key, value) for key, value in shape.__dict__.iteritems()
+                if key not in transient or key == "bitmap")
+
+
+def write_refs(out, shapes, present):
+    """
+    References to shapes: the uid of any shape that's on the canvas (present
+    is a set of uids), then the record of any that isn't
+    """
+    out.varint(len(shapes))
+    for shape in shapes:
+        out.int(shape.uid)
+        if shape.uid in present:
+            out.varint(0)
+        elif isinstance(shape, Media):
+            raise TypeError("Media shapes cannot be packed")
+        else:
+            out.varint(1)
+            write_shape(out, shape)
+
+
+def read_refs(canvas, reader):
+    lookup = shapes_by_uid(canvas)
+    shapes = []
+    for x in range(reader.varint()):
+        uid = reader.int()
+        if reader.varint():
+            shapes.append(load_shape(read_shape(reader), canvas))
+        elif uid in lookup:
+            shapes.append(lookup[uid])
+        else:
+            raise KeyError(uid)
+    return shapes
+
+
+def write_uids(out, uids):
+    """As varints: uids are 62 bits, too big for nums()"""
+    out.varint(len(uids))
+    for uid in uids:
+        out.int(uid)
+
+
+def read_uids(reader):
+    return [reader.int() for x in range(reader.varint())]
+
+
+def write_groups(out, groups):
+    out.varint(len(groups))
+    for group in groups:
+        write_uids(out, sorted(group))
+
+
+def read_groups(reader):
+    return [set(read_uids(reader)) for x in range(reader.varint())]
 
 #----------------------------------------------------------------------
 
+
 class BaseUndo(object):
     """
-    The base undo class.
+    The base undo class. Actions write() their fields into a record when
+    they're moved out of memory or saved, and are read() back when next undone
+    (or redone), so at that point the canvas is exactly as they left it:
+    writing for the redo list refers to the state before the action, rather
+    than after it.
     """
-    def __init__(self, data):
-        self.data = data
+    def __init__(self, canvas):
+        self.canvas = canvas
 
     def undo(self):
         pass
@@ -44,57 +248,511 @@ class BaseUndo(object):
     def redo(self):
         pass
 
+    def size(self):
+        """Approximate number of bytes this action keeps alive"""
+        return codec.ATTRIBUTE_BYTES
 
-class ShapeUndo(BaseUndo):
+    def write(self, out, redo=False):
+        pass
+
+    def record(self, redo=False):
+        """
+        The packed action, compressed, as stored on disk. An action's undo
+        record doesn't change while it's on the undo list, so it's kept once
+        made: saving again only packs the actions added since
+        """
+        if redo:
+            return make_record(self, True)
+        if getattr(self, "packed", None) is None:
+            self.packed = make_record(self)
+        return self.packed
+
+    @classmethod
+    def read(cls, canvas, reader):
+        return make_action(cls, canvas, {})
+
+
+class AddShapeUndo(BaseUndo):
     """
-    An action that's performed on a shape, such as change position/size/colour
+    Removes a newly drawn shape, which is always the top-most shape
     """
+    def __init__(self, canvas, shape):
+        BaseUndo.__init__(self, canvas)
+        self.shape = shape
+        self.index = len(canvas.shapes)
+
     def undo(self):
-        self.data.undo()
+        shapes = self.canvas.shapes
+        if self.index < len(shapes) and shapes[self.index] is self.shape:
+            del shapes[self.index]
+        else:
+            shapes.remove(self.shape)
+        delete_notes([self.shape])
 
     def redo(self):
-        self.data.redo()
+        self.shape.canvas = self.canvas
+        self.canvas.shapes.insert(self.index, self.shape)
+        add_notes([self.shape])
 
+    def write(self, out, redo=False):
+        present = () if redo else (self.shape.uid,)
+        write_refs(out, [self.shape], present)
+        out.varint(self.index)
 
-class ClearSheetUndo(BaseUndo):
+    @classmethod
+    def read(cls, canvas, reader):
+        shape = read_refs(canvas, reader)[0]
+        return make_action(cls, canvas, {'shape': shape, 'index': reader.varint()})
+
+
+class RemoveShapesUndo(BaseUndo):
     """
-    Restore all shapes after clearing a given a sheet
+    Puts deleted shapes back in their original drawing positions, and restores
+    any groups they were in
     """
+    def __init__(self, canvas, shapes):
+        BaseUndo.__init__(self, canvas)
+        positions = dict((id(shape), x) for x, shape in enumerate(canvas.shapes))
+        self.removed = sorted((positions[id(s)], s) for s in shapes if id(s) in positions)
+        self.groups = affected_groups(canvas, [s for index, s in self.removed])
+
     def undo(self):
-        self.data.undo()
+        for index, shape in self.removed:
+            shape.canvas = self.canvas
+            self.canvas.shapes.insert(index, shape)
+        restore_groups(self.canvas, self.groups)
+        add_notes([shape for index, shape in self.removed])
 
     def redo(self):
-        self.data.redo()
+        for index, shape in reversed(self.removed):
+            del self.canvas.shapes[index]
+        shapes = [shape for index, shape in self.removed]
+        self.canvas.remove_from_groups(shapes)
+        delete_notes(shapes)
 
+    def size(self):
+        return sum(codec.estimate_size(shape) for index, shape in self.removed)
 
-class ClearAllSheetUndo(BaseUndo):
+    def write(self, out, redo=False):
+        shapes = [shape for index, shape in self.removed]
+        present = set(shape.uid for shape in shapes) if redo else ()
+        out.nums([index for index, shape in self.removed])
+        write_refs(out, shapes, present)
+        write_groups(out, self.groups)
+
+    @classmethod
+    def read(cls, canvas, reader):
+        indexes = reader.nums()
+        shapes = read_refs(canvas, reader)
+        return make_action(cls, canvas, {'removed': zip(indexes, shapes),
+                                         'groups': read_groups(reader)})
+
+
+class ReorderUndo(BaseUndo):
     """
-    Restores all shapes to each canvas after clearing all sheets
+    A shape has been moved up/down the drawing order
     """
+    def __init__(self, canvas, shape, old, new):
+        BaseUndo.__init__(self, canvas)
+        self.shape = shape
+        self.old = old
+        self.new = new
+
+    def move(self, _from, to):
+        shape = self.canvas.shapes.pop(_from)
+        self.canvas.shapes.insert(to, shape)
+
     def undo(self):
-        self.data.undo()
+        self.move(self.new, self.old)
 
     def redo(self):
-        self.data.redo()
+        self.move(self.old, self.new)
 
+    def write(self, out, redo=False):
+        out.varint(self.old)
+        out.varint(self.new)
 
-class CanvasResizeUndo(BaseUndo):
+    @classmethod
+    def read(cls, canvas, reader):
+        return make_action(cls, canvas, {'old': reader.varint(),
+                                         'new': reader.varint(), 'shape': None})
+
+
+class ShapeUndo(BaseUndo):
     """
-    Restores the canvas to its previous size
+    An action that's performed on shapes, such as change position/size/colour.
+    The shapes' attributes are recorded when the action starts; the changed
+    attributes are recorded when it's first undone, to be redone.
     """
+    def __init__(self, canvas, shapes):
+        BaseUndo.__init__(self, canvas)
+        self.shapes = list(shapes)
+        self.before = [shape.get_state() for shape in self.shapes]
+        self.after = None
+
+    def restore(self, states):
+        for shape, state in zip(self.shapes, states):
+            shape.set_state(state)
+            if not state.get('brush'):  # was packed
+                codec.refresh_shape(shape)
+                if shape.__dict__.get("handles"):
+                    shape.sort_handles()
+            if isinstance(shape, Note) and shape.tree_id:
+                pub.sendMessage('note.edit', tree_id=shape.tree_id, text=shape.text)
+
+    def undo(self):
+        self.after = [shape.get_state() for shape in self.shapes]
+        self.restore(self.before)
+
+    def redo(self):
+        self.restore(self.after)
+
+    def size(self):
+        """Bitmaps are shared with the shapes, so aren't counted"""
+        total = 0
+        for state in self.before:
+            total += codec.estimate_size(dict(state, image=None))
+        return total
+
+    def write(self, out, redo=False):
+        """Redoing needs both states: the action goes back to the undo list"""
+        write_uids(out, [shape.uid for shape in self.shapes])
+        for shape, state in zip(self.shapes, self.before):
+            write_state(out, shape, state)
+        out.varint(int(redo))
+        if redo:
+            for shape, state in zip(self.shapes, self.after):
+                write_state(out, shape, state)
+
+    @classmethod
+    def read(cls, canvas, reader):
+        lookup = shapes_by_uid(canvas)
+        shapes = [lookup[uid] for uid in read_uids(reader)]
+        before = [read_state(reader) for shape in shapes]
+        after = None
+        if reader.varint():
+            after = [read_state(reader) for shape in shapes]
+        return make_action(cls, canvas, {'shapes': shapes, 'before': before,
+                                         'after': after})
+
+
+class ShapeListUndo(BaseUndo):
+    """
+    The shape list has been replaced (e.g. re-ordered by the Shape Viewer).
+    Only references to the shapes are kept, not copies of them.
+    """
+    def __init__(self, canvas, old, new):
+        BaseUndo.__init__(self, canvas)
+        self.old = list(old)
+        self.new = list(new)
+        kept = set(id(shape) for shape in self.new)
+        self.groups = affected_groups(canvas, [s for s in self.old if id(s) not in kept])
+
+    def swap(self, old, new):
+        """Replaces the shape list, updating any affected notes"""
+        kept = set(id(shape) for shape in new)
+        delete_notes([shape for shape in old if id(shape) not in kept])
+        had = set(id(shape) for shape in old)
+        add_notes([shape for shape in new if id(shape) not in had])
+        self.canvas.shapes = list(new)
+
     def undo(self):
-        self.data.undo()
+        self.swap(self.new, self.old)
+        restore_groups(self.canvas, self.groups)
 
     def redo(self):
-        self.data.redo()
+        self.swap(self.old, self.new)
+        kept = set(id(shape) for shape in self.new)
+        self.canvas.remove_from_groups([s for s in self.old if id(s) not in kept])
+
+    def size(self):
+        present = set(id(shape) for shape in self.canvas.shapes)
+        return sum(codec.estimate_size(shape) for shape in self.old
+                   if id(shape) not in present) + codec.POINT_BYTES * len(self.new)
+
+    def write(self, out, redo=False):
+        current = self.old if redo else self.new
+        present = set(shape.uid for shape in current)
+        write_refs(out, self.old, present)
+        write_refs(out, self.new, present)
+        write_groups(out, self.groups)
+
+    @classmethod
+    def read(cls, canvas, reader):
+        old = read_refs(canvas, reader)
+        new = read_refs(canvas, reader)
+        return make_action(cls, canvas, {'old': old, 'new': new,
+                                         'groups': read_groups(reader)})
+
+
+class ClearSheetUndo(ShapeListUndo):
+    """
+    Restore all shapes after clearing a given a sheet
+    """
+    pass
 
 
-class CanvasRenameUndo(BaseUndo):
+class PackedUndo(BaseUndo):
     """
-    Undo renaming a canvas
+    An action read back from a save file, which is only unpacked once it's
+    undone or redone. Until then it's written back out as it was read.
     """
+    def __init__(self, canvas, record):
+        BaseUndo.__init__(self, canvas)
+        self.data = record
+        self.action = None
+
+    def unpacked(self):
+        if not self.action:
+            self.action = (unpack_record(self.canvas, self.data) or
+                           BaseUndo(self.canvas))
+            self.data = None
+        self.action.canvas = self.canvas
+        return self.action
+
     def undo(self):
-        self.data.undo()
+        self.unpacked().undo()
 
     def redo(self):
-        self.data.redo()
\ No newline at end of file
+        self.unpacked().redo()
+
+    def size(self):
+        if self.action:
+            return self.action.size()
+        return len(self.data)
+
+    def record(self, redo=False):
+        if self.action:
+            return self.action.record(redo)
+        return self.data
+
+
+#----------------------------------------------------------------------
+
+ACTIONS = dict((cls.__name__, cls) for cls in
+               (BaseUndo, AddShapeUndo, RemoveShapesUndo, ReorderUndo,
+                ShapeUndo, ShapeListUndo, ClearSheetUndo))
+
+RECORD_LENGTH = struct.Struct(">I")
+MAGIC = "WBU\x01"  # starts every undo record
+
+
+def make_record(action, redo=False):
+    out = records.Writer()
+    out.text(action.__class__.__name__)
+    action.write(out, redo)
+    return MAGIC + zlib.compress(out.getvalue(), 6)
+
+
+def unpack_record(canvas, record):
+    """
+    Re-creates an action from its record, or returns None if the record is
+    unreadable or the shapes it refers to can't be found
+    """
+    name = None
+    try:
+        if not record.startswith(MAGIC):
+            raise ValueError("Not an undo record")
+        reader = records.Reader(zlib.decompress(record[len(MAGIC):]))
+        name = reader.text()
+        if name not in ACTIONS:
+            raise ValueError("Unknown undo action %r" % name)
+        return ACTIONS[name].read(canvas, reader)
+    except Exception:
+        logger.exception(u"Couldn't restore undo action %s", name)
+
+
+def encode_log(records):
+    """Joins records into an undo log, as stored in a save file"""
+    return "".join(RECORD_LENGTH.pack(len(record)) + record for record in records)
+
+
+def decode_log(data):
+    """Splits an undo log back into records, without unpacking them"""
+    records = []
+    position = 0
+    while position + RECORD_LENGTH.size <= len(data):
+        length, = RECORD_LENGTH.unpack_from(data, position)
+        position += RECORD_LENGTH.size
+        records.append(data[position:position + length])
+        position += length
+    return records
+
+
+class UndoJournal(object):
+    """
+    A stack of action records in a temporary file, which the OS removes when
+    it's closed (or Whyteboard exits).
+    """
+    def __init__(self, directory=None):
+        if not directory:
+            directory = get_home_dir(u"undo")
+        self.file = tempfile.TemporaryFile(suffix=u".journal", dir=directory)
+        self.offsets = []
+
+    def push(self, record):
+        self.file.seek(0, os.SEEK_END)
+        self.offsets.append(self.file.tell())
+        self.file.write(record)
+
+    def pop(self):
+        offset = self.offsets.pop()
+        self.file.seek(offset)
+        record = self.file.read()
+        self.file.seek(offset)
+        self.file.truncate()
+        return record
+
+    def records(self):
+        """Every record, oldest first"""
+        ends = self.offsets[1:] + [self.size()]
+        for offset, end in zip(self.offsets, ends):
+            self.file.seek(offset)
+            yield self.file.read(end - offset)
+
+    def size(self):
+        self.file.seek(0, os.SEEK_END)
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+        self.offsets = []
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+class UndoHistory(object):
+    """
+    A canvas' undo list, kept within the undo_limit and undo_memory (MB)
+    preferences. Once either is exceeded, the oldest actions are moved into an
+    UndoJournal; they're read back one at a time as they're undone.
+    """
+    def __init__(self, canvas, limit=None, memory=None, directory=None):
+        self.canvas = canvas
+        self.limit = limit
+        self.memory = memory
+        self.directory = directory
+        self.actions = []
+        self.sizes = []
+        self.bytes = 0
+        self.journal = None
+
+    def budget(self):
+        """(max. actions, max. bytes) to hold in memory"""
+        limit, memory = self.limit, self.memory
+        if limit is None:
+            limit = Config().undo_limit()
+        if memory is None:
+            memory = Config().undo_memory() * 1048576
+        return limit, memory
+
+    def append(self, action):
+        size = action.size()
+        self.actions.append(action)
+        self.sizes.append(size)
+        self.bytes += size
+        self.spill()
+        logger.debug(u"Undo history: %s", self)
+
+    def spill(self):
+        """Moves the oldest actions to disk until back within budget"""
+        limit, memory = self.budget()
+        while len(self.actions) > 1 and (len(self.actions) > limit or
+                                         self.bytes > memory):
+            action = self.actions[0]
+            try:
+                record = action.record()
+                if not self.journal:
+                    self.journal = UndoJournal(self.directory)
+                self.journal.push(record)
+            except Exception:
+                logger.exception(u"Couldn't move %s to disk; discarding the "
+                                 u"undo history before it", action)
+                self.discard_journal()
+            del self.actions[0]
+            self.bytes -= self.sizes.pop(0)
+
+    def pop(self):
+        if self.actions:
+            self.bytes -= self.sizes.pop()
+            return self.actions.pop()
+
+        action = unpack_record(self.canvas, self.journal.pop())
+        if not action:
+            self.discard_journal()  # nothing earlier can be undone either
+            action = BaseUndo(self.canvas)
+        return action
+
+    def records(self, depth):
+        """
+        The newest depth actions' records, oldest first, for saving. Records
+        on disk are copied rather than unpacked
+        """
+        records = []
+        for action in reversed(self.actions):
+            if len(records) == depth:
+                break
+            try:
+                records.append(action.record())
+            except Exception:
+                logger.exception(u"Couldn't save %s; saving the undo history "
+                                 u"after it only", action)
+                return list(reversed(records))
+
+        if self.journal and len(records) < depth:
+            older = list(self.journal.records())
+            records.extend(reversed(older[-(depth - len(records)):]))
+        return list(reversed(records))
+
+    def discard_journal(self):
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+
+    def detach(self):
+        """Takes the actions out of memory (e.g. for packing a closed sheet)"""
+        actions = self.actions
+        self.actions = []
+        self.sizes = []
+        self.bytes = 0
+        return actions
+
+    def attach(self, actions):
+        """Puts detached actions back, newer than any on disk"""
+        for action in actions:
+            self.actions.append(action)
+            self.sizes.append(action.size())
+            self.bytes += self.sizes[-1]
+        self.spill()
+
+    def set_canvas(self, canvas):
+        self.canvas = canvas
+        for action in self.actions:
+            action.canvas = canvas
+
+    def close(self):
+        """Frees everything, once this history is no longer needed"""
+        self.discard_journal()
+        self.actions = []
+        self.sizes = []
+        self.bytes = 0
+
+    def on_disk(self):
+        return len(self.journal) if self.journal else 0
+
+    def __len__(self):
+        return len(self.actions) + self.on_disk()
+
+    def __nonzero__(self):
+        return bool(len(self))
+
+    def __iter__(self):
+        """Only the actions in memory"""
+        return iter(self.actions)
+
+    def __str__(self):
+        disk = self.journal.size() if self.journal else 0
+        return u"%i actions in memory (%s), %i on disk (%s)" % (
+            len(self.actions), format_bytes(self.bytes), self.on_disk(),
+            format_bytes(disk))
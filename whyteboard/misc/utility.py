@@ -23,7 +23,29 @@ This module contains a utility helper class to reduce the amount of code
 inside gui.py - whyteboard-file saving/loading, pdf/ps loading/conversion and
 loading a standard image.
 
-The saved .wtbd file structure is:
+A .wtbd file is a zip archive containing:
+
+  manifest.json   - deflated JSON     { 'version', 'colour' (RGBA),
+                                        'thickness', 'tool', 'tab', 'font',
+                                        'sheets': [ {'name', 'size', 'shapes',
+                                                     'images', 'thumbnail'},
+                                                    ...  ] }
+                    where 'shapes' is a sheet's shape count, 'images' the
+                    names of its images and 'thumbnail' its thumbnail's name
+  sheets/N.data   - each sheet's shapes as records (see misc/records.py),
+                    only loaded once the sheet is first viewed
+  thumbnails/N.png - each sheet's thumbnail
+  data/*          - images
+
+read_manifest() and read_thumbnail() read these without loading anything else.
+
+Sheets that haven't changed since the file was loaded or last saved aren't
+written again: their chunk, history and images are copied over from the old
+file as they are, without being decompressed (see copy_member).
+
+Files written by older versions have a single save.data file instead of the
+manifest and sheets (or, older still, are that file, unzipped), whose structure
+is as follows; migrate.py converts them in bulk:
 
   dictionary { 0: [colour, thickness, tool, tab, version, font], - app settings
                1: shapes { 0: [shape1, shape2, .. shapeN],
@@ -56,16 +78,24 @@ The saved .wtbd file structure is:
 
 Image Tools have the assosicated image removed from their class upon saving,
 but are restored with it upon loading the file.
+
+Each sheet's undo and redo history is stored alongside, as history/N.undo
+and history/N.redo (see misc/undo.py's encode_log). They're only unpacked as
+the user undoes or redoes.
 """
 
 from __future__ import with_statement
 
+import copy
 import os
 import sys
+import json
 import logging
-import shutil
+import struct
+import tempfile
 import time
 import zipfile
+import zlib
 import wx
 
 try:
@@ -75,14 +105,181 @@ except ImportError:
 
 from whyteboard.core import Config
 from whyteboard.lib import pub
-from whyteboard.misc import (meta, get_home_dir, load_image, convert_quality, make_filename,
-                       get_wx_image_type, version_is_greater, open_url)
+from whyteboard.misc import (meta, get_home_dir, load_image, make_filename,
+                       get_wx_image_type, version_is_greater, open_url, replace_file)
+
+from whyteboard.misc import codec, png, records
+from whyteboard.misc.converter import Converter, page_count, page_size, read_file
+from whyteboard.misc.images import EncodedImages, ImageStore
+from whyteboard.misc.pdfcache import PDFCache
+from whyteboard.misc.rasterizers import ImageMagick, choose, print_dpi, screen_dpi
+from whyteboard.misc.undo import PackedUndo, decode_log, encode_log
 
 import whyteboard.tools as tools
 
 _ = wx.GetTranslation
 logger = logging.getLogger("whyteboard.utility")
 
+MANIFEST = u"manifest.json"
+SHEET_CHUNK = u"sheets/%i.data"
+THUMBNAIL = u"thumbnails/%i.png"
+BACKGROUND_DELAY = 50  # ms between loading each sheet in the background
+ENCODE_BATCH = 2  # images per save worker held in memory at once
+HISTORY = (u"history/%i.undo", u"history/%i.redo")
+FAST_LEVEL = 1  # zlib level inside sheet chunks, with fast_save
+CORRUPT_PICKLE = (pickle.UnpicklingError, AttributeError, ImportError,
+                  ValueError, TypeError, EOFError)
+
+#----------------------------------------------------------------------
+
+def copy_member(source, name, target, new_name=None):
+    """
+    Copies a file from one open zip to another without decompressing and
+    re-compressing it; the target must have been opened for writing
+    """
+    info = source.getinfo(name)
+    fp = source.fp
+    fp.seek(info.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, fp.read(zipfile.sizeFileHeader))
+    fp.seek(header[zipfile._FH_FILENAME_LENGTH] +
+            header[zipfile._FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+    data = fp.read(info.compress_size)
+
+    member = copy.copy(info)
+    member.filename = new_name or name
+    member.flag_bits &= ~0x08  # sizes are in the header, no data descriptor
+    member.extra = ""
+    append_member(target, member, data)
+
+
+def write_member(_zip, name, data, level=0):
+    """
+    Writes a file to a zip, deflated at the given zlib level (zipfile itself
+    only uses the default level), or stored at level 0. Data that deflate
+    can't shrink is stored as well
+    """
+    member = zipfile.ZipInfo(name, time.localtime(time.time())[:6])
+    member.external_attr = 0600 << 16
+    member.file_size = len(data)
+    member.CRC = zlib.crc32(data) & 0xffffffff
+    if level:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        if len(compressed) < len(data):
+            member.compress_type = zipfile.ZIP_DEFLATED
+            data = compressed
+    member.compress_size = len(data)
+    append_member(_zip, member, data)
+
+
+def append_member(_zip, member, data):
+    """Writes a member's header and its (compressed) data to an open zip"""
+    member.header_offset = _zip.fp.tell()
+    _zip.fp.write(member.FileHeader())
+    _zip.fp.write(data)
+    _zip.filelist.append(member)
+    _zip.NameToInfo[member.filename] = member
+    _zip._didModify = True
+
+
+def parse_manifest(_zip):
+    """An open .wtbd zip's manifest, or None for an older save file"""
+    if MANIFEST not in _zip.NameToInfo:
+        return None
+    return json.loads(_zip.read(MANIFEST))
+
+
+def read_manifest(filename):
+    """
+    A .wtbd file's manifest (described above): its version and settings, and
+    each sheet's name, size, shape count, images and thumbnail. None for files
+    saved by older versions. Nothing else is read, so it's quick enough to
+    index many files.
+    """
+    try:
+        _zip = zipfile.ZipFile(filename)
+    except zipfile.BadZipfile:
+        return None  # a single pickled file
+    try:
+        return parse_manifest(_zip)
+    finally:
+        _zip.close()
+
+
+def read_thumbnail(filename, sheet):
+    """A sheet's thumbnail as PNG data, or None if the file doesn't have one"""
+    _zip = zipfile.ZipFile(filename)
+    try:
+        return _zip.read(THUMBNAIL % sheet)
+    except KeyError:
+        return None
+    finally:
+        _zip.close()
+
+
+def unpickle_save(filename, pickle_data=None):
+    """
+    The save data (described above) of the old format: a file that's a single
+    pickle, or a zip's save.data contents. Pretty messy, to support old save
+    files written in "w", not "wb", which are read again as text. Returns the
+    data and whether it was read as text; raises one of CORRUPT_PICKLE.
+    Unpickling can run arbitrary code: only for trusted files.
+    """
+    sys.modules['tools'] = tools  # monkey patch for new src layout (0.4)
+    try:
+        if pickle_data:
+            return pickle.loads(pickle_data), False
+        try:
+            with open(filename, 'rb') as f:
+                return pickle.load(f), False
+        except ImportError:
+            logger.warning("Even older, incompatible save format being used.")
+            with open(filename, 'r') as f:
+                return pickle.load(f), True
+    finally:
+        logger.debug("Removing tools namespace")
+        del sys.modules['tools']
+
+
+def manifest_settings(util, tab, version):
+    """The program settings, as saved in a manifest"""
+    font = None
+    if util.font:
+        font = util.font.GetNativeFontInfoDesc()
+    return {'version': version, 'colour': records.colour_ints(util.colour),
+            'thickness': util.thickness, 'tool': util.tool, 'tab': tab,
+            'font': font}
+
+#----------------------------------------------------------------------
+
+class Compression(object):
+    """
+    How each member of a save file is compressed. Sheet chunks and the manifest
+    are deflated at the save_compression level; images, thumbnails and undo
+    history are compressed already, and are stored. With fast_save, sheet
+    chunks are compressed inside with zlib's quickest level, and stored.
+    """
+    def __init__(self, level=None, fast=None):
+        config = Config()
+        self.level = config.save_compression() if level is None else level
+        self.fast = config.fast_save() if fast is None else fast
+        self.chunk_level = FAST_LEVEL if self.fast else 0
+
+
+    def chunk(self, sheet, pause=None):
+        """A sheet's {'shapes', 'medias', 'groups'} as records"""
+        return records.dumps(sheet, self.chunk_level, pause)
+
+
+    def member_level(self, name):
+        if name == MANIFEST or name.startswith(u"sheets/") and not self.fast:
+            return self.level
+        return 0
+
+
+    def write(self, _zip, name, data):
+        write_member(_zip, name, data, self.member_level(name))
+
 #----------------------------------------------------------------------
 
 class Utility(object):
@@ -93,10 +290,11 @@ class Utility(object):
 
     Trying to achieve a data-driven system, focusing on "don't repeat yourself"
     """
-    def __init__(self, gui):
+    def __init__(self, gui, pdf_cache=None):
         """
         Initialise "shared" variables, and set up a wxPython wildcard from the
-        supported filetypes.
+        supported filetypes. pdf_cache is the PDF cache's database file, by
+        default in the home directory.
         """
         self.gui = gui
         self.filename = None   # ACTIVE .wtbd file
@@ -117,7 +315,16 @@ class Utility(object):
         self.saved_version = u""
         self.im_location = None  # location of ImageMagick on windows
         self.path = None
-        self.library = PDFCache(u"library.known")
+        self.library = PDFCache(pdf_cache)
+        self.imports = {}  # converter: (file, cache key, its pages' sheets)
+        self.renders = {}  # converter: (file, cache key, {page: its images})
+        self.pending = {}  # canvas: sheet number, for sheets not loaded yet
+        self.source = None  # saved file that unchanged sheets are copied from
+        self.sheet_images = {}  # sheet number: its images, in the source
+        self.sheet_shapes = {}  # sheet number: its shape count, in the source
+        self.thumbnails = set()  # sheet numbers shown with their saved thumbnail
+        self.image_files = EncodedImages()  # the images encoded to be saved
+        self.images = ImageStore()  # the loaded file's images, see Image.load
         pub.subscribe(self.set_colour, 'change_colour')
         pub.subscribe(self.set_background, 'change_background')
 
@@ -129,8 +336,8 @@ class Utility(object):
 
     def save_file(self):
         """
-        Saves the file by wrapping a pickled dictionary into a .data file and
-        added any images into a zip archive along with the .data file.
+        Saves the file as a zip of a manifest, each sheet's records and history,
+        and its images - all written from memory into the zip.
         """
         if not self.filename:
             logger.debug("No filename set; cannot save")
@@ -140,113 +347,235 @@ class Utility(object):
         if not self.update_version:
             version = self.saved_version
 
+        self.gui.autosave.wait()
         self.is_zipped = True
         self.mark_saved()
         self.save_last_path(self.filename)
         self.gui.show_progress_dialog(_("Saving..."))
 
         canvases = self.gui.get_canvases()
-        save = Save(self, canvases, self.gui.get_tab_names())
+        source = self.open_source()
+        clean = self.clean_sheets(canvases, source)
+        logger.debug("Copying %i unchanged sheets of %i", len(clean), len(canvases))
+        save = Save(self, canvases, self.gui.get_tab_names(), clean)
 
-        if not self.write_save_file(save, version):
-            save.restore_items(canvases)
+        if not self.write_save_file(save, version, source):
             self.gui.dialog.Destroy()
             return
 
+        self.sheet_images = dict((x, save.image_names(x))
+                                 for x in range(len(canvases)))
+        self.sheet_shapes = dict((x, save.shape_count(x))
+                                 for x in range(len(canvases)))
+        self.thumbnails = set(x for x, canvas in enumerate(canvases)
+                              if canvas in self.pending and canvas.chunk in self.thumbnails)
+        for x, canvas in enumerate(canvases):
+            canvas.dirty = False
+            canvas.chunk = x
+        self.pending = dict((canvas, canvas.chunk) for canvas in self.pending)
+        self.source = self.filename
+
         self.zip = zipfile.ZipFile(self.filename, "r")
-        save.restore_items(canvases)
-        self.zip.close()
+        if not self.pending:
+            self.zip.close()
+        self.gui.autosave.discard()
+        self.gui.journal.start()  # the save file now holds everything journalled
 
         self.gui.dialog.Destroy()
         self.gui.SetTitle(u"%s - %s" % (os.path.basename(self.filename), self.gui.title))
 
 
-    def write_save_file(self, save, version):
+    def open_source(self):
+        """The saved file to copy unchanged sheets from, if there is one"""
+        if not self.source or not os.path.exists(self.source):
+            return None
+        try:
+            return zipfile.ZipFile(self.source)
+        except (IOError, zipfile.BadZipfile):
+            logger.exception("Can't re-open [%s]; saving every sheet", self.source)
+            return None
+
+
+    def clean_sheets(self, canvases, source):
         """
-        An existing .wtbd zip must be re-created by copying all files except
-        the pickled file, otherwise it gets added twice
+        Maps each sheet that hasn't changed since it was loaded or saved to its
+        number in the source file. Unloaded sheets that can't be copied from
+        the source are loaded, and saved from scratch.
         """
-        path = os.path.join(os.path.dirname(self.filename), u'whyteboard_temp_new.wtbd')
-        tmp_file = os.path.abspath(path)
-        errored = False
+        clean = {}
+        names = set(source.namelist()) if source else set()
+        for x, canvas in enumerate(canvases):
+            chunk = canvas.chunk
+            if canvas in self.pending:
+                images = self.sheet_images.get(chunk)
+                if (images is None or SHEET_CHUNK % chunk not in names
+                    or not names.issuperset(u"data/" + i for i in images)):
+                    self.load_sheet(canvas)
+            if not canvas.dirty and chunk is not None and SHEET_CHUNK % chunk in names:
+                clean[x] = chunk
+        return clean
+
+
+    def write_save_file(self, save, version, source=None):
+        """
+        Writes the new zip beside the file, then moves it over the file in one
+        step: nothing else touches the disk, and a failed save leaves the file
+        as it was. Unchanged sheets are copied from the source zip. See
+        Compression for how members are compressed.
+        """
+        tmp_file = os.path.abspath(self.filename) + u".tmp"
+        _zip = None
+        written = False
         logger.debug("Creating temporary zip file [%s].", tmp_file)
-        
-        _zip = zipfile.ZipFile(tmp_file, 'w')
-        self.save_bitmap_data(_zip)
-        save.save_items()
-        data = save.create_save_list(self.gui.current_tab, version)
-        data_file = os.path.join(get_home_dir(), "save.data")
-        logger.debug("Writing save data to [%s]", data_file)
-        
-        with open(data_file, 'wb') as f:
-            try:
-                pickle.dump(data, f)
-            except pickle.PickleError:
-                wx.MessageBox(_("Error saving file data"), u"Whyteboard")
-                logger.exception("Error pickling file data")
-                self.saved = False
-                self.filename = None
-                errored = True
-        
-        if not errored:
-            logger.debug("Writing data file to zip and cleaning up")
-            _zip.write(data_file, "save.data")
-        _zip.close()
-        os.remove(data_file)
-        if errored:
-            os.remove(tmp_file)
+
+        try:
+            _zip = zipfile.ZipFile(tmp_file, 'w')
+            self.save_bitmap_data(_zip, source)
+            thumbnails = save.write_thumbnails(_zip, source)
+            manifest = save.create_manifest(self.gui.current_tab, version, thumbnails)
+
+            logger.debug("Writing manifest and %i sheets to zip", len(save.items))
+            save.compression.write(_zip, MANIFEST, json.dumps(manifest))
+            for x in save.items:
+                save.compression.write(_zip, SHEET_CHUNK % x, save.create_sheet_chunk(x))
+            save.write_history(_zip)
+            self.copy_sheets(save.clean, source, _zip)
+            _zip.close()
+            written = True
+        except (pickle.PickleError, TypeError, ValueError, struct.error,
+                EnvironmentError, zipfile.BadZipfile):
+            wx.MessageBox(_("Error saving file data"), u"Whyteboard")
+            logger.exception("Error writing file data")
+            self.saved = False
+            self.filename = None
+        finally:
+            if _zip:
+                _zip.close()
+            if source:
+                source.close()
+            if not written and os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+        if not written:
             return False
-        
-        logger.debug("Removing old file and renaming temporary file")
-        if os.path.exists(self.filename):
-            os.remove(self.filename)
-        shutil.move(tmp_file, self.filename)
 
+        if self.pending:
+            self.zip.close()  # re-opened on the new file once it's in place
 
-    def save_bitmap_data(self, _zip):
-        """
-        Will save all Image tools to disk as temporary files, and then removes
-        them. This function is lengthy because it will not save two idential
-        images twice.
-        """
-        logger.debug("Writing bitmap files to zip")
-        data = {}  # list of bitmap data, check if image has been pasted
-        to_remove = []
-        for canvas in self.gui.get_canvases():
-            for shape in canvas.shapes:
-                if isinstance(shape, tools.Image):
-                    img = shape.image.ConvertToImage()
-                    img_data = img.GetData()
+        logger.debug("Replacing [%s] with the temporary file", self.filename)
+        try:
+            replace_file(tmp_file, self.filename)
+        except EnvironmentError:  # WindowsError too, e.g. the file's open elsewhere
+            logger.exception("Couldn't replace [%s]", self.filename)
+            wx.MessageBox(_('"%s" could not be saved.\nIs it open in another program?')
+                          % os.path.basename(self.filename), u"Whyteboard")
+            self.saved = False
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            if self.pending:
+                self.zip = zipfile.ZipFile(self.zip.filename)  # still as it was
+            return False
+        return True
 
-                    for key, value in data.items():
-                        if value == img_data:
-                            if not shape.filename:
-                                shape.filename = key
-                            break
 
-                    #  the above iteration didn't find any common pastes
-                    if not shape.filename:
-                        tmp_name = make_filename() + u".png"
-                        img.SaveFile(tmp_name, wx.BITMAP_TYPE_PNG)
-                        img = wx.Image(tmp_name)
+    def copy_sheets(self, clean, source, _zip):
+        """Copies unchanged sheets' data and history from the source zip"""
+        names = source.namelist() if source else []
+        for x, chunk in clean.items():
+            copy_member(source, SHEET_CHUNK % chunk, _zip, SHEET_CHUNK % x)
+            for name in HISTORY:
+                if name % chunk in names:
+                    copy_member(source, name % chunk, _zip, name % x)
 
-                        name = make_filename() + u".jpg"
-                        img.SaveFile(name, wx.BITMAP_TYPE_JPEG)
-                        shape.filename = name
-                        data[shape.filename] = img_data
-                        _zip.write(name, os.path.join(u"data", name))
-                        to_remove.append(name)
-                        to_remove.append(tmp_name)
 
-                    else:
-                        name = shape.filename
+    def save_bitmap_data(self, _zip, source=None):
+        """
+        Writes each distinct image to the zip once. Images already in the source
+        zip are copied as they are, and so are those of sheets that haven't been
+        loaded; images from the image store are written without decoding them.
+        Other images are told apart by a hash of their pixels, and
+        written as encode_images() yields them.
+        """
+        logger.debug("Writing bitmap files to zip")
+        written = set()
+        names = set(source.namelist()) if source else set()
+
+        def copy_image(name):
+            if name not in written:
+                if u"data/" + name in names:
+                    copy_member(source, u"data/" + name, _zip)
+                elif name in self.images:
+                    _zip.writestr(u"data/" + name, self.images.data(name))
+                else:
+                    return False
+                written.add(name)
+            return True
 
-                        if not name in to_remove:
-                            data[name] = img_data
-                            img.SaveFile(name, get_wx_image_type(name))
-                            _zip.write(name, os.path.join("data", name))
+        images = []
+        for canvas in self.gui.get_canvases():
+            if canvas in self.pending:
+                for name in self.sheet_images[self.pending[canvas]]:
+                    copy_image(name)
+            else:
+                images.extend(shape for shape in canvas.shapes
+                              if isinstance(shape, tools.Image))
+
+        images = [shape for shape in images
+                  if not (shape.filename and copy_image(shape.filename))]
+        files = {}
+        for digest, (name, data) in self.encode_images(images):
+            files[digest] = name
+            if name not in written:
+                _zip.writestr(u"data/" + name, data)
+                written.add(name)
+        for shape in images:
+            shape.filename = files[shape.get_digest()]
+
+
+    def encode_images(self, shapes):
+        """
+        Yields each distinct image's digest, name and PNG data. Images encoded
+        this session, or imported from a file that was kept, are reused while
+        they're still kept (see EncodedImages). The rest are encoded in batches
+        across a pool of workers (see png.py), to bound the memory used.
+        """
+        seen = set()
+        todo = {}
+        for shape in shapes:
+            digest = shape.get_digest()
+            if digest not in seen:
+                seen.add(digest)
+                image = self.image_files.get(digest)
+                if image:
+                    yield digest, image
+                else:
+                    todo[digest] = shape.image
+        if not todo:
+            return
 
-        [os.remove(x) for x in to_remove]
+        workers = Config().save_workers() or png.cpu_count()
+        logger.debug("Encoding %i images with %i workers", len(todo), workers)
+        digests = todo.keys()
+        batch = workers * ENCODE_BATCH
+        for x in xrange(0, len(digests), batch):
+            chunk = digests[x:x + batch]
+            pixels = [codec.bitmap_pixels(todo[digest]) for digest in chunk]
+            for digest, data in zip(chunk, png.encode_all(pixels, workers)):
+                name = make_filename() + u".png"
+                self.image_files.add(digest, name, data)
+                yield digest, (name, data)
+
+
+    def keep_image_file(self, shape, path):
+        """Keeps an imported image's file, to be saved without re-encoding it"""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except IOError:
+            logger.exception("Couldn't keep [%s]; it will be re-encoded", path)
+            return
+        name = make_filename() + os.path.splitext(path)[1].lower()
+        self.image_files.add(shape.get_digest(), name, data)
 
 
 
@@ -280,6 +609,8 @@ class Utility(object):
         or a single pickled file.
         """
         logger.debug("Loading .wtbd file")
+        self.discard_pending()
+        self.images.clear()
         f = None
         try:
             f = zipfile.ZipFile(filename)
@@ -291,6 +622,9 @@ class Utility(object):
         self.is_zipped = True
         data = None
         self.zip = f
+        if MANIFEST in f.namelist():
+            self.load_manifest(filename)
+            return
         try:
             data = f.read("save.data")
         except KeyError:
@@ -307,50 +641,136 @@ class Utility(object):
     def load_wtbd_pickle(self, filename, pickle_data=None):
         """
         Loads in the old .wtbd format (just a pickled file). Takes in either
-        a filename (path) or a Python file object (from the zip archive)
-        Pretty messy code, to support old save files written in "w", not "wb"
+        a filename (path) or the contents of a zip's save.data
         """
-        sys.modules['tools'] = tools  # monkey patch for new src layout (0.4)
-
-        save_data = {}
         if not pickle_data:
             logger.warning("Loading in older .wtbd save format.")
-            method = pickle.load
-            f = open(filename, 'rb')
-        else:
-            method = pickle.loads
-            f = pickle_data
-
         try:
-            save_data = method(f)
-        except (pickle.UnpicklingError, AttributeError, ValueError, TypeError, EOFError):
+            save_data = unpickle_save(filename, pickle_data)[0]
+        except CORRUPT_PICKLE:
             logger.exception("Save file has corrupt data")
             wx.MessageBox(_('"%s" has corrupt data.\nThis file cannot be loaded.') % os.path.basename(filename),
-                            u"Whyteboard")
+                          u"Whyteboard")
             return
-        except ImportError:  
-            logger.warning("Even older, incompatible save format being used.")
-            if not pickle_data:
-                f.close()
-                f = open(filename, 'r')
+        self.recreate_save(filename, save_data)
+
+
+    def load_manifest(self, filename):
+        """
+        Loads a chunked save file. Only the manifest is read now: each sheet is
+        loaded when it's first viewed, or in the background. The zip is kept
+        open until every sheet has been loaded.
+        """
+        try:
+            manifest = parse_manifest(self.zip)
+        except Exception:
+            logger.exception("Save file has a corrupt manifest")
+            wx.MessageBox(_('"%s" has corrupt data.\nThis file cannot be loaded.') % os.path.basename(filename),
+                          u"Whyteboard")
+            self.zip.close()
+            return
+
+        logger.debug("Recreating %i sheets from manifest", len(manifest['sheets']))
+        settings = [wx.Colour(*manifest['colour']), manifest['thickness'],
+                    manifest['tool'], manifest['tab'], manifest['version'],
+                    manifest['font']]
+        self.filename = filename
+        self.gui.show_progress_dialog(_("Loading..."))
+        self.gui.journal.stop()  # started again once the file's loaded
+        self.gui.remove_all_sheets()
+        self.restore_settings(settings)
+
+        self.source = filename
+        self.sheet_images = {}
+        self.sheet_shapes = {}
+        self.thumbnails = set()
+        for x, sheet in enumerate(manifest['sheets']):
+            self.gui.on_new_tab(name=sheet['name'])
+            self.gui.canvas.resize(tuple(sheet['size']))
+            self.gui.canvas.chunk = x
+            self.gui.canvas.dirty = False  # it's copied as it is until it's loaded
+            self.pending[self.gui.canvas] = x
+            self.sheet_images[x] = sheet['images']
+            self.sheet_shapes[x] = sheet['shapes']
+            if sheet.get('thumbnail'):
+                self.load_thumbnail(x, sheet['thumbnail'])
+
+        self.finish_loading(filename, settings)  # loads the current sheet
+        wx.CallLater(BACKGROUND_DELAY, self.load_next_sheet)
+
+
+    def load_thumbnail(self, x, name):
+        """
+        Shows a sheet's saved thumbnail until the sheet is changed, rather
+        than drawing the sheet to make one
+        """
+        try:
+            self.gui.thumbs.load_thumbnail(x, self.zip.read(name))
+            self.thumbnails.add(x)
+        except Exception:
+            logger.exception("Couldn't load thumbnail [%s]", name)
+
+
+    def load_sheet(self, canvas):
+        """Loads a sheet of a chunked save file, if it's not been loaded yet"""
+        x = self.pending.pop(canvas, None)
+        if x is None:
+            return
+
+        logger.debug("Loading sheet %i from save file", x)
+        try:
+            data = records.loads(self.zip.read(SHEET_CHUNK % x))
+        except Exception:
+            logger.exception("Sheet %i has corrupt data", x)
+            data = {'shapes': [], 'medias': [], 'groups': []}
 
+        for media in data['medias']:
+            media.canvas = canvas
+            media.load()
+            canvas.medias.append(media)
+
+        for shape in data['shapes']:
             try:
-                save_data = method(f)
-            except (pickle.UnpicklingError, AttributeError, ImportError, ValueError, TypeError, EOFError):
-                logger.exception("Save file has corrupt data")
-                wx.MessageBox(_('"%s" has corrupt data.\nThis file cannot be loaded.') % os.path.basename(filename),
-                              u"Whyteboard")
-                return
-            finally:
-                if not pickle_data:
-                    f.close()
-        finally:
-            if not pickle_data:
-                f.close()
+                shape.canvas = canvas
+                shape.load()
+                canvas.add_shape(shape, undoable=False)
+            except Exception:
+                logger.exception("Couldn't load %s", shape)
+                continue
+
+        canvas.restore_groups(data['groups'], data['shapes'])
+        self.load_history(canvas, x)
+        canvas.dirty = False
+        canvas.defer_redraw()
+        if x not in self.thumbnails:
+            self.gui.thumbs.schedule(self.gui.tabs.GetPageIndex(canvas))
+
+        if not self.pending:
+            logger.debug("Every sheet has been loaded")
+            self.zip.close()
+
+
+    def load_next_sheet(self):
+        """Loads the remaining sheets one at a time, in the background"""
+        for canvas in self.gui.get_canvases():
+            if canvas in self.pending:
+                self.load_sheet(canvas)
+                break
+        if self.pending:
+            wx.CallLater(BACKGROUND_DELAY, self.load_next_sheet)
 
-        logger.debug("Removing tools namespace")
-        del sys.modules['tools']
-        self.recreate_save(filename, save_data)
+
+    def load_all_sheets(self):
+        """Before anything that needs every sheet, e.g. saving or printing"""
+        for canvas in self.gui.get_canvases():
+            self.load_sheet(canvas)
+
+
+    def discard_pending(self):
+        """Forgets any sheets yet to be loaded, e.g. before loading another file"""
+        if self.pending:
+            self.pending = {}
+            self.zip.close()
 
 
     def recreate_save(self, filename, save_data):
@@ -359,16 +779,11 @@ class Utility(object):
         """
         logger.debug("Recreating save file")
         self.filename = filename
+        self.source = None  # sheets are all written out on the first save
         self.gui.show_progress_dialog(_("Loading..."))
+        self.gui.journal.stop()
         self.gui.remove_all_sheets()
-
-        # change program settings and update the Preview window
-        self.colour = save_data[0][0]
-        self.thickness = save_data[0][1]
-        self.tool = save_data[0][2]
-        self.gui.control.change_tool(_id=self.tool)  # toggle button
-        self.gui.control.colour.SetColour(self.colour)
-        self.gui.control.thickness.SetSelection(self.thickness - 1)
+        self.restore_settings(save_data[0])
 
         # re-create tabs and its saved drawings
         for x in save_data[1]:
@@ -393,26 +808,46 @@ class Utility(object):
                 try:
                     shape.canvas = self.gui.canvas  # restore canvas
                     shape.load()  # restore unpickleable settings
-                    self.gui.canvas.add_shape(shape)
+                    self.gui.canvas.add_shape(shape, undoable=False)
                 except Exception:
                     break
-            self.gui.canvas.redraw_all(True)
 
-        # close progress bar, handle older file versions gracefully
+            if 6 in save_data and x in save_data[6]:
+                self.gui.canvas.restore_groups(save_data[6][x], save_data[1][x])
+            self.load_history(self.gui.canvas, x)
+            self.gui.canvas.defer_redraw()  # thumbnails are made in on_done_load
+
+        self.finish_loading(filename, save_data[0])
+
+
+    def restore_settings(self, settings):
+        """change program settings and update the Preview window"""
+        self.colour = settings[0]
+        self.thickness = settings[1]
+        self.tool = settings[2]
+        self.gui.control.change_tool(_id=self.tool)  # toggle button
+        self.gui.control.colour.SetColour(self.colour)
+        self.gui.control.thickness.SetSelection(self.thickness - 1)
+
+
+    def finish_loading(self, filename, settings):
+        """close progress bar, handle older file versions gracefully"""
         wx.PostEvent(self.gui, self.gui.LoadEvent())
         self.mark_saved()
-        self.saved_version = save_data[0][4]
+        self.saved_version = settings[4]
         pub.sendMessage('canvas.change_tool')
-        self.gui.tabs.SetSelection(save_data[0][3])
+        self.gui.tabs.SetSelection(settings[3])
         self.gui.on_change_tab()
         self.gui.SetTitle(u"%s - %s" % (os.path.basename(filename), self.gui.title))
+        for tab in self.gui.closed_tabs:
+            tab.close()
         self.gui.closed_tabs = list()
 
         try:
-            if save_data[0][5]:
-                logger.debug("Setting default font from save file: [%s]", save_data[0][5])
+            if settings[5]:
+                logger.debug("Setting default font from save file: [%s]", settings[5])
                 font = wx.FFont(1, wx.FONTFAMILY_DEFAULT)
-                font.SetNativeFontInfoFromString(save_data[0][5])
+                font.SetNativeFontInfoFromString(settings[5])
                 self.font = font
         except IndexError:
             pass
@@ -420,6 +855,26 @@ class Utility(object):
         #  Don't save .wtbd file of future versions as current, older version
         if version_is_greater(self.saved_version, meta.version):
             self.update_version = False
+        self.gui.journal.start()
+
+
+    def load_history(self, canvas, sheet):
+        """
+        Restores a sheet's undo/redo history from the save file, leaving each
+        action packed until it's needed
+        """
+        if not self.is_zipped:
+            return
+        try:
+            undo = decode_log(self.zip.read(u"history/%i.undo" % sheet))
+            redo = decode_log(self.zip.read(u"history/%i.redo" % sheet))
+        except KeyError:
+            return
+
+        logger.debug("Restoring %i undo and %i redo actions for sheet %i",
+                     len(undo), len(redo), sheet)
+        canvas.undo_list.attach([PackedUndo(canvas, record) for record in undo])
+        canvas.redo_list = [PackedUndo(canvas, record) for record in redo]
 
 
     def save_last_path(self, path):
@@ -434,89 +889,265 @@ class Utility(object):
     def convert(self):
         """
         If the filetype is PDF/PS, convert to a (temporary) series of images and
-        loads them. Find out the directory length before/after the conversion to
-        know how many 'pages' were converted - used then to create a new
-        Whyteboard tabs for each page. The PDF's file location, convert quality
-        and converted images are written into a "library" file, effectively
-        caching the conversion.
+        loads them, creating a new Whyteboard tab for each page. Pages are
+        converted in parallel, in the background (see converter.py): the tabs
+        are created first, and each page's image is added once it's converted.
+        Pages are rendered to fit the canvas' width; see render_high_res for
+        printing. The converted images are kept in the PDF cache (see
+        pdfcache.py), by the PDF's contents, backend, quality and resolution.
+        """
+        _file = self.temp_file
+        found = self.find_rasterizer(_file)
+        if not found:
+            return
+        backend, location = found
+        logger.info("Converting [%s] with %s", os.path.basename(_file), backend.label)
+
+        data = read_file(_file)  # read once, for its page size and count and its digest
+        quality = Config().convert_quality()
+        dpi = screen_dpi(quality, page_size(_file, data), Config().default_width())
+        key = backend.cache_key(quality, dpi)
+        cached = self.library.lookup(_file, key, data)
+        if not cached:
+            pages = page_count(_file, data)
+            converter = Converter(backend, location, _file, quality,
+                                  self.conversion_directory(_file, key), pages,
+                                  on_page=self.on_converted_page,
+                                  on_done=self.on_converted, dpi=dpi)
+            sheets = []
+            if pages:
+                sheets = self.create_page_sheets(_file, pages, pages == 1)
+            self.imports[converter] = (_file, key, sheets)
+            logger.info("Starting to convert PDF")
+            if not self.gui.convert_dialog(converter):  # progress bar, kick off convert
+                del self.imports[converter]
+                self.conversion_failed()
+            return
+
+        logger.debug("PDF is cached")
+        self.display_converted(_file, cached)
+        # Just in case it's a file with many pages
+        self.gui.show_progress_dialog(_("Loading..."))
+        self.gui.on_done_load()
+
+
+    def conversion_directory(self, _file, key):
+        digest = self.library.identify(_file)[0]
+        directory = tempfile.mkdtemp(prefix=u"%s-%s-" % (digest[:16], key),
+                                     dir=get_home_dir(u"wtbd-tmp"))
+        logger.debug("Writing PDF images into [%s]", directory)
+        return directory
 
-        An attempt at randomising the temp. file name is made using alphanumeric
-        characters to help minimise conflict.
+
+    def find_rasterizer(self, _file):
+        """
+        The backend to convert a file with, and its program (see
+        rasterizers.py). Asks where ImageMagick is if nothing else can
         """
+        found = choose(Config().pdf_backend(), _file, Config().imagemagick_path())
+        if found:
+            return found
         if not self.im_location:
             self.prompt_for_im()
+        if self.im_location:
+            return ImageMagick(), self.im_location
+        return None
 
-        if not self.im_location:  # above will have changed this if IM exists
-            return
 
-        _file = self.temp_file
-        logger.info("Converting [%s]", os.path.basename(_file))
+    def on_converted_page(self, converter, page, path):
+        """Adds a page's image to its sheet, if the sheet's still open"""
+        _file, key, sheets = self.imports[converter]
+        if page < len(sheets) and sheets[page] in self.gui.get_canvases():
+            self.attach_page(path, sheets[page], (_file, page))
 
-        quality = Config().convert_quality()
-        cached = self.library.lookup(_file, quality)
-        if cached:
-            logger.debug("PDF is cached")
-            self.display_converted(_file, cached)
+
+    def on_converted(self, converter):
+        """Once every page is converted; caches the pages if none failed"""
+        _file, quality, sheets = self.imports.pop(converter)
+        self.gui.converters.remove(converter)
+        if converter.cancelled:
+            logger.info("Convert process cancelled by user")
+            converter.remove_output()
+            return
+
+        images = converter.images()
+        logger.info("Convert process complete. %i images were created", len(images))
+        if not images:
+            logger.warning("Failed to convert.")
+            converter.remove_output()
+            self.conversion_failed()
+            return
+        if not sheets:  # its pages weren't known until now
+            self.display_converted(_file, images, len(images) == 1)
+            self.gui.on_done_load()
+        if len(images) < len(sheets):
+            logger.warning("Only %i of %i pages were converted", len(images), len(sheets))
+            converter.remove_output()  # its sheets have read what there is
         else:
-            path = get_home_dir(u"wtbd-tmp")  # directory to store the images
-            tmp_file = make_filename()
-            before = os.walk(path).next()[2]  # file count before convert
-            full_path = path + tmp_file + u".png"
-            logger.debug("Writing PDF images as [%s]", full_path)
+            self.library.write(_file, images, quality)
 
-            cmd = convert_quality(quality, self.im_location, _file, full_path)
-            logger.info("Starting to convert PDF")
-            self.gui.convert_dialog(cmd)  # show progress bar, kick off convert
-
-            if self.gui.convert_cancelled:
-                logger.info("Convert process cancelled by user")
-                return
-            after = os.walk(path).next()[2]
-            count = len(after) - len(before)
-            images = []
-            ignore = False
-            logger.info("Convert process complete. %i images were created", count)
-
-            if not count:
-                logger.warning("Failed to convert.")
-                wx.MessageBox(_("Failed to convert file. Ensure GhostScript is installed\nhttp://pages.cs.wisc.edu/~ghost/"), _("Conversion Failed"))
-                open_url(u"http://pages.cs.wisc.edu/~ghost/")
-                return
-
-            if count == 1:
-                images.append(path + tmp_file + u".png")
-                ignore = True
+
+    def conversion_failed(self):
+        wx.MessageBox(_("Failed to convert file. Ensure GhostScript is installed\nhttp://pages.cs.wisc.edu/~ghost/"), _("Conversion Failed"))
+        open_url(u"http://pages.cs.wisc.edu/~ghost/")
+
+
+    def prioritise_page(self, canvas):
+        """Converts the page being viewed next, if it's still converting"""
+        for converter, (_file, quality, sheets) in self.imports.items():
+            if canvas in sheets:
+                converter.prioritise(sheets.index(canvas))
+
+
+    def render_high_res(self, canvases):
+        """
+        Renders the converted pages on some sheets at print resolution, in the
+        background, unless they already have been. They're found in the PDF
+        cache if they've been rendered before
+        """
+        wanted = {}  # file: {page number: [its images]}
+        for canvas in canvases:
+            for shape in canvas.shapes:
+                if isinstance(shape, tools.Image) and shape.page and not shape.high_res:
+                    _file, page = shape.page
+                    wanted.setdefault(_file, {}).setdefault(page, []).append(shape)
+
+        rendering = [(_file, key) for _file, key, pages in self.renders.values()]
+        for _file, pages in wanted.items():
+            found = os.path.exists(_file) and choose(Config().pdf_backend(), _file,
+                                                     Config().imagemagick_path())
+            if not found:
+                continue
+            backend, location = found
+            quality = Config().convert_quality()
+            dpi = print_dpi(quality)
+            key = backend.cache_key(quality, dpi)
+            if (_file, key) in rendering:
+                continue
+
+            cached = self.library.lookup(_file, key)
+            if cached:
+                for page, shapes in pages.items():
+                    for shape in shapes:
+                        if page < len(cached):
+                            shape.high_res = cached[page]
+                continue
+
+            logger.info("Rendering [%s] at %i dpi", os.path.basename(_file), dpi)
+            converter = Converter(backend, location, _file, quality,
+                                  self.conversion_directory(_file, key),
+                                  page_count(_file), on_page=self.on_high_res_page,
+                                  on_done=self.on_high_res, dpi=dpi)
+            converter.prioritise(min(pages))
+            if converter.start():
+                self.renders[converter] = (_file, key, pages)
+                self.gui.converters.append(converter)
             else:
-                for x in range(count):
-                    # store the temp file path for this file in the dictionary
-                    images.append(u"%s%s-%i.png" % (path, tmp_file, x))
+                converter.remove_output()
 
-            self.display_converted(_file, images, ignore)
-            self.library.write(_file, images, quality)
 
-        # Just in case it's a file with many pages
-        self.gui.show_progress_dialog(_("Loading..."))
-        self.gui.on_done_load()
+    def on_high_res_page(self, converter, page, path):
+        for shape in self.renders[converter][2].get(page, []):
+            shape.high_res = path
 
 
-    def display_converted(self, _file, images, ignore_close=False):
+    def on_high_res(self, converter):
+        """Caches a file's high resolution pages, once they're all rendered"""
+        _file, key, pages = self.renders.pop(converter)
+        self.gui.converters.remove(converter)
+        images = converter.images()
+        if not converter.cancelled and images and len(images) == (converter.pages or len(images)):
+            self.library.write(_file, images, key)
+            return
+
+        for shapes in pages.values():  # they'd point at deleted renders
+            for shape in shapes:
+                if shape.high_res in images:
+                    shape.high_res = None
+        converter.remove_output()
+
+
+    def create_page_sheets(self, _file, count, ignore_close=False):
         """
-        Display converted items. _file: PDF/PS name. Images: list of files
+        A sheet for each page of a converted file, showing the first; their
+        images are added as the pages are converted
         """
-        logger.debug("Displaying PDF images")
         if not ignore_close and self.gui.tab_count == 1 and not self.gui.canvas.shapes:
             logger.info("Closing all sheets")
             self.gui.remove_all_sheets()
 
-        for x in range(len(images)):
-            name = u"%s - %s" % (os.path.basename(_file)[:15], x + 1)
-            self.gui.on_new_tab(name=name)
-            load_image(images[x], self.gui.canvas, tools.Image)
-        
+        sheets = []
+        for x in range(count):
+            self.gui.on_new_tab(name=u"%s - %s" % (os.path.basename(_file)[:15], x + 1))
+            sheets.append(self.gui.canvas)
+        self.gui.tabs.SetSelection(self.gui.tabs.GetPageIndex(sheets[0]))
+        self.gui.on_change_tab()
+        return sheets
+
+
+    def display_converted(self, _file, images, ignore_close=False):
+        """
+        Display converted items. _file: PDF/PS name. Images: list of files
+        """
+        logger.debug("Displaying PDF images")
+        sheets = self.create_page_sheets(_file, len(images), ignore_close)
+        for x, canvas in enumerate(sheets):
+            self.add_page(images[x], canvas, (_file, x))
+
         logger.debug("Files loaded - redrawing canvas")
         self.gui.canvas.redraw_all()
 
 
+    def add_page(self, path, canvas, page=None):
+        """
+        Adds a converted page as an image that's only decoded and drawn once
+        it's shown (see ImageStore). page is its (file, page number)
+        """
+        shape = self.page_image(path, canvas, page)
+        if not shape:
+            load_image(path, canvas, tools.Image)
+            return
+        canvas.defer_redraw()
+        shape.place(0, 0)
+
+
+    def attach_page(self, path, canvas, page=None):
+        """
+        Adds a page converted in the background to its sheet, underneath
+        anything already drawn on it. Not undoable: it's the page itself
+        """
+        shape = self.page_image(path, canvas, page)
+        if not shape:
+            return
+        canvas.mark_unsaved()  # before, so the journal sees a new shape
+        shape.x = shape.y = 0
+        canvas.shapes.insert(0, shape)
+        canvas.index.invalidate()
+        canvas.resize_if_large_image(shape.size)
+        shape.sort_handles()
+        canvas.defer_redraw()
+        self.gui.thumbs.schedule(self.gui.tabs.GetPageIndex(canvas))
+
+
+    def page_image(self, path, canvas, page=None):
+        """An Image of a converted page, kept encoded; None if it's not a PNG"""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except IOError:
+            data = ""
+        size = png.image_size(data)
+        if not size:
+            return None
+
+        shape = tools.Image(canvas, None, path)
+        shape.filename = make_filename() + u".png"
+        shape.size = shape.scale_size = size
+        shape.page = page
+        self.images.add(shape.filename, data)
+        return shape
+
+
     def export(self, filename):
         """
         Exports the current view as a file. Select the appropriate wx constant
@@ -524,6 +1155,7 @@ class Utility(object):
         """
         const = get_wx_image_type(filename)
         self.gui.canvas.deselect_shape()
+        self.gui.canvas.ensure_drawn()
 
         context = wx.MemoryDC(self.gui.canvas.buffer)
         memory = wx.MemoryDC()
@@ -541,13 +1173,11 @@ class Utility(object):
         initialisation. Save location to config file.
         """
         if os.name == "posix":
-            value = os.system(u"which convert")
-            if value == 256:
+            self.im_location = ImageMagick().find()
+            if not self.im_location:
                 logger.warning("Could not find ImageMagick")
                 wx.MessageBox(_("ImageMagick was not found. You will be unable to load PDF and PS files until it is installed."),
                               u"Whyteboard")
-            else:
-                self.im_location = u"convert"
         elif os.name == "nt":
             if not Config().imagemagick_path():
                 self.gui.prompt_for_im()
@@ -599,48 +1229,6 @@ class Utility(object):
 
 #----------------------------------------------------------------------
 
-class PDFCache(object):
-    """
-    Represents a cache of any converted PDF files
-    """
-    def __init__(self, filename):
-        self.path = os.path.join(get_home_dir(), filename)
-        logger.debug("Using PDF cache at [%s]", self.path)
-        if not os.path.exists(self.path):
-            logger.debug("Cache file does not exist - creating it")
-            self.write_dict(dict())
-
-
-    def lookup(self, _file, quality):
-        """Check whether a file is inside our known file library"""
-        files = self.entries()
-
-        for x, key in files.items():
-            if files[x]['file'] == _file and files[x]['quality'] == quality:
-                return files[x]['images']
-        return False
-
-
-    def write(self, location, images, quality):
-        """Adds a newly converted file to the library"""
-        logger.debug("Adding [%s] at [%s] quality to cache", os.path.basename(location), quality)
-        files = self.entries()
-        files[len(files)] = {'file': location, 'images': images,
-                             'quality': quality, 'date': time.asctime()}
-        self.write_dict(files)
-
-
-    def write_dict(self, files):
-        logger.debug("Writing to PDF cache")
-        with open(self.path, "w") as f:
-            pickle.dump(files, f)
-
-
-    def entries(self):
-        with open(self.path) as f:
-            return pickle.load(f)
-
-
 #----------------------------------------------------------------------
 
 
@@ -648,72 +1236,103 @@ class Save(object):
     """
     Stores the data required to save a file.
     """
-    def __init__(self, util, canvases, names):
+    def __init__(self, util, canvases, names, clean=None):
         self.util = util
+        self.canvases = canvases
         self.names = names
+        self.clean = clean or {}  # sheet: number in the source file
         self.medias = []
         self.canvas_sizes = []
-        self.tree_ids = []
         self.items = {}
+        self.groups = {}
+        self.history = {}
+        self.compression = Compression()
+        depth = Config().undo_save_depth()
 
         for x, canvas in enumerate(canvases):
-            for media in canvas.medias:
-                media.save()
-
-            self.items[x] = list(canvas.shapes)
             self.canvas_sizes.append(canvas.area)
             self.medias.append(canvas.medias)
+            if x in self.clean:
+                continue
+            self.items[x] = list(canvas.shapes)
+            self.groups[x] = canvas.group_indexes()
+            if depth:
+                self.history[x] = self.pack_history(canvas, depth)
 
 
-    def save_items(self):
+    def pack_history(self, canvas, depth):
         """
-        Remove any unpickleable items from the list of shapes
+        The canvas' newest undo/redo actions, packed while its shapes are still
+        intact. Stops at the first action that can't be packed
         """
-        for x in self.items:
-            for shape in self.items[x]:
-                if isinstance(shape, tools.Note):
-                    self.tree_ids.append(shape.tree_id)
-                    shape.tree_id = None
-                try:
-                    shape.save()
-                except Exception:
-                    break
+        redo = []
+        for action in reversed(canvas.redo_list):
+            if len(redo) == depth:
+                break
+            try:
+                redo.append(action.record(True))
+            except Exception:
+                logger.exception("Couldn't save redo action %s", action)
+                break
+        redo.reverse()
+        return encode_log(canvas.undo_list.records(depth)), encode_log(redo)
 
 
-    def create_save_list(self, tab, version):
-        """
-        Creates the save list. This *really* needs to be revised, using ints
-        as dictionary keys! ugh.
-        """
-        font = None
-        if self.util.font:
-            font = self.util.font.GetNativeFontInfoDesc()
+    def write_history(self, _zip):
+        for x, (undo, redo) in self.history.items():
+            self.compression.write(_zip, HISTORY[0] % x, undo)
+            self.compression.write(_zip, HISTORY[1] % x, redo)
+
+
+    def image_names(self, x):
+        """The images in the zip that a sheet's shapes use"""
+        canvas = self.canvases[x]
+        if canvas in self.util.pending:
+            return self.util.sheet_images[self.util.pending[canvas]]
+        return sorted(set(shape.filename for shape in canvas.shapes
+                          if isinstance(shape, tools.Image) and shape.filename))
+
 
-        return { 0: [self.util.colour, self.util.thickness, self.util.tool, tab,
-                      version, font],
-                  1: self.items,
-                  2: None, # was self.to_convert, but wasn't used.
-                  3: self.names,
-                  4: self.canvas_sizes,
-                  5: self.medias }
+    def shape_count(self, x):
+        canvas = self.canvases[x]
+        if canvas in self.util.pending:
+            return self.util.sheet_shapes[self.util.pending[canvas]]
+        return len(canvas.shapes)
 
 
-    def restore_items(self, canvases):
+    def write_thumbnails(self, _zip, source):
         """
-        Fixes a bug with Windows, where the save_items() fuction unlinks each
-        shape's canvas'
+        Writes each sheet's thumbnail, returning the sheets that have one.
+        Unchanged sheets keep the thumbnail in the source file, if it has one
         """
-        count = 0
-        for x in self.items:
-            canvas = canvases[x]
-            for shape in self.items[x]:
-                shape.canvas = canvas
-                if isinstance(shape, tools.Note):
-                    shape.load(False)
-                    shape.tree_id = self.tree_ids[count]
-                    count += 1
-                else:
-                    shape.load()
-            for m in canvas.medias:
-                m.canvas = canvas
-                m.load()
+        written = set()
+        names = set(source.namelist()) if source else set()
+        for x, canvas in enumerate(self.canvases):
+            if x in self.clean and THUMBNAIL % self.clean[x] in names:
+                copy_member(source, THUMBNAIL % self.clean[x], _zip, THUMBNAIL % x)
+            elif canvas in self.util.pending:
+                continue
+            else:
+                bitmap = self.util.gui.thumbs.thumbnail(x)
+                self.compression.write(_zip, THUMBNAIL % x,
+                                       png.encode_png(*codec.bitmap_pixels(bitmap)))
+            written.add(x)
+        return written
+
+
+    def create_manifest(self, tab, version, thumbnails):
+        """The program settings, and each sheet's name, size, shapes and images"""
+        manifest = manifest_settings(self.util, tab, version)
+        manifest['sheets'] = [{'name': name, 'size': size,
+                               'shapes': self.shape_count(x),
+                               'images': self.image_names(x),
+                               'thumbnail': THUMBNAIL % x if x in thumbnails else None}
+                              for x, (name, size) in enumerate(zip(self.names, self.canvas_sizes))]
+        return manifest
+
+
+    def create_sheet_chunk(self, x):
+        """A sheet's shapes as records, to be loaded independently"""
+        return self.compression.chunk({'shapes': self.items[x],
+                                       'medias': self.medias[x],
+                                       'groups': self.groups[x]})
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""
+Tests for autosaves: a snapshot of the sheets is written to a recovery file,
+which is offered back if the Whyteboard that wrote it is no longer running
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import zipfile
+
+import wx
+
+import whyteboard.tools as tools
+
+from whyteboard.test import fakewidgets
+from whyteboard.core import Config
+from whyteboard.lib import Mock
+from whyteboard.lib.mock import patch
+from whyteboard.misc import records, utility
+from whyteboard.misc.autosave import AutoSave, RECOVERY_FILE, RECOVERED_FILE
+
+#----------------------------------------------------------------------
+
+class FakeCanvas(object):
+    def __init__(self):
+        self.overlay = None
+        self.shapes = [tools.Rectangle(self, (0, 0, 0), 1) for x in range(3)]
+        self.medias = []
+        self.area = (800, 600)
+        self.dirty = True
+        self.chunk = None
+        self.version = 0
+
+    def group_indexes(self):
+        return [[0, 1]]
+
+
+class FakeColour(object):
+    def __init__(self, red, green, blue):
+        self.rgb = (red, green, blue)
+
+    def Red(self):
+        return self.rgb[0]
+
+    def Green(self):
+        return self.rgb[1]
+
+    def Blue(self):
+        return self.rgb[2]
+
+
+class FakeGUI(object):
+    def __init__(self):
+        self.current_tab = 0
+        self.canvases = []
+        self.journal = Mock()
+
+    def Bind(self, *args):
+        pass
+
+    def get_canvases(self):
+        return self.canvases
+
+    def get_tab_names(self):
+        return [u"Sheet %i" % (x + 1) for x in range(len(self.canvases))]
+
+    def mark_unsaved(self):
+        self.unsaved = True
+
+
+def dead_pid():
+    """The process ID of a process that's been and gone"""
+    process = subprocess.Popen([sys.executable, "-c", ""])
+    process.wait()
+    return process.pid
+
+
+class TestAutoSave(object):
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        Config().init(os.path.join(self.dir, u"user.pref"))
+        self.gui = FakeGUI()
+        self.gui.util = utility.Utility(self.gui, os.path.join(self.dir, u"pdfcache.db"))
+        self.gui.util.filename = u"document.wtbd"
+        self.gui.canvases = [FakeCanvas()]
+        self.shapes = self.gui.canvases[0].shapes
+
+        self.autosave = AutoSave(self.gui)
+        self.autosave.directory = self.dir
+        self.autosave.filename = os.path.join(self.dir, RECOVERY_FILE % os.getpid())
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def recovery_file(self, pid):
+        path = os.path.join(self.dir, RECOVERY_FILE % pid)
+        f = open(path, "wb")
+        f.close()
+        return path
+
+
+    def test_snapshot(self):
+        """Shapes are copied, so later changes aren't autosaved half-made"""
+        snapshot = self.autosave.snapshot()
+        sheet = snapshot['sheets'][0]
+        assert [shape.uid for shape in sheet['shapes']] == [shape.uid for shape in self.shapes]
+        assert not set(sheet['shapes']) & set(self.shapes)
+        self.shapes[0].x = 50
+        assert sheet['shapes'][0].x != 50
+        assert sheet['count'] == 3
+        assert snapshot['filename'] == u"document.wtbd"
+
+    def test_snapshot_colours(self):
+        """Colours are read on the GUI thread, so the worker never calls wx"""
+        self.shapes[0].colour = FakeColour(10, 20, 30)
+        sheet = self.autosave.snapshot()['sheets'][0]
+        assert sheet['shapes'][0].colour == (10, 20, 30, 255)
+        assert isinstance(self.shapes[0].colour, FakeColour)
+
+    def test_write(self):
+        self.autosave.write(self.autosave.snapshot())
+
+        manifest = utility.read_manifest(self.autosave.filename)
+        assert manifest['filename'] == u"document.wtbd"
+        assert manifest['sheets'][0]['shapes'] == 3
+        _zip = zipfile.ZipFile(self.autosave.filename)
+        data = records.loads(_zip.read(utility.SHEET_CHUNK % 0))
+        _zip.close()
+        assert [shape.uid for shape in data['shapes']] == [shape.uid for shape in self.shapes]
+        assert data['groups'] == [[0, 1]]
+
+    def test_unchanged_sheets_are_reused(self):
+        """A sheet that hasn't changed since the last autosave isn't encoded again"""
+        self.autosave.write(self.autosave.snapshot())
+        snapshot = self.autosave.snapshot()
+        assert 'shapes' not in snapshot['sheets'][0]
+        assert snapshot['sheets'][0]['chunk']
+
+    def test_recovery_files(self):
+        """Those of Whyteboards that are still running are left alone"""
+        crashed = self.recovery_file(dead_pid())
+        self.recovery_file(os.getppid())
+        self.autosave.write(self.autosave.snapshot())
+        assert self.autosave.recovery_files() == [crashed]
+
+    @patch('wx.MessageBox')
+    def test_recover(self, message):
+        message.return_value = wx.YES
+        crashed = os.path.join(self.dir, RECOVERY_FILE % dead_pid())
+        self.autosave.filename = crashed
+        self.autosave.write(self.autosave.snapshot())
+        running = self.recovery_file(os.getppid())
+        self.gui.util.filename = None
+        self.gui.util.load_wtbd = Mock()
+
+        self.autosave.filename = os.path.join(self.dir, RECOVERY_FILE % os.getpid())
+        self.autosave.recover()
+        path = os.path.join(self.dir, RECOVERED_FILE % os.getpid())
+        self.gui.util.load_wtbd.assert_called_with(path)
+        assert self.gui.util.filename == u"document.wtbd"
+        assert self.gui.unsaved
+        assert os.path.exists(path)
+        assert os.path.exists(running)
+        assert not os.path.exists(crashed)
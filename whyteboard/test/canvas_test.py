@@ -149,6 +149,52 @@ class TestCanvas:
         assert not self.canvas.shapes[2].selected
 
 
+    def test_select_shape_add(self):
+        """Adding to the selection keeps the previously selected shapes"""
+        shape, other = self.canvas.shapes[3], self.canvas.shapes[2]
+        self.canvas.select_shape(shape)
+        self.canvas.select_shape(other, add=True)
+        assert self.canvas.selected == other
+        assert self.canvas.selection == set([shape, other])
+        self.canvas.deselect_shape()
+        assert not self.canvas.selection
+        assert not shape.selected and not other.selected
+
+
+    def test_group_selection(self):
+        """Selecting one shape of a group selects the whole group"""
+        shape, other = self.canvas.shapes[3], self.canvas.shapes[2]
+        self.canvas.select_shape(shape)                # given
+        self.canvas.select_shape(other, add=True)
+        self.canvas.group_selection()
+        self.canvas.deselect_shape()
+
+        self.canvas.select_shape(shape)                # when
+        assert self.canvas.selection == set([shape, other])  # then
+
+        self.canvas.ungroup_selection()
+        self.canvas.select_shape(shape)
+        assert self.canvas.selection == set([shape])
+
+
+    def test_group_indexes(self):
+        """Groups are saved as shape positions and restored from them"""
+        self.canvas.groups = [set([self.canvas.shapes[1].uid, self.canvas.shapes[4].uid])]
+        indexes = self.canvas.group_indexes()
+        assert indexes == [[1, 4]]
+        self.canvas.groups = []
+        self.canvas.restore_groups(indexes)
+        assert self.canvas.group_indexes() == [[1, 4]]
+
+
+    def test_restore_groups_by_uid(self):
+        """A shape that failed to load doesn't shift the other groups"""
+        saved = list(self.canvas.shapes)
+        self.canvas.shapes.remove(saved[0])  # as if it couldn't be loaded
+        self.canvas.restore_groups([[0, 2], [3, 4]], saved)
+        assert self.canvas.groups == [set([saved[3].uid, saved[4].uid])]
+
+
     def test_toggle_transparency(self):
         """Shape's transparency should be toggled on/off"""
         shape = self.canvas.shapes[3]
@@ -187,7 +233,7 @@ class TestCanvas:
 
     def test_undo(self):
         """Undo reverts to previous states"""
-        shapes = self.canvas.shapes
+        shapes = list(self.canvas.shapes)
         assert len(self.canvas.redo_list) == 0
         self.canvas.undo()
         assert shapes != self.canvas.shapes
@@ -291,3 +337,58 @@ class TestCanvas:
         assert self.canvas.shapes[0] == shape
         assert self.canvas.shapes[1] == bottom_shape
 
+
+#----------------------------------------------------------------------
+
+class FakeShape(object):
+    def __init__(self):
+        self.selected = False
+        self.drawn = 0
+
+    def draw(self, dc, replay=False):
+        self.drawn += 1
+
+
+class DrawnCanvas(Canvas):
+    """Just what a Canvas needs to draw its shapes, counting its redraws"""
+    def __init__(self):
+        self.shapes = [FakeShape(), FakeShape()]
+        self.text = None
+        self.copy = None
+        self.buffer = Bitmap(None)
+        self.stale = False
+        self.redraws = 0
+
+    def redraw_all(self, *args, **kwargs):
+        self.redraws += 1
+        Canvas.redraw_all(self, *args, **kwargs)
+
+    def Refresh(self):
+        pass
+
+
+class TestDeferredRedraw:
+    """
+    Loaded sheets are drawn when they're first needed, rather than up front
+    """
+    def setup(self):
+        self.canvas = DrawnCanvas()
+
+    def test_defer_redraw(self):
+        self.canvas.defer_redraw()
+        assert self.canvas.stale
+        assert self.canvas.redraws == 0
+        assert [shape.drawn for shape in self.canvas.shapes] == [0, 0]
+
+    def test_ensure_drawn(self):
+        """A deferred sheet is drawn once, however often it's needed"""
+        self.canvas.defer_redraw()
+        self.canvas.ensure_drawn()
+        self.canvas.ensure_drawn()
+        assert not self.canvas.stale
+        assert self.canvas.redraws == 1
+        assert [shape.drawn for shape in self.canvas.shapes] == [1, 1]
+
+    def test_ensure_drawn_when_drawn(self):
+        self.canvas.ensure_drawn()
+        assert self.canvas.redraws == 0
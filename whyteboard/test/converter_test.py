@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+
+"""
+Tests for splitting a PDF/PS conversion into page ranges
+"""
+
+import os
+import tempfile
+import zlib
+
+from whyteboard.misc.converter import page_count, page_ranges, page_size, prioritise
+
+#----------------------------------------------------------------------
+
+def make_file(data):
+    handle, path = tempfile.mkstemp()
+    os.write(handle, data)
+    os.close(handle)
+    return path
+
+
+class TestConverter(object):
+    def test_page_ranges(self):
+        """Every page is in one range, and each worker gets a few"""
+        ranges = page_ranges(150, 8)
+        assert ranges[0] == (0, 6) and ranges[-1] == (147, 149)
+        assert sum(last - first + 1 for first, last in ranges) == 150
+        assert page_ranges(1, 8) == [(0, 0)]
+        assert page_ranges(1000, 2)[1] == (10, 19)  # at most MAX_RANGE pages
+
+    def test_prioritise(self):
+        """A page and the next come first, and no page is lost or repeated"""
+        ranges = prioritise([(0, 9), (10, 19)], 9)
+        assert ranges[:2] == [(9, 9), (10, 10)]
+        assert sorted(ranges) == [(0, 8), (9, 9), (10, 10), (11, 19)]
+        assert prioritise([(3, 3)], 3) == [(3, 3)]
+        assert prioritise([], 3) == []
+
+    def test_pdf_page_count(self):
+        """Pages are counted, including those packed in object streams"""
+        packed = zlib.compress("<< /Type /Page >> << /Type/Page /Parent 1 0 R >>")
+        pdf = ("%PDF-1.5\n1 0 obj << /Type /Pages /Count 3 >> endobj\n"
+               "2 0 obj << /Type /Page >> endobj\n"
+               "3 0 obj << /Type /ObjStm /N 2 /Filter /FlateDecode >>\nstream\n"
+               + packed + "\nendstream endobj")
+        path = make_file(pdf)
+        try:
+            assert page_count(path) == 3
+        finally:
+            os.remove(path)
+
+    def test_pdf_incremental_updates(self):
+        """
+        Updates append new versions of objects: the last trailer's page tree
+        is counted, not every page object
+        """
+        pdf = ("%PDF-1.4\n1 0 obj << /Type /Catalog /Pages 2 0 R >> endobj\n"
+               "2 0 obj << /Type /Pages /Kids [3 0 R 4 0 R] /Count 2 >> endobj\n"
+               "3 0 obj << /Type /Page /Parent 2 0 R >> endobj\n"
+               "4 0 obj << /Type /Page /Parent 2 0 R >> endobj\n"
+               "trailer << /Size 5 /Root 1 0 R >>\n%%EOF\n")
+        annotated = pdf + ("3 0 obj << /Type /Page /Parent 2 0 R /Annots [] >> endobj\n"
+                           "trailer << /Size 5 /Root 1 0 R /Prev 9 >>\n%%EOF\n")
+        removed = annotated + ("2 0 obj << /Type /Pages /Kids [3 0 R] /Count 1 >> endobj\n"
+                               "trailer << /Size 5 /Root 1 0 R /Prev 9 >>\n%%EOF\n")
+        for data, count in [(pdf, 2), (annotated, 2), (removed, 1)]:
+            path = make_file(data)
+            try:
+                assert page_count(path) == count
+            finally:
+                os.remove(path)
+
+    def test_pdf_packed_page_tree(self):
+        """The catalog and page tree can be in an object stream"""
+        objects = "<< /Type /Catalog /Pages 2 0 R >> << /Type /Pages /Count 5 >>"
+        packed = zlib.compress("1 0 2 34 " + objects)
+        pdf = ("%PDF-1.5\n3 0 obj << /Type /ObjStm /N 2 /First 9 /Filter /FlateDecode >>\n"
+               "stream\n" + packed + "\nendstream endobj\n"
+               "4 0 obj << /Type /XRef /Root 1 0 R /Size 5 >>\nstream\n\nendstream endobj\n"
+               "%%EOF\n")
+        path = make_file(pdf + "5 0 obj << /Type /Page >> endobj\n%%EOF\n")
+        try:
+            assert page_count(path) == 5
+        finally:
+            os.remove(path)
+
+    def test_ps_page_count(self):
+        """The last %%Pages comment is used; unknown counts are None"""
+        path = make_file("%!PS\n%%Pages: (atend)\nshowpage\n%%Trailer\n%%Pages: 4\n")
+        try:
+            assert page_count(path) == 4
+        finally:
+            os.remove(path)
+        path = make_file("%!PS\nshowpage\n")
+        try:
+            assert page_count(path) is None
+        finally:
+            os.remove(path)
+
+    def test_page_size(self):
+        """A PDF's MediaBox or PostScript's BoundingBox, in points"""
+        path = make_file("%PDF-1.4\n3 0 obj << /Type /Page /MediaBox [0 0 595.28 841.89] >>")
+        try:
+            assert page_size(path) == (595.28, 841.89)
+        finally:
+            os.remove(path)
+        path = make_file("%!PS\n%%BoundingBox: 18 36 594 756\n")
+        try:
+            assert page_size(path) == (576, 720)
+        finally:
+            os.remove(path)
+
+    def test_contents_read_once(self):
+        """Contents already read are used rather than the file"""
+        data = "%!PS\n%%Pages: 2\n%%BoundingBox: 0 0 100 200\n"
+        assert page_count(u"missing.ps", data) == 2
+        assert page_size(u"missing.ps", data) == (100, 200)
@@ -54,10 +54,14 @@ class Event(object):
     def __init__(self, *args, **kwds):
         self.calls = []
         self.selection = 0
+        self.more = False
 
     def Skip(self):
         pass
 
+    def RequestMore(self, more=True):
+        self.more = more
+
     def GetSelection(self):
         return self.selection
 
@@ -1236,6 +1240,9 @@ def FFont(*args):
 
 def CallAfter(func, *args, **kwargs):
     func(*args, **kwargs)
+
+def CallLater(millis, func, *args, **kwargs):
+    pass
 #
 # This is a static class which needs to be emulated
 #
@@ -19,6 +19,10 @@
 
 
 import os
+import shutil
+import subprocess
+import sys
+import tempfile
 from wx import BITMAP_TYPE_PNG, BITMAP_TYPE_JPEG, BITMAP_TYPE_TIF
 import unittest
 
@@ -110,6 +114,7 @@ class TestFunctions(unittest.TestCase):
         assert convert_quality("highest", im, f, path) == u'"%s" -density 300 "%s" -resample 120 -unsharp 0x.5 -trim +repage -bordercolor white -border 20 "%s"' % (im, f, path)
         assert convert_quality("high", im, f, path) == u'"%s" -density 250 "%s" -resample 100 -unsharp 0x.5 -trim +repage -bordercolor white -border 20 "%s"' % (im, f, path)
         assert convert_quality("normal", im, f, path) == u'"%s" -density 200 "%s" -resample 88 -unsharp 0x.5 -trim +repage -bordercolor white -border 20 "%s"' % (im, f, path)
+        assert convert_quality("normal", im, f, path, 7) == u'"%s" -density 200 "%s" -resample 88 -unsharp 0x.5 -trim +repage -bordercolor white -border 20 -scene 7 "%s"' % (im, f, path)
 
 
     def test_get_time(self):
@@ -145,4 +150,42 @@ class TestFunctions(unittest.TestCase):
         self.assertTrue(is_save_file("blah.wtbd"))
         self.assertFalse(is_save_file("blahwtbd"))
         self.assertFalse(is_save_file("/blah.png"))
-        self.assertFalse(is_save_file("wtbd"))
\ No newline at end of file
+        self.assertFalse(is_save_file("wtbd"))
+
+    def test_process_exists(self):
+        """
+        Running processes are told apart from those that have finished
+        """
+        process = subprocess.Popen([sys.executable, "-c", ""])
+        process.wait()
+        self.assertTrue(functions.process_exists(os.getpid()))
+        self.assertFalse(functions.process_exists(process.pid))
+        self.assertFalse(functions.process_exists(0))
+
+    def test_replace_file(self):
+        """
+        A file is replaced by another; one that can't be is left as it was
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            source = os.path.join(directory, u"save.wtbd.tmp")
+            target = os.path.join(directory, u"save.wtbd")
+            for name, data in [(source, "new"), (target, "old")]:
+                f = open(name, "wb")
+                f.write(data)
+                f.close()
+            functions.replace_file(source, target)
+            self.assertEqual("new", open(target, "rb").read())
+            self.assertFalse(os.path.exists(source))
+
+            f = open(source, "wb")
+            f.write("newer")
+            f.close()
+            folder = os.path.join(directory, u"folder")
+            os.mkdir(folder)
+            open(os.path.join(folder, u"file"), "wb").close()
+            self.assertRaises(EnvironmentError, functions.replace_file, source, folder)
+            self.assertEqual("newer", open(source, "rb").read())
+            self.assertTrue(os.path.isdir(folder))
+        finally:
+            shutil.rmtree(directory)
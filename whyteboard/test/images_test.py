@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009, 2010 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+"""
+Tests for the image store: images are decoded when needed, and the least
+recently used are evicted once over the memory budget. Encoded images are
+let go of the same way. Converted pages are printed from their high
+resolution renders.
+"""
+
+import os
+import tempfile
+
+import whyteboard.tools as tools
+
+from whyteboard.test.fakewidgets.core import Bitmap
+from whyteboard.lib.mock import patch
+from whyteboard.misc.images import EncodedImages, ImageStore
+
+
+#----------------------------------------------------------------------
+
+class TestImageStore(object):
+    def setup(self):
+        self.store = ImageStore(memory=10 * 10 * 4 * 2)  # two 10x10 images
+        self.decoded = []
+        self.store.decode = self.decode
+        for name in ["a", "b", "c"]:
+            self.store.add(name, "encoded " + name)
+
+    def decode(self, name):
+        self.decoded.append(name)
+        bitmap = Bitmap(name)
+        bitmap.SetSize(10, 10)
+        return bitmap
+
+
+    def test_decode_when_needed(self):
+        assert not self.decoded
+        bitmap = self.store.get("a")
+        assert bitmap.filename == "a"
+        assert self.store.get("a") is bitmap
+        assert self.decoded == ["a"]
+
+    def test_evict_least_recently_used(self):
+        # given
+        self.store.get("a")
+        self.store.get("b")
+        self.store.get("a")
+        # when
+        self.store.get("c")
+        # then
+        assert self.store.bitmaps.keys() == ["a", "c"]
+        assert self.store.used == 10 * 10 * 4 * 2
+        assert self.store.data("b") == "encoded b"
+
+    def test_redecode_after_eviction(self):
+        for name in ["a", "b", "c", "a"]:
+            self.store.get(name)
+        assert self.decoded == ["a", "b", "c", "a"]
+
+    def test_keeps_one_bitmap_over_budget(self):
+        self.store.memory = 0
+        self.store.get("a")
+        assert self.store.bitmaps.keys() == ["a"]
+
+
+class TestEncodedImages(object):
+    def setup(self):
+        self.files = EncodedImages(memory=20)
+        self.files.add("1", "a.png", "0123456789")
+        self.files.add("2", "b.png", "0123456789")
+
+    def test_get(self):
+        assert self.files.get("1") == ("a.png", "0123456789")
+        assert self.files.data("b.png") == "0123456789"
+        assert self.files.get("3") is None
+        assert self.files.data("c.png") is None
+
+    def test_evict_least_recently_used(self):
+        self.files.get("1")
+        self.files.add("3", "c.png", "0123456789")
+        assert self.files.files.keys() == ["1", "3"]
+        assert "2" not in self.files
+        assert self.files.data("b.png") is None
+        assert self.files.used == 20
+
+    def test_replace(self):
+        self.files.add("1", "c.png", "01234")
+        assert self.files.get("1") == ("c.png", "01234")
+        assert self.files.data("a.png") is None
+        assert self.files.used == 15
+
+    def test_keeps_one_image_over_budget(self):
+        self.files.add("3", "c.png", "0" * 30)
+        assert self.files.files.keys() == ["3"]
+
+
+class FakeCanvas(object):
+    def __init__(self):
+        self.overlay = None
+
+
+class Render(Bitmap):
+    """A page's print render, as read from its file"""
+    def Ok(self):
+        return True
+
+
+class FakeDC(object):
+    def __init__(self):
+        self.scale = (1, 1)
+        self.drawn = []
+
+    def GetUserScale(self):
+        return self.scale
+
+    def SetUserScale(self, x, y):
+        self.scale = (x, y)
+
+    def DrawBitmap(self, bitmap, x, y, transparent=False):
+        self.drawn.append((self.scale, x, y))
+
+
+class TestDrawHighRes(object):
+    def setup(self):
+        handle, self.path = tempfile.mkstemp(suffix=".png")
+        os.close(handle)
+        page = Bitmap()
+        page.SetSize(100, 130)
+        self.image = tools.Image(FakeCanvas(), page, None)
+        self.image.x, self.image.y = 10, 20
+        self.image.high_res = self.path
+        self.dc = FakeDC()
+
+    def teardown(self):
+        os.remove(self.path)
+
+    def render(self, width, height):
+        bitmap = Render()
+        bitmap.SetSize(width, height)
+        return bitmap
+
+
+    @patch('wx.Bitmap')
+    def test_scaled_to_the_page(self, bitmap):
+        """Each side is scaled to the image's, drawn where the image is"""
+        bitmap.return_value = self.render(400, 520)
+        assert self.image.draw_high_res(self.dc)
+        assert self.dc.drawn == [((0.25, 0.25), 40, 80)]
+        assert self.dc.scale == (1, 1)
+
+        bitmap.return_value = self.render(400, 516)
+        assert self.image.draw_high_res(self.dc)
+        (x_scale, y_scale), x, y = self.dc.drawn[-1]
+        assert (x_scale * 400, y_scale * 516) == (100, 130)
+
+    @patch('wx.Bitmap')
+    def test_out_of_proportion(self, bitmap):
+        """A render that's a different shape from the page isn't used"""
+        bitmap.return_value = self.render(400, 400)
+        assert not self.image.draw_high_res(self.dc)
+        assert not self.dc.drawn
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+
+"""
+Tests for the journal's entries, replaying them over a save file's sheets, and
+offering crashed documents back
+"""
+
+import cStringIO
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import wx
+
+import whyteboard.tools as tools
+
+from whyteboard.test import fakewidgets
+from whyteboard.core import Config
+from whyteboard.lib import Mock
+from whyteboard.lib.mock import patch
+from whyteboard.misc import journal, records, utility
+
+#----------------------------------------------------------------------
+
+class FakeCanvas(object):
+    def __init__(self):
+        self.overlay = None
+
+
+def entry(kind, *values):
+    writer = records.Writer()
+    writer.varint(kind)
+    for value in values:
+        if isinstance(value, list):
+            journal.write_shapes(writer, value)
+        else:
+            writer.varint(value)
+    return writer
+
+
+class TestJournal(object):
+    def setup(self):
+        canvas = FakeCanvas()
+        self.shapes = [tools.Rectangle(canvas, (0, 0, 0), 1) for x in range(3)]
+        self.sheets = {0: {'name': u"Sheet 1", 'size': (800, 600), 'medias': [],
+                           'shapes': list(self.shapes), 'groups': []}}
+
+    def entries(self, *writers):
+        out = cStringIO.StringIO()
+        out.write(journal.MAGIC)
+        for writer in writers:
+            journal.write_entry(out, writer)
+        return out.getvalue()
+
+
+    def test_torn_entries(self):
+        """A crash mid-write loses only the last entry"""
+        data = self.entries(entry(journal.ORDER, 0, 0), entry(journal.ORDER, 0, 0))
+        assert len(journal.read_entries(data)) == 2
+        assert len(journal.read_entries(data[:-1])) == 1
+        corrupt = data[:-1] + chr(ord(data[-1]) ^ 1)
+        assert len(journal.read_entries(corrupt)) == 1
+
+    def test_replay_shapes(self):
+        """Shapes are replaced by uid, and the order drops removed shapes"""
+        changed = records.loads(records.dumps({'shapes': [self.shapes[0]],
+                                               'medias': [], 'groups': []}))['shapes'][0]
+        changed.x = 50
+        added = tools.Rectangle(FakeCanvas(), (0, 0, 0), 1)
+        uids = [added.uid, self.shapes[0].uid, self.shapes[2].uid]
+
+        data = self.entries(entry(journal.SHAPE, 0, 0, [changed]),
+                            entry(journal.SHAPE, 0, 3, [added]),
+                            entry(journal.ORDER, 0, len(uids), *uids))
+        sheets, images = journal.replay(journal.read_entries(data), self.sheets)
+        shapes = sheets[0]['shapes']
+        assert [shape.uid for shape in shapes] == uids
+        assert shapes[1].x == 50
+        assert images == {}
+
+
+class FakeGUI(object):
+    def __init__(self):
+        self.current_tab = 0
+        self.filehistory = Mock()
+        self.filehistory.GetCount.return_value = 0
+
+    def Bind(self, *args):
+        pass
+
+    def get_canvases(self):
+        return []
+
+    def get_tab_names(self):
+        return []
+
+    def mark_unsaved(self):
+        self.unsaved = True
+
+
+def dead_pid():
+    """The process ID of a process that's been and gone"""
+    process = subprocess.Popen([sys.executable, "-c", ""])
+    process.wait()
+    return process.pid
+
+
+class TestRecover(object):
+    """Journals are offered back once the Whyteboard writing them has gone"""
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        Config().init(os.path.join(self.dir, u"user.pref"))
+        self.gui = FakeGUI()
+        self.gui.util = utility.Utility(self.gui, os.path.join(self.dir, u"pdfcache.db"))
+        self.gui.util.load_wtbd = Mock()
+        self.journal = journal.Journal(self.gui)
+        self.answers = []
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def write_journal(self, name, pid, mtime, document=u"", base=u""):
+        """A journal with just a header; pid None leaves it out, as it used to be"""
+        path = os.path.join(self.dir, name)
+        header = entry(journal.HEADER)
+        header.text(document)
+        header.text(base)
+        header.varint(1)
+        header.varint(0)
+        header.text(u"{}")
+        if pid is not None:
+            header.varint(pid)
+        out = open(path, "wb")
+        out.write(journal.MAGIC)
+        journal.write_entry(out, header)
+        out.close()
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def answer(self, *args, **kwargs):
+        return self.answers.pop(0)
+
+
+    def test_header_pid(self):
+        path = self.write_journal(u"journal-1.wbj", 1234, 1000)
+        assert journal.read_header(path)['pid'] == 1234
+        path = self.write_journal(u"journal-2.wbj", None, 1000)
+        assert journal.read_header(path)['pid'] == 0
+
+    @patch('whyteboard.misc.journal.get_home_dir')
+    def test_find(self, home):
+        """Newest first, leaving out those of Whyteboards still running"""
+        home.return_value = self.dir
+        older = self.write_journal(u"journal-1.wbj", dead_pid(), 1000)
+        newer = self.write_journal(u"journal-2.wbj", None, 2000)
+        self.write_journal(u"journal-3.wbj", os.getppid(), 3000)
+        assert self.journal.find() == [newer, older]
+
+    @patch('wx.MessageBox')
+    @patch('whyteboard.misc.journal.get_home_dir')
+    def test_recover(self, home, message):
+        """
+        Each document is offered until one's recovered; declined journals are
+        deleted, and one that can't be replayed is kept
+        """
+        home.return_value = self.dir
+        message.side_effect = self.answer
+        self.answers = [wx.NO, wx.YES, wx.OK, wx.YES]
+        recovered = self.write_journal(u"journal-1.wbj", dead_pid(), 1000,
+                                       document=u"lecture.wtbd")
+        failed = self.write_journal(u"journal-2.wbj", dead_pid(), 2000,
+                                    base=os.path.join(self.dir, u"missing.wtbd"))
+        declined = self.write_journal(u"journal-3.wbj", dead_pid(), 3000)
+
+        assert self.journal.recover()
+        assert not self.answers
+        assert not os.path.exists(declined)
+        assert os.path.exists(failed)
+        assert not os.path.exists(recovered)
+        self.gui.util.load_wtbd.assert_called_with(
+            os.path.join(self.dir, journal.RECOVERED_FILE % os.getpid()))
+        assert self.gui.util.filename == u"lecture.wtbd"
+        assert self.gui.unsaved
+
+    @patch('wx.MessageBox')
+    @patch('whyteboard.misc.journal.get_home_dir')
+    def test_recover_declined(self, home, message):
+        home.return_value = self.dir
+        message.return_value = wx.NO
+        path = self.write_journal(u"journal-1.wbj", dead_pid(), 1000)
+        assert not self.journal.recover()
+        assert not os.path.exists(path)
+        assert not self.gui.util.load_wtbd.called
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+
+"""
+Tests for converting older save files to the current format
+"""
+
+import cPickle
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import whyteboard.tools as tools
+
+from whyteboard.misc import migrate, records
+from whyteboard.misc.utility import SHEET_CHUNK, read_manifest
+
+#----------------------------------------------------------------------
+
+class FakeCanvas(object):
+    def __init__(self):
+        self.overlay = None
+
+
+def legacy_shapes(count):
+    """Rectangles as older versions pickled them: without a uid"""
+    shapes = [tools.Rectangle(FakeCanvas(), (0, 0, 0), 1) for x in range(count)]
+    shapes = records.loads(records.dumps({'shapes': shapes, 'medias': [],
+                                          'groups': []}))['shapes']
+    for shape in shapes:
+        del shape.uid
+    return shapes
+
+
+class TestMigrate(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, u"lecture.wtbd")
+        save_data = {0: [(0, 0, 0), 1, 1, 0, u"0.40", None],
+                     1: {0: legacy_shapes(3), 1: legacy_shapes(2)},
+                     3: [u"Sheet 1", u"Sheet 2"], 4: [(800, 600), (640, 480)],
+                     5: {0: [], 1: []}, 6: {0: [[0, 1]]}}
+        _zip = zipfile.ZipFile(self.filename, "w")
+        _zip.writestr("save.data", cPickle.dumps(save_data))
+        _zip.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def test_migrate_zipped_pickle(self):
+        """A zipped pickle is converted, verified, and its original kept"""
+        result = migrate.migrate_file(self.filename)
+
+        self.assertEqual(migrate.CONVERTED, result['status'], result['message'])
+        self.assertEqual(migrate.ZIPPED_PICKLE, result['format'])
+        self.assertEqual((2, 5), (result['sheets'], result['shapes']))
+        self.assertTrue(os.path.exists(self.filename + migrate.BACKUP))
+
+        manifest = read_manifest(self.filename)
+        self.assertEqual([3, 2], [sheet['shapes'] for sheet in manifest['sheets']])
+        self.assertEqual([800, 600], manifest['sheets'][0]['size'])
+        _zip = zipfile.ZipFile(self.filename)
+        sheet = records.loads(_zip.read(SHEET_CHUNK % 0))
+        _zip.close()
+        self.assertEqual([[0, 1]], sheet['groups'])
+        self.assertTrue(all(shape.uid for shape in sheet['shapes']))
+
+
+    def test_migrate_directory(self):
+        """Files already converted are skipped, and each has a report row"""
+        migrate.migrate_directory(self.directory, workers=1)
+        results = migrate.migrate_directory(self.directory, workers=1)
+
+        self.assertEqual([migrate.SKIPPED], [r['status'] for r in results])
+        with open(os.path.join(self.directory, migrate.REPORT)) as f:
+            self.assertEqual(2, len(f.readlines()))
+
+
+    def test_corrupt_file(self):
+        """A file that can't be read is reported, and left as it was"""
+        with open(self.filename, "wb") as f:
+            f.write("not a save file")
+        result = migrate.migrate_file(self.filename)
+        self.assertEqual(migrate.FAILED, result['status'])
+        self.assertFalse(os.path.exists(self.filename + u".tmp"))
+        self.assertFalse(os.path.exists(self.filename + migrate.BACKUP))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""
+Tests for the thumbnails panel: out of date thumbnails are redrawn one at a
+time when idle, those the user can see first.
+"""
+
+from whyteboard.test import fakewidgets
+from whyteboard.gui.panels import Thumbs
+from whyteboard.test.fakewidgets.core import Event
+
+#----------------------------------------------------------------------
+
+class FakeThumb(object):
+    def __init__(self, _id):
+        self.thumb_id = _id
+        self.stale = True
+        self.current = False
+
+    def GetRect(self):
+        return self
+
+
+class FakeView(object):
+    """The part of the panel scrolled into view"""
+    def __init__(self, visible):
+        self.visible = visible
+
+    def Intersects(self, thumb):
+        return thumb.thumb_id in self.visible
+
+
+class IdleThumbs(Thumbs):
+    """Thumbs that only note which thumbnails are updated"""
+    def __init__(self, count, visible):
+        self.thumbs = [FakeThumb(x) for x in range(count)]
+        self.visible = visible
+        self.updated = []
+
+    def GetClientRect(self):
+        return FakeView(self.visible)
+
+    def update(self, _id):
+        self.updated.append(_id)
+        self.thumbs[_id].stale = False
+
+
+class TestThumbsOnIdle:
+    def setup(self):
+        self.thumbs = IdleThumbs(6, visible=[3, 4])
+        self.thumbs.thumbs[4].current = True
+
+    def idle(self):
+        event = Event()
+        self.thumbs.on_idle(event)
+        return event.more
+
+    def test_one_at_a_time(self):
+        """Each idle event updates one thumbnail, asking for more while any are left"""
+        assert self.idle()
+        assert self.thumbs.updated == [4]
+        for x in range(4):
+            assert self.idle()
+        assert not self.idle()
+        assert not self.idle()
+        assert len(self.thumbs.updated) == 6
+
+    def test_visible_first(self):
+        """The current sheet's first, then those in view, then the rest in order"""
+        for x in range(6):
+            self.idle()
+        assert self.thumbs.updated == [4, 3, 0, 1, 2, 5]
+
+    def test_only_stale(self):
+        for thumb in self.thumbs.thumbs[:4]:
+            thumb.stale = False
+        for x in range(3):
+            self.idle()
+        assert self.thumbs.updated == [4, 5]
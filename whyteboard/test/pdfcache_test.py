@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+
+"""
+Tests for the cache of converted PDF files
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from whyteboard.misc.pdfcache import PDFCache, file_digest
+
+#----------------------------------------------------------------------
+
+class TestPDFCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = PDFCache(self.path(u"cache.db"), budget=100)
+        self.pdf = self.make_file(u"lecture.pdf", "%PDF lecture")
+
+    def tearDown(self):
+        self.cache.db.close()
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def make_file(self, name, data):
+        with open(self.path(name), "wb") as f:
+            f.write(data)
+        return self.path(name)
+
+    def convert(self, name, size=10):
+        """Fakes converting a file into two images of size bytes"""
+        images = [self.make_file(u"%s-%i.png" % (name, x), "x" * size) for x in range(2)]
+        self.cache.write(self.path(name), images, u"normal")
+        return images
+
+
+    def test_lookup_by_content(self):
+        """A moved file is still found, a changed one isn't"""
+        images = self.convert(u"lecture.pdf")
+        self.assertEqual(images, self.cache.lookup(self.pdf, u"normal"))
+        self.assertFalse(self.cache.lookup(self.pdf, u"high"))
+
+        moved = self.path(u"moved.pdf")
+        os.rename(self.pdf, moved)
+        self.assertEqual(images, self.cache.lookup(moved, u"normal"))
+
+        with open(moved, "ab") as f:
+            f.write(" - revised")
+        self.assertFalse(self.cache.lookup(moved, u"normal"))
+        self.assertEqual((2, 2), self.cache.stats())
+
+
+    def test_digest_of_contents(self):
+        """Contents already read hash the same as the file"""
+        self.assertEqual(file_digest(self.pdf), file_digest(self.pdf, "%PDF lecture"))
+        self.convert(u"lecture.pdf")
+        self.cache.known = {}
+        self.assertTrue(self.cache.lookup(self.pdf, u"normal", "%PDF lecture"))
+
+
+    def test_missing_images(self):
+        """An entry whose images have been deleted is dropped"""
+        images = self.convert(u"lecture.pdf")
+        os.remove(images[0])
+        self.assertFalse(self.cache.lookup(self.pdf, u"normal"))
+        self.assertEqual([], self.cache.entries())
+        self.assertFalse(os.path.exists(images[1]))
+
+
+    def test_eviction(self):
+        """The least recently used entries make way for new ones"""
+        self.make_file(u"other.pdf", "%PDF other")
+        self.make_file(u"third.pdf", "%PDF third")
+        first = self.convert(u"lecture.pdf", 20)
+        second = self.convert(u"other.pdf", 20)
+        self.cache.lookup(self.pdf, u"normal")  # now the most recently used
+
+        self.convert(u"third.pdf", 20)
+        files = [os.path.basename(entry['file']) for entry in self.cache.entries()]
+        self.assertEqual([u"lecture.pdf", u"third.pdf"], files)
+        self.assertEqual(80, self.cache.disk_usage())
+        self.assertFalse(os.path.exists(second[0]))
+        self.assertTrue(os.path.exists(first[0]))
+
+
+    def test_converted_twice(self):
+        """Two conversions of a file at once: the last is kept, the first's removed"""
+        first = self.convert(u"lecture.pdf")
+        job = self.path(u"job")
+        os.mkdir(job)
+        images = [os.path.join(u"job", os.path.basename(image)) for image in first]
+        images = [self.make_file(image, "y" * 10) for image in images]
+        self.cache.write(self.pdf, images, u"normal")
+
+        self.assertEqual(images, self.cache.lookup(self.pdf, u"normal"))
+        self.assertFalse(os.path.exists(first[0]))
+        self.cache.remove([self.cache.entries()[0]['id']])
+        self.assertFalse(os.path.exists(job))  # its directory went with it
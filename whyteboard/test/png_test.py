@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+
+"""
+Tests for the PNG writer: images are decoded back to the pixels they were
+encoded from, whichever filter their rows were stored with.
+"""
+
+import random
+import struct
+import zlib
+
+from whyteboard.misc import png
+
+#----------------------------------------------------------------------
+
+def decode(data):
+    """A PNG's (width, height, colour type, filters, pixels); filters are per row"""
+    assert data[:8] == png.SIGNATURE
+    chunks = {}
+    offset = 8
+    while offset < len(data):
+        length, kind = struct.unpack(">I4s", data[offset:offset + 8])
+        chunks[kind] = data[offset + 8:offset + 8 + length]
+        offset += length + 12
+    width, height, depth, colour = struct.unpack(">IIBB", chunks["IHDR"][:10])
+    bpp = 4 if colour == png.RGBA else 3
+    stride = width * bpp
+
+    rows = zlib.decompress(chunks["IDAT"])
+    filters = []
+    pixels = bytearray()
+    above = bytearray(stride)
+    for y in range(height):
+        kind = ord(rows[y * (stride + 1)])
+        row = bytearray(rows[y * (stride + 1) + 1:(y + 1) * (stride + 1)])
+        for x in range(stride):
+            if kind == png.SUB and x >= bpp:
+                row[x] = (row[x] + row[x - bpp]) % 256
+            elif kind == png.UP:
+                row[x] = (row[x] + above[x]) % 256
+        filters.append(kind)
+        pixels.extend(row)
+        above = row
+    return width, height, colour, filters, str(pixels)
+
+
+def noise(size):
+    return "".join(chr(random.randrange(256)) for x in range(size))
+
+
+def gradient(width, height):
+    return "".join(chr((x * 3 + y) % 256) * 3 for y in range(height) for x in range(width))
+
+
+class TestPNG(object):
+    def setup(self):
+        random.seed(0)
+
+    def test_subtract(self):
+        a, b = noise(100), noise(100)
+        expected = "".join(chr((ord(x) - ord(y)) % 256) for x, y in zip(a, b))
+        assert png.subtract(a, b) == expected
+        assert png.subtract("\x00\x80\xff", "\xff\x7f\x00") == "\x01\x01\xff"
+        assert png.subtract("", "") == ""
+
+    def test_round_trip(self):
+        pixels = noise(7 * 5 * 3)
+        data = png.encode_png(7, 5, pixels)
+        assert png.image_size(data) == (7, 5)
+        width, height, colour, filters, decoded = decode(data)
+        assert colour == png.RGB
+        assert decoded == pixels
+
+    def test_round_trip_alpha(self):
+        pixels, alpha = noise(4 * 3 * 3), noise(4 * 3)
+        width, height, colour, filters, decoded = decode(png.encode_png(4, 3, pixels, alpha))
+        assert colour == png.RGBA
+        assert decoded[0::4] == pixels[0::3]
+        assert decoded[3::4] == alpha
+
+    def test_each_filter(self):
+        """Rows decode to the same pixels, whichever filter is chosen"""
+        pixels = gradient(20, 40)
+        above = "\x00" * 60 + pixels[:-60]
+        for kind in (png.NONE, png.SUB, png.UP):
+            rows = png.filter_rows(pixels, above, 60, 3, kind)
+            header = struct.pack(">IIBBBBB", 20, 40, 8, png.RGB, 0, 0, 0)
+            data = "".join([png.SIGNATURE, png.chunk("IHDR", header),
+                            png.chunk("IDAT", zlib.compress(rows)), png.chunk("IEND", "")])
+            width, height, colour, filters, decoded = decode(data)
+            assert filters == [kind] * 40
+            assert decoded == pixels
+
+    def test_choose_filter(self):
+        """Smooth images are filtered, as they compress better for it"""
+        pixels = gradient(200, 40)
+        above = "\x00" * 600 + pixels[:-600]
+        kind = png.choose_filter(pixels, above, 600, 3)
+        assert kind != png.NONE
+        assert decode(png.encode_png(200, 40, pixels))[3] == [kind] * 40
+
+        unfiltered = png.filter_rows(pixels, above, 600, 3, png.NONE)
+        filtered = png.filter_rows(pixels, above, 600, 3, kind)
+        assert len(zlib.compress(filtered)) < len(zlib.compress(unfiltered))
+
+    def test_bands(self):
+        """Tall images are encoded a band of rows at a time, pausing between"""
+        pauses = []
+        pixels = gradient(30, png.BAND * 2 + 5)
+        data = png.encode_png(30, png.BAND * 2 + 5, pixels, pause=lambda: pauses.append(1))
+        assert len(pauses) == 3
+        assert decode(data)[4] == pixels
+
+    def test_encode_all(self):
+        """PNGs are returned in the order they're given, however many workers"""
+        images = [(x + 1, 2, noise((x + 1) * 2 * 3), None) for x in range(6)]
+        for workers in (1, 3):
+            encoded = png.encode_all(images, workers)
+            assert [png.image_size(data) for data in encoded] == [(x + 1, 2) for x in range(6)]
+            assert [decode(data)[4] for data in encoded] == [image[2] for image in images]
+
+    def test_image_size(self):
+        assert png.image_size("GIF89a" + "\x00" * 20) is None
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+
+"""
+Tests for the PDF/PS rasterizer backends
+"""
+
+import os
+import shutil
+import tempfile
+
+from whyteboard.misc.rasterizers import (Ghostscript, ImageMagick, Poppler,
+                                         choose, screen_dpi)
+
+#----------------------------------------------------------------------
+
+def touch(path):
+    open(path, "wb").close()
+
+
+class TestRasterizers(object):
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        self.output = os.path.join(self.dir, u"doc-normal-%04d.png")
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+
+    def test_imagemagick_command(self):
+        """A range is selected with [first-last] and numbered with -scene"""
+        cmd = ImageMagick().command(u"convert", "normal", u"a.pdf", self.output, (3, 5))
+        assert u'"a.pdf[3-5]" -resample 88' in cmd
+        assert cmd.endswith(u'-scene 3 "%s"' % self.output)
+
+
+    def test_resolutions(self):
+        """Pages fit the canvas, and each resolution is cached apart"""
+        assert screen_dpi("normal", (612, 792), 640) == 75  # US letter
+        assert screen_dpi("normal", (306, 396), 640) == 88  # never bigger than before
+        assert screen_dpi("normal", None, 640) == 88
+        assert ImageMagick().cache_key("normal") == ImageMagick().cache_key("normal", 88) == "normal"
+        assert ImageMagick().cache_key("normal", 200) == "normal@200"
+        assert Poppler().cache_key("high", 75) == "poppler-high@75"
+        cmd = ImageMagick().command(u"convert", "normal", u"a.pdf", self.output, None, 300)
+        assert u"-density 300 " in cmd and u"-resample 300 " in cmd
+
+    def test_imagemagick_border(self):
+        """The border is in proportion to the resolution pages are rendered at"""
+        cmd = ImageMagick().command(u"convert", "normal", u"a.pdf", self.output)
+        assert u"-border 20 " in cmd
+        cmd = ImageMagick().command(u"convert", "normal", u"a.pdf", self.output, None, 44)
+        assert u"-border 10 " in cmd
+        cmd = ImageMagick().command(u"convert", "normal", u"a.pdf", self.output, None, 264)
+        assert u"-border 60 " in cmd
+
+
+    def test_ghostscript_collect(self):
+        """Ghostscript's pages, numbered from 1, get their page's name"""
+        cmd = Ghostscript().command(u"gs", "high", u"a.pdf", self.output, (10, 11))
+        assert u"-r100 " in cmd and u"-dFirstPage=11 -dLastPage=12 " in cmd
+        touch(os.path.join(self.dir, u"doc-normal-0010-1.png"))
+        touch(os.path.join(self.dir, u"doc-normal-0010-2.png"))
+        Ghostscript().collect(self.output, (10, 11))
+        assert sorted(os.listdir(self.dir)) == [u"doc-normal-0010.png", u"doc-normal-0011.png"]
+
+
+    def test_poppler_collect(self):
+        """pdftoppm's pages are named by page number, padded however wide"""
+        touch(os.path.join(self.dir, u"doc-normal-0008-p-009.png"))
+        touch(os.path.join(self.dir, u"doc-normal-0008-p-010.png"))
+        Poppler().collect(self.output, (8, 9))
+        assert sorted(os.listdir(self.dir)) == [u"doc-normal-0008.png", u"doc-normal-0009.png"]
+
+
+    def test_choose(self):
+        """The chosen backend is used if installed; otherwise, the first one that is"""
+        program = os.path.join(self.dir, Ghostscript.executables[0])
+        touch(program)
+        os.chmod(program, 0755)
+        path = os.environ.get("PATH", "")
+        os.environ["PATH"] = self.dir
+        try:
+            backend, location = choose(u"poppler", u"a.pdf")
+            assert isinstance(backend, Ghostscript) and location == program
+            assert choose(u"auto", u"a.svg") is None  # only ImageMagick reads SVG
+        finally:
+            os.environ["PATH"] = path
+
+    def test_choose_auto(self):
+        """Automatic prefers ImageMagick, as Whyteboard always has"""
+        for backend in (ImageMagick, Poppler):
+            program = os.path.join(self.dir, backend.executables[0])
+            touch(program)
+            os.chmod(program, 0755)
+        path = os.environ.get("PATH", "")
+        os.environ["PATH"] = self.dir
+        try:
+            assert isinstance(choose(u"auto", u"a.pdf")[0], ImageMagick)
+        finally:
+            os.environ["PATH"] = path
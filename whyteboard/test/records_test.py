@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+
+"""
+Tests for the record codec: shapes should be written and read back with their
+saved attributes, without pickling.
+"""
+
+from wx import TRANSPARENT
+
+import whyteboard.tools as tools
+
+from whyteboard.misc import records
+
+
+#----------------------------------------------------------------------
+
+class FakeCanvas(object):
+    def __init__(self):
+        self.overlay = None
+
+
+class TestRecords(object):
+    def setup(self):
+        canvas = FakeCanvas()
+        self.rect = tools.Rectangle(canvas, (0, 0, 255), 3, TRANSPARENT)
+        self.rect.x, self.rect.y, self.rect.width, self.rect.height = 5, 6.5, -10, 20
+
+        self.pen = tools.Pen(canvas, (255, 0, 0), 2)
+        self.pen.points = [[1, 2, 3, 4], [3, 4, 5, 6]]
+        self.pen.time = [1300000000.25, 1300000000.5]
+
+        self.text = tools.Text(canvas, (0, 0, 0), 1)
+        self.text.text = u"h\xe9llo"
+        self.text.font_data = u"0;-12;0;0;0;400;0;0;0;0;0;0;0;0;Sans"
+        self.sheet = {'shapes': [self.rect, self.pen, self.text], 'medias': [],
+                      'groups': [[0, 2]]}
+
+
+    def test_round_trip(self):
+        sheet = records.loads(records.dumps(self.sheet))
+        rect, pen, text = sheet['shapes']
+        assert (rect.uid, rect.x, rect.y, rect.width, rect.height) == (
+            self.rect.uid, 5, 6.5, -10, 20)
+        assert rect.background == TRANSPARENT
+        assert records.colour_ints(rect.colour) == (0, 0, 255, 255)
+        assert pen.points == self.pen.points
+        assert pen.time == self.pen.time
+        assert text.text == self.text.text
+        assert text.font_data == self.text.font_data
+        assert sheet['groups'] == [[0, 2]]
+
+    def test_transient_attributes(self):
+        rect = records.loads(records.dumps(self.sheet))['shapes'][0]
+        assert rect.canvas is None
+        assert rect.handles == []
+        assert not rect.selected
+
+    def test_unknown_types(self):
+        self.sheet['shapes'].append(tools.Select(FakeCanvas(), (0, 0, 0), 1))
+        try:
+            records.dumps(self.sheet)
+        except TypeError:
+            return
+        assert False, "Select has no record schema"
+
+    def test_not_records(self):
+        try:
+            records.loads("x\x9c pickled")
+        except ValueError:
+            return
+        assert False
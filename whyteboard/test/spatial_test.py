@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+import unittest
+
+from whyteboard.core.spatial import SpatialIndex
+
+#----------------------------------------------------------------------
+
+class FakeShape(object):
+    def __init__(self, bounds):
+        self.bounds = bounds
+
+    def get_bounds(self):
+        return self.bounds
+
+
+class TestSpatialIndex(unittest.TestCase):
+    """Rubber-band selection queries"""
+
+    def setUp(self):
+        self.shapes = [FakeShape((10, 10, 50, 50)), FakeShape((300, 300, 400, 420)),
+                       FakeShape((20, 20, 30, 30)), FakeShape(None)]
+        self.index = SpatialIndex()
+        for shape in self.shapes:
+            self.index.insert(shape)
+
+
+    def test_query_inside(self):
+        """Only shapes entirely inside the rectangle are found, in order"""
+        found = self.index.query((0, 0, 100, 100), self.shapes)
+        self.assertEqual([self.shapes[0], self.shapes[2]], found)
+
+
+    def test_query_reversed_rect(self):
+        """Dragging right-to-left/bottom-to-top gives the same result"""
+        found = self.index.query((100, 100, 0, 0), self.shapes)
+        self.assertEqual([self.shapes[0], self.shapes[2]], found)
+
+
+    def test_query_partial_overlap(self):
+        """A shape crossing the rectangle's edge isn't selected"""
+        found = self.index.query((0, 0, 350, 350), self.shapes)
+        self.assertEqual([self.shapes[0], self.shapes[2]], found)
+
+
+    def test_invalidate(self):
+        """Moved shapes are found in their new place after invalidating"""
+        self.shapes[1].bounds = (5, 5, 15, 15)
+        self.index.invalidate()
+        found = self.index.query((0, 0, 100, 100), self.shapes)
+        self.assertEqual(self.shapes[:3], found)
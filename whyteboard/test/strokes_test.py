@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+
+"""
+Tests for the pen stroke encoding.
+"""
+
+from whyteboard.misc import strokes
+
+
+#----------------------------------------------------------------------
+
+class TestStrokes(object):
+    def setup(self):
+        self.points = [[10, 10, 12, 9], [12, 9, 15, 4], [15, 4, 14, 7]]
+        self.times = [1300000000.0, 1300000000.016, 1300000000.033]
+
+
+    def test_round_trip(self):
+        points, times = strokes.decode(strokes.encode(self.points, self.times))
+        assert points == self.points
+        assert [round(t, 3) for t in times] == self.times
+
+    def test_compressed(self):
+        data = strokes.encode(self.points, self.times, compress=True)
+        assert strokes.decode(data)[0] == self.points
+
+    def test_separate_runs(self):
+        """Segments not starting where the last ended are kept apart"""
+        self.points.append([40, -40, 41, -41])
+        assert strokes.decode(strokes.encode(self.points, []))[0] == self.points
+
+    def test_fixed_point(self):
+        self.points[1] = [12, 9, 15.25, 4.5]
+        self.points[2] = [15.25, 4.5, 14, 7]
+        assert strokes.decode(strokes.encode(self.points, []))[0] == self.points
+
+    def test_empty(self):
+        assert strokes.decode(strokes.encode([], [])) == ([], [])
+
+    def test_smaller_than_segments(self):
+        """Each point is stored once, in a byte or two per coordinate"""
+        data = strokes.encode(self.points * 100, [])
+        assert len(data) < len(self.points) * 100 * 4
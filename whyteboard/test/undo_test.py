@@ -19,34 +19,317 @@
 
 
 """
-
+Tests for the undo actions: each should restore the canvas' shapes to their
+state before the action, and redo should re-apply it.
 """
 
-import os
+import cPickle
+import tempfile
+import zlib
 
 from wx import TRANSPARENT
 
 import whyteboard.tools as tools
 
-from whyteboard.gui import Canvas
-from whyteboard.lib import Mock, pub
 from whyteboard.misc import undo
 
 
 #----------------------------------------------------------------------
 
+class FakeCanvas(object):
+    def __init__(self):
+        self.shapes = []
+        self.groups = []
+        self.overlay = None
+
+    def remove_from_groups(self, shapes):
+        uids = set(x.uid for x in shapes)
+        self.groups = [g - uids for g in self.groups if len(g - uids) > 1]
+
+
 class TestUndo(object):
     """
     Tests undoing objects
     """
+    def setup(self):
+        self.canvas = FakeCanvas()
+        self.shapes = [tools.Rectangle(self.canvas, (0, 0, 0), 1, TRANSPARENT)
+                       for x in range(4)]
+        self.canvas.shapes = list(self.shapes)
+
+
+    def test_undo_add_shape(self):
+        # given
+        shape = tools.Rectangle(self.canvas, (0, 0, 0), 1, TRANSPARENT)
+        action = undo.AddShapeUndo(self.canvas, shape)
+        self.canvas.shapes.append(shape)
+
+        # when
+        action.undo()
+
+        # then
+        assert self.canvas.shapes == self.shapes
+        action.redo()
+        assert self.canvas.shapes[-1] is shape
+
+
+    def test_undo_remove_shapes(self):
+        # given
+        removed = [self.shapes[0], self.shapes[2]]
+        self.canvas.groups = [set([self.shapes[0].uid, self.shapes[2].uid])]
+        action = undo.RemoveShapesUndo(self.canvas, removed)
+        self.canvas.shapes = [self.shapes[1], self.shapes[3]]
+        self.canvas.remove_from_groups(removed)
+
+        # when
+        action.undo()
+
+        # then
+        assert self.canvas.shapes == self.shapes
+        assert self.canvas.groups == [set([self.shapes[0].uid, self.shapes[2].uid])]
+        action.redo()
+        assert self.canvas.shapes == [self.shapes[1], self.shapes[3]]
+        assert not self.canvas.groups
+
+
+    def test_remove_shapes_only_copies_their_groups(self):
+        """Groups without a removed shape aren't copied, and survive undo"""
+        removed = [self.shapes[0]]
+        other = set([self.shapes[1].uid, self.shapes[3].uid])
+        self.canvas.groups = [set([self.shapes[0].uid, self.shapes[2].uid]), other]
+        action = undo.RemoveShapesUndo(self.canvas, removed)
+        assert action.groups == [set([self.shapes[0].uid, self.shapes[2].uid])]
+
+        action.redo()
+        assert self.canvas.groups == [other]
+        action.undo()
+        assert other in self.canvas.groups and len(self.canvas.groups) == 2
+
+
+    def test_undo_reorder(self):
+        # given
+        shape = self.canvas.shapes.pop(0)
+        self.canvas.shapes.append(shape)
+        action = undo.ReorderUndo(self.canvas, shape, 0, 3)
+
+        # when
+        action.undo()
+
+        # then
+        assert self.canvas.shapes == self.shapes
+        action.redo()
+        assert self.canvas.shapes[3] is shape
+
+
     def test_undo_shape(self):
         # given
-        canvas = Mock(wraps=Canvas)
-        shape = tools.Rectangle(canvas, (0, 0, 0), 1, TRANSPARENT)
+        shape = self.shapes[1]
+        action = undo.ShapeUndo(self.canvas, [shape])
+        shape.move(10, 20, (1, 2))
+        shape.colour = (255, 0, 0)
+
+        # when
+        action.undo()
+
+        # then
+        assert (shape.x, shape.y) == (0, 0)
+        assert shape.colour == (0, 0, 0)
+        assert shape.canvas is self.canvas
+        action.redo()
+        assert (shape.x, shape.y) == (9, 18)
+        assert shape.colour == (255, 0, 0)
+
+
+    def test_undo_clear(self):
+        # given
+        action = undo.ClearSheetUndo(self.canvas, self.canvas.shapes, [])
+        self.canvas.shapes = []
+
+        # when
+        action.undo()
+
+        # then
+        assert self.canvas.shapes == self.shapes
+        action.redo()
+        assert not self.canvas.shapes
+
+
+#----------------------------------------------------------------------
+
+class TestUndoHistory(object):
+    """
+    Tests the undo history spilling old actions to disk, and reading them back
+    """
+    def setup(self):
+        self.canvas = FakeCanvas()
+        self.history = undo.UndoHistory(self.canvas, limit=2, memory=1048576,
+                                        directory=tempfile.gettempdir())
+
+    def add_shapes(self, count):
+        for x in range(count):
+            shape = tools.Rectangle(self.canvas, (0, 0, 0), 1, TRANSPARENT)
+            self.history.append(undo.AddShapeUndo(self.canvas, shape))
+            self.canvas.shapes.append(shape)
+
+
+    def test_spill_to_disk(self):
+        # when
+        self.add_shapes(5)
+
+        # then
+        assert len(self.history) == 5
+        assert len(self.history.actions) == 2
+        assert self.history.on_disk() == 3
+
+
+    def test_memory_budget(self):
+        # given
+        self.history.limit = 100
+        self.history.memory = 1
 
         # when
-        shape.move(1, 2, (1, 2))
-        shape.assert_called_with(1, 2, (1, 2))
+        self.add_shapes(3)
+
+        # then
+        assert len(self.history.actions) == 1  # always keeps the newest one
+        assert self.history.on_disk() == 2
+
 
+    def test_pop_from_disk(self):
+        # given
+        self.add_shapes(4)
+
+        # when
+        while self.history:
+            self.history.pop().undo()
+
+        # then
+        assert not self.canvas.shapes
+        assert not self.history.on_disk()
+
+
+    def test_pack_shape_undo(self):
+        # given
+        shape = tools.Rectangle(self.canvas, (0, 0, 0), 1, TRANSPARENT)
+        self.canvas.shapes.append(shape)
+        action = undo.ShapeUndo(self.canvas, [shape])
+        shape.move(10, 20, (1, 2))
+        moved = (shape.x, shape.y)
+
+        # when
+        action = undo.unpack_record(self.canvas, action.record())
+        action.undo()
+
+        # then
+        assert action.shapes[0] is shape
+        assert (shape.x, shape.y) == (0, 0)
+        action = undo.unpack_record(self.canvas, action.record(True))
+        action.redo()
+        assert (shape.x, shape.y) == moved
+
+
+    def test_pack_removed_shapes(self):
+        """Shapes that aren't on the canvas are written as shape records"""
+        # given
+        self.add_shapes(3)
+        shapes = list(self.canvas.shapes)
+        removed = [shapes[0], shapes[2]]
+        self.canvas.groups = [set(shape.uid for shape in removed)]
+        action = undo.RemoveShapesUndo(self.canvas, removed)
+        self.canvas.shapes = [shapes[1]]
+        self.canvas.remove_from_groups(removed)
+
+        # when
+        action = undo.unpack_record(self.canvas, action.record())
+        action.undo()
+
+        # then
+        assert [s.uid for s in self.canvas.shapes] == [s.uid for s in shapes]
+        assert self.canvas.shapes[0] is not shapes[0]
+        assert self.canvas.shapes[0].canvas is self.canvas
+        assert self.canvas.groups == [set(s.uid for s in removed)]
+
+
+    def test_pickled_record(self):
+        """Records are never unpickled"""
+        # given
+        record = zlib.compress(cPickle.dumps(("ReorderUndo", {'old': 0, 'new': 1})))
+
+        # then
+        assert undo.unpack_record(self.canvas, record) is None
+        assert undo.unpack_record(self.canvas, undo.MAGIC + record) is None
+
+
+    def test_record_is_kept(self):
+        """Saving again doesn't pack an action that's already been saved"""
+        action = undo.ReorderUndo(self.canvas, None, 0, 1)
+        record = action.record()
+        assert action.record() is record
+        assert action.record(True) is not record
+        action.packed = None  # as when it's undone
+        assert action.record() is not record
+
+
+    def test_close(self):
+        # given
+        self.add_shapes(4)
+
+        # when
+        self.history.close()
+
+        # then
+        assert not self.history
+        assert not self.history.journal
+
+
+    def test_detach_and_attach(self):
+        # given
+        self.add_shapes(3)
+
+        # when
+        actions = self.history.detach()
+
+        # then
+        assert len(actions) == 2
+        assert len(self.history) == 1  # still on disk
+        self.history.attach(actions)
+        assert len(self.history) == 3
+        assert self.history.actions == actions
+
+
+    def test_records_are_newest(self):
+        # given
+        self.add_shapes(4)
+
+        # when
+        records = self.history.records(3)
+
+        # then
+        assert len(records) == 3
+        assert records[-1] == self.history.actions[-1].record()
+
+
+    def test_undo_log_round_trip(self):
+        # given
+        records = ["one", "", "three" * 100]
+
+        # when
+        data = undo.encode_log(records)
+
+        # then
+        assert undo.decode_log(data) == records
+
+
+    def test_packed_undo(self):
+        # given
+        self.add_shapes(3)
+        records = self.history.records(10)
+        history = undo.UndoHistory(self.canvas, limit=10, memory=1048576)
+
+        # when
+        history.attach([undo.PackedUndo(self.canvas, x) for x in records])
+        while history:
+            history.pop().undo()
 
-        # then
\ No newline at end of file
+        # then
+        assert not self.canvas.shapes
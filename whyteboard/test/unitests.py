@@ -614,10 +614,11 @@ class TestShapes(unittest.TestCase):
 
     def test_image_hit(self):
         """Image hit test"""
-        img = whyteboard.tools.Image(self.canvas, Bitmap(None), "C:\picture.jpg")
+        bitmap = Bitmap(None)
+        bitmap.SetSize(50, 50)
+        img = whyteboard.tools.Image(self.canvas, bitmap, "C:\picture.jpg")
         img.x = 150
         img.y = 150
-        img.image.SetSize(50, 50)
         img.sort_handles()
 
         assert img.hit_test(160, 160)
@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2009-2011 by Steven Sproat
+#
+# GNU General Public Licence (GPL)
+#
+# Whyteboard is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option) any later
+# version.
+# Whyteboard is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+# You should have received a copy of the GNU General Public License along with
+# Whyteboard; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+
+"""
+Unit tests for the save file helpers in misc/utility.py
+"""
+
+import errno
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import whyteboard.tools as tools
+
+from whyteboard.test import fakewidgets
+from whyteboard.core import Config
+from whyteboard.lib import Mock
+from whyteboard.misc import png, records, utility
+from whyteboard.misc.utility import (copy_member, read_manifest, read_thumbnail,
+                                     write_member, Compression, Utility, MANIFEST)
+
+#----------------------------------------------------------------------
+
+class TestCopyMember(unittest.TestCase):
+    """Zip members are copied between archives without being re-compressed"""
+    def setUp(self):
+        handle, self.source_name = tempfile.mkstemp(suffix=".wtbd")
+        os.close(handle)
+        handle, self.target_name = tempfile.mkstemp(suffix=".wtbd")
+        os.close(handle)
+
+        source = zipfile.ZipFile(self.source_name, "w", zipfile.ZIP_DEFLATED)
+        source.writestr("sheets/3.data", "shapes " * 100)
+        source.writestr("data/image.png", "pixels")
+        source.close()
+
+    def tearDown(self):
+        os.remove(self.source_name)
+        os.remove(self.target_name)
+
+
+    def test_copy_member(self):
+        """Copied members can be read back, under their new names"""
+        source = zipfile.ZipFile(self.source_name)           # given
+        target = zipfile.ZipFile(self.target_name, "w")
+        target.writestr("manifest.data", "manifest")
+
+        copy_member(source, "sheets/3.data", target, "sheets/0.data")  # when
+        copy_member(source, "data/image.png", target)
+        target.writestr("after", "written after the copies")
+        target.close()
+        source.close()
+
+        result = zipfile.ZipFile(self.target_name)            # then
+        self.assertEqual(None, result.testzip())
+        self.assertEqual(["manifest.data", "sheets/0.data", "data/image.png", "after"],
+                         result.namelist())
+        self.assertEqual("shapes " * 100, result.read("sheets/0.data"))
+        self.assertEqual("pixels", result.read("data/image.png"))
+        self.assertEqual(zipfile.ZIP_DEFLATED, result.getinfo("sheets/0.data").compress_type)
+        result.close()
+
+
+    def test_write_member(self):
+        """Members are deflated at any level, or stored if that's no smaller"""
+        target = zipfile.ZipFile(self.target_name, "w")
+        for level in range(10):
+            write_member(target, "sheets/%i.data" % level, "shapes " * 100, level)
+        write_member(target, "data/image.png", os.urandom(100), 9)
+        target.close()
+
+        result = zipfile.ZipFile(self.target_name)
+        self.assertEqual(None, result.testzip())
+        for level in range(10):
+            self.assertEqual("shapes " * 100, result.read("sheets/%i.data" % level))
+        self.assertEqual(zipfile.ZIP_STORED, result.getinfo("sheets/0.data").compress_type)
+        self.assertEqual(zipfile.ZIP_DEFLATED, result.getinfo("sheets/9.data").compress_type)
+        self.assertEqual(zipfile.ZIP_STORED, result.getinfo("data/image.png").compress_type)
+        result.close()
+
+
+class TestCompression(unittest.TestCase):
+    """Only sheets and the manifest are deflated"""
+    def test_member_level(self):
+        compression = Compression(level=9, fast=False)
+        self.assertEqual(9, compression.member_level(MANIFEST))
+        self.assertEqual(9, compression.member_level(u"sheets/0.data"))
+        self.assertEqual(0, compression.member_level(u"data/image.png"))
+        self.assertEqual(0, compression.member_level(u"thumbnails/0.png"))
+        self.assertEqual(0, compression.member_level(u"history/0.undo"))
+
+    def test_fast(self):
+        """Fast saves compress inside sheet chunks instead"""
+        compression = Compression(level=9, fast=True)
+        self.assertEqual(0, compression.member_level(u"sheets/0.data"))
+        self.assertEqual(9, compression.member_level(MANIFEST))
+        self.assertEqual(0, Compression(level=9, fast=False).chunk_level)
+        self.assertNotEqual(0, compression.chunk_level)
+
+
+class TestReadManifest(unittest.TestCase):
+    """A save's manifest and thumbnails are read without its sheets"""
+    def setUp(self):
+        handle, self.filename = tempfile.mkstemp(suffix=".wtbd")
+        os.close(handle)
+        self.manifest = {'version': u"0.42", 'sheets': [
+            {'name': u"Sheet 1", 'size': [800, 600], 'shapes': 3,
+             'images': [u"a.png"], 'thumbnail': u"thumbnails/0.png"}]}
+
+        _zip = zipfile.ZipFile(self.filename, "w")
+        _zip.writestr(MANIFEST, json.dumps(self.manifest))
+        _zip.writestr("thumbnails/0.png", "thumbnail")
+        _zip.close()
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+
+    def test_read_manifest(self):
+        self.assertEqual(self.manifest, read_manifest(self.filename))
+
+    def test_read_thumbnail(self):
+        self.assertEqual("thumbnail", read_thumbnail(self.filename, 0))
+        self.assertEqual(None, read_thumbnail(self.filename, 1))
+
+    def test_older_files(self):
+        """Files saved as a single pickle have no manifest"""
+        f = open(self.filename, "wb")
+        f.write("(dp0\n.")
+        f.close()
+        self.assertEqual(None, read_manifest(self.filename))
+
+
+class FakeCanvas(object):
+    """Just enough of a Canvas to load a sheet into"""
+    def __init__(self):
+        self.overlay = None
+        self.shapes = []
+        self.medias = []
+        self.groups = None
+        self.chunk = None
+        self.dirty = True
+
+    def resize(self, size):
+        self.area = size
+
+    def add_shape(self, shape, undoable=False):
+        if shape.x < 0:
+            raise ValueError("can't load this shape")
+        self.shapes.append(shape)
+
+    def restore_groups(self, groups, saved=None):
+        self.groups = groups
+
+    def defer_redraw(self):
+        pass
+
+
+class FakeGUI(object):
+    def __init__(self):
+        self.canvas = None
+        self.canvases = []
+        self.current_tab = 0
+        self.title = u"Whyteboard"
+        self.autosave = Mock()
+        self.dialog = Mock()
+        self.control = Mock()
+        self.journal = Mock()
+        self.thumbs = Mock()
+        self.tabs = Mock()
+
+    def on_new_tab(self, name=None):
+        self.canvas = FakeCanvas()
+        self.canvases.append(self.canvas)
+
+    def get_canvases(self):
+        return self.canvases
+
+    def get_tab_names(self):
+        return [u"Sheet %i" % (x + 1) for x in range(len(self.canvases))]
+
+    def remove_all_sheets(self):
+        self.canvases = []
+
+    def show_progress_dialog(self, title):
+        pass
+
+    def SetTitle(self, title):
+        pass
+
+
+class TestLoadSheets(unittest.TestCase):
+    """A chunked save's sheets are loaded when viewed, or in the background"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, u"save.wtbd")
+        Config().init(os.path.join(self.dir, u"user.pref"))
+        self.util = Utility(FakeGUI(), os.path.join(self.dir, u"pdfcache.db"))
+        self.util.finish_loading = Mock()
+
+        canvas = FakeCanvas()
+        self.sheets = []
+        for x in range(3):
+            shapes = [tools.Rectangle(canvas, (0, 0, 0), 1) for y in range(3)]
+            self.sheets.append(shapes)
+        self.sheets[1][1].x = -1  # fails to load
+
+        manifest = {'version': u"0.42", 'colour': [0, 0, 0], 'thickness': 1,
+                    'tool': 1, 'tab': 0, 'font': None, 'sheets': []}
+        _zip = zipfile.ZipFile(self.filename, "w")
+        for x, shapes in enumerate(self.sheets):
+            manifest['sheets'].append({'name': u"Sheet %i" % (x + 1),
+                                       'size': [800, 600], 'shapes': len(shapes),
+                                       'images': []})
+            _zip.writestr("sheets/%i.data" % x, records.dumps(
+                {'shapes': shapes, 'medias': [], 'groups': [[0, 2]]}))
+        _zip.writestr(MANIFEST, json.dumps(manifest))
+        _zip.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def load(self):
+        self.util.zip = zipfile.ZipFile(self.filename)
+        self.util.load_manifest(self.filename)
+        return self.util.gui.get_canvases()
+
+
+    def test_load_manifest(self):
+        """Every sheet is created, but none of their shapes are loaded yet"""
+        canvases = self.load()
+        self.assertEqual(3, len(canvases))
+        self.assertEqual(dict((canvas, x) for x, canvas in enumerate(canvases)),
+                         self.util.pending)
+        self.assertEqual([[], [], []], [canvas.shapes for canvas in canvases])
+        self.assertEqual({0: 3, 1: 3, 2: 3}, self.util.sheet_shapes)
+        self.assertEqual((800, 600), canvases[2].area)
+        self.assertEqual(self.filename, self.util.source)
+
+    def test_load_sheet(self):
+        canvases = self.load()
+        self.util.load_sheet(canvases[0])
+        self.assertEqual([shape.uid for shape in self.sheets[0]],
+                         [shape.uid for shape in canvases[0].shapes])
+        self.assertEqual([[0, 2]], canvases[0].groups)
+        self.assertFalse(canvases[0].dirty)
+        self.assertFalse(canvases[0] in self.util.pending)
+        self.assertEqual(None, self.util.zip.testzip())  # still open
+
+    def test_load_sheet_skips_bad_shapes(self):
+        """A shape that can't be loaded doesn't lose the shapes after it"""
+        canvases = self.load()
+        self.util.load_sheet(canvases[1])
+        self.assertEqual([self.sheets[1][0].uid, self.sheets[1][2].uid],
+                         [shape.uid for shape in canvases[1].shapes])
+
+    def test_load_next_sheet(self):
+        """Sheets are loaded in order, and the file's closed after the last"""
+        canvases = self.load()
+        self.util.load_sheet(canvases[1])
+        self.util.load_next_sheet()
+        self.assertEqual([canvases[2]], self.util.pending.keys())
+        self.assertEqual(3, len(canvases[0].shapes))
+
+        self.util.load_next_sheet()
+        self.assertEqual({}, self.util.pending)
+        self.assertEqual(None, self.util.zip.fp)
+
+    def test_discard_pending(self):
+        """Sheets yet to be loaded are forgotten, and the file closed"""
+        canvases = self.load()
+        self.util.load_sheet(canvases[0])
+        self.util.discard_pending()
+        self.assertEqual({}, self.util.pending)
+        self.assertEqual(None, self.util.zip.fp)
+        self.util.discard_pending()
+
+    def test_save_pending(self):
+        """Sheets that haven't been loaded are saved as they were"""
+        self.load()
+        self.util.is_zipped = True
+        self.util.save_file()
+
+        self.util = Utility(FakeGUI(), os.path.join(self.dir, u"pdfcache.db"))
+        self.util.finish_loading = Mock()
+        canvases = self.load()
+        self.util.load_all_sheets()
+        self.assertEqual([3, 2, 3], [len(canvas.shapes) for canvas in canvases])
+
+    def test_save_not_replaced(self):
+        """A file that can't be replaced is left as it was, and keeps loading"""
+        canvases = self.load()
+        before = open(self.filename, "rb").read()
+
+        def refuse(source, target):
+            raise OSError(errno.EACCES, "in use")
+        replace_file, utility.replace_file = utility.replace_file, refuse
+        try:
+            self.util.is_zipped = True
+            self.util.save_file()
+        finally:
+            utility.replace_file = replace_file
+
+        self.assertFalse(self.util.saved)
+        self.assertEqual(before, open(self.filename, "rb").read())
+        self.assertFalse(os.path.exists(self.filename + u".tmp"))
+        self.util.load_all_sheets()
+        self.assertEqual([3, 2, 3], [len(canvas.shapes) for canvas in canvases])
+
+    def test_save_not_written(self):
+        """Failing to write the images leaves no temporary file behind"""
+        self.load()
+        before = open(self.filename, "rb").read()
+
+        def fail(_zip, source=None):
+            raise IOError(errno.ENOSPC, "disk full")
+        self.util.save_bitmap_data = fail
+        filename = self.filename
+        self.util.is_zipped = True
+        self.util.save_file()
+
+        self.assertFalse(self.util.saved)
+        self.assertEqual(before, open(filename, "rb").read())
+        self.assertFalse(os.path.exists(filename + u".tmp"))
+
+
+class FakeBitmap(object):
+    """A bitmap, and the image it converts to"""
+    def __init__(self, pixels):
+        self.pixels = pixels
+
+    def ConvertToImage(self):
+        return self
+
+    def HasMask(self):
+        return False
+
+    def HasAlpha(self):
+        return False
+
+    def GetWidth(self):
+        return len(self.pixels) / 3
+
+    def GetHeight(self):
+        return 1
+
+    def GetData(self):
+        return self.pixels
+
+
+class FakeImage(tools.Image):
+    def __init__(self, pixels):
+        self.image = FakeBitmap(pixels)
+        self.filename = None
+
+    def get_digest(self):
+        return self.image.pixels
+
+
+class TestEncodeImages(unittest.TestCase):
+    """Images are encoded once a session, and told apart by their pixels"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        Config().init(os.path.join(self.dir, u"user.pref"))
+        self.util = Utility(FakeGUI(), os.path.join(self.dir, u"pdfcache.db"))
+        self.util.gui.on_new_tab()
+        self.shapes = [FakeImage("\xff\x00\x00"), FakeImage("\x00\xff\x00"),
+                       FakeImage("\xff\x00\x00")]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+
+    def test_encode_images(self):
+        encoded = dict(self.util.encode_images(self.shapes))
+        self.assertEqual(2, len(encoded))
+        name, data = encoded["\xff\x00\x00"]
+        self.assertTrue(name.endswith(u".png"))
+        self.assertEqual((1, 1), png.image_size(data))
+        self.assertEqual((name, data), self.util.image_files.get("\xff\x00\x00"))
+
+        again = dict(self.util.encode_images(self.shapes[:1]))
+        self.assertTrue(again["\xff\x00\x00"][1] is data)  # not re-encoded
+
+    def test_encode_evicted_images(self):
+        """Images that have been let go of are encoded again"""
+        self.util.image_files.memory = 0
+        encoded = dict(self.util.encode_images(self.shapes))
+        self.assertEqual(2, len(encoded))
+        self.assertFalse(all(digest in self.util.image_files for digest in encoded))
+        again = dict(self.util.encode_images(self.shapes))
+        self.assertEqual(2, len(again))
+
+    def test_keep_image_file(self):
+        """An imported image's file is saved as it is"""
+        path = os.path.join(self.dir, u"photo.JPG")
+        f = open(path, "wb")
+        f.write("jpeg")
+        f.close()
+        self.util.keep_image_file(self.shapes[0], path)
+        self.util.keep_image_file(self.shapes[1], os.path.join(self.dir, u"missing.png"))
+
+        encoded = dict(self.util.encode_images(self.shapes))
+        name, data = encoded["\xff\x00\x00"]
+        self.assertTrue(name.endswith(u".jpg"))
+        self.assertEqual("jpeg", data)
+        self.assertTrue(encoded["\x00\xff\x00"][0].endswith(u".png"))
+
+    def test_save_bitmap_data(self):
+        """Copies of an image are written once, and share its name"""
+        self.util.gui.canvas.shapes = self.shapes
+        filename = os.path.join(self.dir, u"save.wtbd")
+        _zip = zipfile.ZipFile(filename, "w")
+        self.util.save_bitmap_data(_zip)
+        _zip.close()
+
+        _zip = zipfile.ZipFile(filename)
+        self.assertEqual(2, len(_zip.namelist()))
+        self.assertEqual(self.shapes[0].filename, self.shapes[2].filename)
+        self.assertEqual(set(u"data/" + shape.filename for shape in self.shapes),
+                         set(_zip.namelist()))
+        _zip.close()
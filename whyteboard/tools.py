@@ -28,10 +28,11 @@ with by the user (e.g. they can't draw an image directly)
 from __future__ import division
 
 import os
+import hashlib
+import random
 import logging
 import time
 import math
-import cStringIO
 import ntpath
 import wx
 
@@ -60,10 +61,23 @@ EDGE_RIGHT  = 10
 EDGE_BOTTOM = 11
 EDGE_LEFT   = 12
 
+# attributes that belong to the live shape, not to its undo-able state
+STATE_IGNORE = ('canvas', 'selected', 'tree_id', 'mc')
+
+HIGH_RES_DISTORTION = 0.02  # how far a page's print render may differ in shape
+
 def set_handle_size(handle_size):
     global HANDLE_SIZE
     HANDLE_SIZE = handle_size
 
+def new_uid():
+    """
+    A shape ID, used to refer to a shape in a group or in the undo history.
+    Random rather than sequential, so that IDs loaded from a save file don't
+    clash with those of newly drawn shapes
+    """
+    return random.getrandbits(62)
+
 pub.subscribe(set_handle_size, 'tools.set_handle_size')
 
 #----------------------------------------------------------------------
@@ -77,6 +91,14 @@ class Tool(object):
     icon = u""
     hotkey = u""
 
+    # The record schema, for saving (see misc/records.py): (attribute, kind) of
+    # each saved attribute - new ones must be appended - and the values of the
+    # others once loaded. Subclasses extend their parent's.
+    fields = (("uid", "int"), ("x", "num"), ("y", "num"), ("colour", "colour"),
+              ("background", "colour"), ("thickness", "num"), ("join", "int"))
+    transient = {'canvas': None, 'brush': None, 'cursor': wx.CURSOR_PENCIL,
+                 'selected': False, 'drawing': False, 'edges': {}}
+
     def __init__(self, canvas, colour, thickness, background=wx.TRANSPARENT,
                  cursor=wx.CURSOR_PENCIL, join=wx.JOIN_ROUND):
         self.canvas = canvas
@@ -91,6 +113,7 @@ class Tool(object):
         self.edges = {}
         self.x = 0
         self.y = 0
+        self.uid = new_uid()
         self.make_pen()
 
     def left_down(self, x, y):
@@ -134,6 +157,23 @@ class Tool(object):
         """
         pass
 
+    def get_bounds(self):
+        """The (x1, y1, x2, y2) bounding box, for rubber-band selection"""
+        return None
+
+    def get_state(self):
+        """
+        The shape's attributes, for undoing changes made to it. A shallow copy:
+        anything changing a shape's list (e.g. points) must replace the list
+        """
+        state = dict(self.__dict__)
+        for key in STATE_IGNORE:
+            state.pop(key, None)
+        return state
+
+    def set_state(self, state):
+        self.__dict__.update(state)
+
     def make_pen(self, dc=None):
         """ Creates a pen, usually after loading in a save file """
         if self.background == wx.TRANSPARENT:
@@ -162,6 +202,8 @@ class Tool(object):
             self.drawing = False
         if not hasattr(self, "join"):
             self.join = wx.JOIN_ROUND
+        if not hasattr(self, "uid"):
+            self.uid = new_uid()
 
 #----------------------------------------------------------------------
 
@@ -170,6 +212,8 @@ class OverlayShape(Tool):
     Contains methods for drawing an overlayed shape. Has some general method
     implementations for drawing handles and drawing the shape.
     """
+    transient = dict(Tool.transient, cursor=wx.CURSOR_CROSS, handles=[])
+
     def __init__(self, canvas, colour, thickness, background=wx.TRANSPARENT,
                  cursor=wx.CURSOR_CROSS, join=wx.JOIN_ROUND):
         Tool.__init__(self, canvas, colour, thickness, background, cursor, join)
@@ -222,6 +266,13 @@ class OverlayShape(Tool):
         """Finds the x/y/width/height edges of a shape"""
         pass
 
+    def get_bounds(self):
+        self.find_edges()
+        if not self.edges:
+            return None
+        return (self.edges[EDGE_LEFT], self.edges[EDGE_TOP],
+                self.edges[EDGE_RIGHT], self.edges[EDGE_BOTTOM])
+
     def resize(self, x, y, handle=None):
         """When the shape is being resized with Select tool"""
         self.motion(x, y)
@@ -299,6 +350,9 @@ class Polygon(OverlayShape):
     name = _("Polygon")
     icon = u"polygon"
     hotkey = u"y"
+    fields = OverlayShape.fields + (("points", "points"),)
+    transient = dict(OverlayShape.transient, center=None, scale_factor=0,
+                     operation=None, original_points=[], orig_click=None)
 
     def __init__(self, canvas, colour, thickness, background=wx.TRANSPARENT,
                  cursor=wx.CURSOR_CROSS, join=wx.JOIN_ROUND):
@@ -528,6 +582,8 @@ class Pen(Polygon):
     name = _("Pen")
     icon = u"pen"
     hotkey = u"p"
+    fields = OverlayShape.fields + (("stroke", "stroke"),)
+    transient = dict(Polygon.transient, cursor=wx.CURSOR_PENCIL, x_tmp=0, y_tmp=0)
 
     def __init__(self, canvas, colour, thickness, background=wx.TRANSPARENT,
                  cursor=wx.CURSOR_PENCIL, join=wx.JOIN_ROUND):
@@ -539,6 +595,15 @@ class Pen(Polygon):
         self.y_tmp = 0
 
 
+    def get_stroke(self):
+        return (self.points, self.time)
+
+    def set_stroke(self, stroke):
+        self.points, self.time = stroke
+
+    stroke = property(get_stroke, set_stroke)  # saved as one, see misc/strokes.py
+
+
     def left_down(self, x, y):
         self.x = x  # original mouse coords
         self.y = y
@@ -577,6 +642,35 @@ class Pen(Polygon):
     def hit_test(self, x, y):
         pass
 
+    def find_edges(self):
+        """Bounding rectangle of every line segment's start and end"""
+        if not self.points:
+            self.edges = {}
+            return
+        xs = [p[0] for p in self.points] + [p[2] for p in self.points]
+        ys = [p[1] for p in self.points] + [p[3] for p in self.points]
+        self.edges = {EDGE_TOP: min(ys), EDGE_RIGHT: max(xs),
+                      EDGE_BOTTOM: max(ys), EDGE_LEFT: min(xs)}
+
+    def get_handles(self):
+        """Handles at the stroke's corners, not at every point"""
+        self.find_edges()
+        if not self.edges:
+            return []
+        d = lambda x, y: (x - 2, y - 2)
+        return [d(self.edges[EDGE_LEFT], self.edges[EDGE_TOP]),
+                d(self.edges[EDGE_RIGHT], self.edges[EDGE_TOP]),
+                d(self.edges[EDGE_LEFT], self.edges[EDGE_BOTTOM]),
+                d(self.edges[EDGE_RIGHT], self.edges[EDGE_BOTTOM])]
+
+    def move(self, x, y, offset):
+        """Shifts every line segment by how far the pen's origin has moved"""
+        dx = x - offset[0] - self.x
+        dy = y - offset[1] - self.y
+        self.x += dx
+        self.y += dy
+        self.points = [[a + dx, b + dy, c + dx, d + dy] for a, b, c, d in self.points]
+
     def draw(self, dc, replay=True, _type=u"LineList"):
         super(Pen, self).draw(dc, replay, _type)
 
@@ -605,6 +699,8 @@ class Highlighter(Pen):
     name = _("Highlighter")
     icon = u"highlighter"
     hotkey = u"h"
+    transient = dict(Pen.transient, current=(0, 0))
+
     def __init__(self, canvas, colour, thickness, background=wx.TRANSPARENT,
                  cursor=wx.CURSOR_PENCIL, join=wx.JOIN_ROUND):
         Pen.__init__(self, canvas, colour, thickness + 6)
@@ -670,6 +766,8 @@ class Rectangle(OverlayShape):
     name = _("Rectangle")
     icon = u"rectangle"
     hotkey = u"r"
+    fields = OverlayShape.fields + (("width", "num"), ("height", "num"))
+    transient = dict(OverlayShape.transient, rect=None)
 
     def __init__(self, canvas, colour, thickness, background=wx.TRANSPARENT):
         OverlayShape.__init__(self, canvas, colour, thickness, background,
@@ -853,6 +951,7 @@ class Circle(OverlayShape):
     name = _("Circle")
     icon = u"circle"
     hotkey = u"c"
+    fields = OverlayShape.fields + (("radius", "num"),)
 
     def __init__(self, canvas, colour, thickness, background=wx.TRANSPARENT):
         OverlayShape.__init__(self, canvas, colour, thickness, background)
@@ -924,6 +1023,7 @@ class Line(OverlayShape):
     name = _("Line")
     icon = u"line"
     hotkey = u"l"
+    fields = OverlayShape.fields + (("x2", "num"), ("y2", "num"))
 
     def __init__(self, canvas, colour, thickness, background=wx.TRANSPARENT):
         OverlayShape.__init__(self, canvas, colour, thickness, background)
@@ -1057,6 +1157,8 @@ class Media(Tool):
     name = _("Media")
     hotkey = u"m"
     icon = u"media"
+    fields = Tool.fields + (("filename", "text"),)
+    transient = dict(Tool.transient, cursor=wx.CURSOR_ARROW, mc=None)
 
     def __init__(self, canvas, colour, thickness, background=wx.TRANSPARENT,
                  cursor=wx.CURSOR_ARROW):
@@ -1069,7 +1171,7 @@ class Media(Tool):
         self.y = y
         self.canvas.medias.append(self)
         self.make_panel()
-        pub.sendMessage('gui.mark_unsaved')
+        self.canvas.mark_unsaved()
         pub.sendMessage('canvas.change_tool')
 
     def make_panel(self):
@@ -1107,6 +1209,7 @@ class Eraser(Pen):
     name = _("Eraser")
     icon = u"eraser"
     hotkey = u"e"
+    transient = dict(Pen.transient, cursor=None)  # re-made when it's the tool
 
     def __init__(self, canvas, colour, thickness, background=wx.TRANSPARENT):
         cursor = self.make_cursor(thickness)
@@ -1188,6 +1291,9 @@ class Text(OverlayShape):
     name = _("Text")
     icon = u"text"
     hotkey = u"t"
+    fields = OverlayShape.fields + (("text", "text"), ("font_data", "text"),
+                                    ("extent", "pair"))
+    transient = dict(OverlayShape.transient, cursor=wx.CURSOR_IBEAM, font=None)
 
     def __init__(self, canvas, colour, thickness, background=wx.TRANSPARENT):
         OverlayShape.__init__(self, canvas, colour, thickness, background,
@@ -1240,7 +1346,7 @@ class Text(OverlayShape):
         font = self.font
         font_data = self.font_data
         colour = self.colour
-        self.canvas.add_undo()
+        self.canvas.add_shape_undo([self])
 
         if not self.canvas.show_text_edit_dialog(self):
             self.text = text  # restore attributes
@@ -1341,6 +1447,7 @@ class Note(Text):
     name = _("Note")
     icon = u"note"
     hotkey = u"n"
+    transient = dict(Text.transient, tree_id=None)
 
     def __init__(self, canvas, colour, thickness, background=wx.TRANSPARENT):
         Text.__init__(self, canvas, colour, thickness, background)
@@ -1409,60 +1516,85 @@ class Note(Text):
 
 class Image(OverlayShape):
     """
-    When being pickled, the image reference will be removed.
+    When being pickled, the image reference will be removed. Images loaded from
+    a save file are kept encoded in the Utility's ImageStore, and only decoded
+    when the image is first needed (usually, drawn).
+    A converted PDF/PS page knows its file and page number, and may have a
+    higher resolution render of itself to print with.
     """
     name = _("Image")
+    fields = OverlayShape.fields + (("path", "text"), ("filename", "text"),
+                                    ("digest", "text"), ("size", "pair"),
+                                    ("scale_size", "pair"), ("angle", "num"))
+    transient = dict(OverlayShape.transient, bitmap=None, resizing=False,
+                     img=None, center=None, outline=None, dragging=False,
+                     orig_click=None, rotate_handle=None, page=None,
+                     high_res=None)
+
     def __init__(self, canvas, image, path):
         OverlayShape.__init__(self, canvas, wx.BLACK, 1)
+        self.bitmap = None  # wx.Bitmap, unless the image is in the store
+        self.size = None
         self.image = image  # of type wx.Bitmap
         self.path = path  # not really needed anymore
-        self.filename = None  # used to restore image on load
-        if path:
-            self.filename = os.path.basename(path)
+        self.filename = None  # name in the save file, to restore image on load
+        self.digest = None  # see get_digest()
         self.resizing = False
-        self.img = wx.ImageFromBitmap(image)  # original wx.Image to rotate/scale
+        self.img = None  # original wx.Image to rotate/scale, once transformed
         self.angle = 0
-        self.scale_size = (image.GetWidth(), image.GetHeight())
+        self.scale_size = self.size
         self.center = None
         self.outline = None  # Rectangle/Polygon, used to rotate/resize
         self.dragging = False  # controls whether to draw the outline
         self.orig_click = None
         self.rotate_handle = None  # wx.Rect
+        self.page = None  # (file, page number), if it's a converted page
+        self.high_res = None  # path to a bigger render of the page
 
 
 
+    def get_image(self):
+        if self.bitmap is None and self.filename:
+            return self.canvas.gui.util.images.get(self.filename)
+        return self.bitmap
+
+    def set_image(self, bitmap):
+        self.bitmap = bitmap
+        if bitmap:
+            self.size = (bitmap.GetWidth(), bitmap.GetHeight())
+
+    image = property(get_image, set_image)
+
+
     def left_down(self, x, y):
+        self.place(x, y)
+        dc = wx.BufferedDC(None, self.canvas.buffer)
+        self.draw(dc)
+        self.canvas.redraw_dirty(dc)
+
+
+    def place(self, x, y):
+        """Adds the image to the canvas, without drawing it"""
         self.x = x
         self.y = y
         pub.sendMessage('shape.add', shape=self)
-        self.canvas.resize_if_large_image((self.image.GetWidth(), self.image.GetHeight()))
+        self.canvas.resize_if_large_image(self.size)
         self.sort_handles()
 
-        dc = wx.BufferedDC(None, self.canvas.buffer)
-        self.draw(dc)
-        self.canvas.redraw_dirty(dc)
-
 
     def sort_handles(self):
-        """Sets the internal image that will be used to rotate, and its mask"""
         super(Image, self).sort_handles()
-        if not self.img:
-            self.img = wx.ImageFromBitmap(self.image)
-        if not self.img.HasAlpha():  # black background otherwise
-            self.img.InitAlpha()
-
         self.find_center()
-        self.rotate_handle = wx.Rect(self.x + self.image.GetWidth() / 2 - 6,
-                                     self.y + self.image.GetHeight() / 2 - 6, 15, 15)
+        self.rotate_handle = wx.Rect(self.x + self.size[0] / 2 - 6,
+                                     self.y + self.size[1] / 2 - 6, 15, 15)
 
 
     def find_center(self):
-        self.center = (self.x + self.image.GetWidth() / 2,
-                       self.y + self.image.GetHeight() / 2)
+        self.center = (self.x + self.size[0] / 2, self.y + self.size[1] / 2)
 
     def find_edges(self):
-        self.edges = {EDGE_TOP: self.y, EDGE_RIGHT: self.x + self.image.GetWidth(),
-                      EDGE_BOTTOM: self.y + self.image.GetWidth(), EDGE_LEFT: self.x}
+        self.edges = {EDGE_TOP: self.y, EDGE_RIGHT: self.x + self.size[0],
+                      EDGE_BOTTOM: self.y + self.size[1], EDGE_LEFT: self.x}
 
     def handle_hit_test(self, x, y):
         """Returns which handle has been clicked on"""
@@ -1476,8 +1608,7 @@ class Image(OverlayShape):
     def draw_selected(self, dc):
         super(Image, self).draw_selected(dc)
         dc.SetBrush(wx.Brush((0, 255, 0)))
-        dc.DrawCircle(self.x + self.image.GetWidth() / 2,
-                      self.y + self.image.GetHeight() / 2, 6)
+        dc.DrawCircle(self.x + self.size[0] / 2, self.y + self.size[1] / 2, 6)
 
 
     def resize(self, x, y, handle=None):
@@ -1521,15 +1652,14 @@ class Image(OverlayShape):
             self.outline.x = self.x
             self.outline.y = self.y
             self.outline.points.append((self.x, self.y))
-            self.outline.points.append((self.x + self.image.GetWidth(), self.y))
-            self.outline.points.append((self.x + self.image.GetWidth(), self.y + + self.image.GetHeight()))
-            self.outline.points.append((self.x, self.y + self.image.GetHeight()))
+            self.outline.points.append((self.x + self.size[0], self.y))
+            self.outline.points.append((self.x + self.size[0], self.y + self.size[1]))
+            self.outline.points.append((self.x, self.y + self.size[1]))
         elif handle in [TOP_LEFT, TOP_RIGHT, BOTTOM_LEFT, BOTTOM_RIGHT]:
             self.outline = Rectangle(self.canvas, wx.BLACK, 2)
             self.outline.x = self.x
             self.outline.y = self.y
-            self.outline.width = self.image.GetWidth()
-            self.outline.height = self.image.GetHeight()
+            self.outline.width, self.outline.height = self.size
 
         if not handle:
             self.canvas.overlay = overlay  # so restore it
@@ -1540,6 +1670,10 @@ class Image(OverlayShape):
     def end_select_action(self, handle):
         """Performs the rescale/rotation, resets attributes"""
         if self.outline and self.dragging:
+            if not self.img:
+                self.img = wx.ImageFromBitmap(self.image)
+                if not self.img.HasAlpha():  # black background otherwise
+                    self.img.InitAlpha()
             img = wx.BitmapFromImage(self.img)
             img = wx.ImageFromBitmap(img)
             img.Rescale(self.scale_size[0], self.scale_size[1], wx.IMAGE_QUALITY_HIGH)
@@ -1548,12 +1682,16 @@ class Image(OverlayShape):
 
             img = img.Rotate(-self.angle, self.center)
             self.image = wx.BitmapFromImage(img)
+            self.filename = None  # the saved file's image no longer matches
+            self.digest = None
+            self.page = self.high_res = None
+
+            self.canvas.redraw_all()
 
         self.dragging = False
         self.orig_click = None
         self.outline = None
         self.sort_handles()
-        self.canvas.redraw_all()
 
 
     def draw(self, dc, replay=False):
@@ -1562,21 +1700,57 @@ class Image(OverlayShape):
             self.outline.draw(dc, replay)
 
 
+    def draw_high_res(self, dc):
+        """
+        Draws the high resolution render, scaled down to the image's size;
+        False if there isn't one (e.g. it's been evicted from the PDF cache),
+        or if its proportions aren't the image's - e.g. it's been rotated
+        """
+        if not self.high_res or not os.path.exists(self.high_res):
+            return False
+        bitmap = wx.Bitmap(self.high_res, wx.BITMAP_TYPE_PNG)
+        if not bitmap.Ok():
+            return False
+        x_factor = float(self.size[0]) / bitmap.GetWidth()
+        y_factor = float(self.size[1]) / bitmap.GetHeight()
+        if abs(x_factor / y_factor - 1) > HIGH_RES_DISTORTION:
+            logger.debug("[%s] isn't in proportion to its page", self.high_res)
+            return False
+        x_scale, y_scale = dc.GetUserScale()
+        dc.SetUserScale(x_scale * x_factor, y_scale * y_factor)
+        dc.DrawBitmap(bitmap, self.x / x_factor, self.y / y_factor)
+        dc.SetUserScale(x_scale, y_scale)
+        return True
+
+
     def get_args(self):
         return [self.image, self.x, self.y]
 
 
+    def get_digest(self):
+        """A hash of the image's pixels, to spot copies of it; cached"""
+        if not self.digest:
+            img = self.image.ConvertToImage()
+            sha = hashlib.sha1("%i %i " % (img.GetWidth(), img.GetHeight()))
+            sha.update(img.GetData())
+            if img.HasAlpha():
+                sha.update(img.GetAlphaData())
+            self.digest = sha.hexdigest()
+        return self.digest
+
+
     def properties(self):
         a, b = "", ""
-        if self.filename:
-            a, b = _("Filename:"), self.filename
+        name = os.path.basename(self.path) if self.path else self.filename
+        if name:
+            a, b = _("Filename:"), name
         return u"X: %i, Y: %i %s %i %s %i %s %s" % (self.x, self.y, _("Width:"),
-                                            self.image.GetWidth(), _("Height:"),
-                                            self.image.GetHeight(), a, b)
+                                            self.size[0], _("Height:"),
+                                            self.size[1], a, b)
 
     def get_handles(self):
         d = lambda x, y: (x - 2, y - 2)
-        x, y, w, h = self.x, self.y, self.image.GetWidth(), self.image.GetHeight()
+        x, y, (w, h) = self.x, self.y, self.size
 
         return d(x, y), d(x + w, y), d(x, y + h), d(x + w, y + h)
 
@@ -1595,6 +1769,12 @@ class Image(OverlayShape):
             self.dragging = False
         if not hasattr(self, "scale_size"):
             self.scale_size = (0, 0)
+        if not hasattr(self, "digest"):
+            self.digest = None
+        if not hasattr(self, "bitmap"):
+            self.__dict__.pop("image", None)  # saved before it was a property
+            self.bitmap = None
+            self.size = None
 
         if not hasattr(self, "filename") or not self.filename:
             self.filename = os.path.basename(self.path)
@@ -1608,27 +1788,26 @@ class Image(OverlayShape):
                 self.image = wx.EmptyBitmap(1, 1)
                 wx.MessageBox(_("Path for the image %s not found.") % self.path,
                               u"Whyteboard")
-        else:
+        elif not self.filename in self.canvas.gui.util.images:
             try:
                 data = self.canvas.gui.util.zip.read("data/" + self.filename)
-                stream = cStringIO.StringIO(data)
-                self.image = wx.BitmapFromImage(wx.ImageFromStream(stream))
-
+                self.canvas.gui.util.images.add(self.filename, data)
             except KeyError:
                 self.image = wx.EmptyBitmap(1, 1)
                 wx.MessageBox(_("File %s not found in the save") % self.filename,
                               u"Whyteboard")
 
-        self.img = wx.ImageFromBitmap(self.image)
+        if not self.size:  # older saves didn't keep it; decode the image now
+            self.size = tuple(self.image.GetSize())
+        self.img = None
         self.colour = wx.BLACK
         self.sort_handles()
 
 
     def hit_test(self, x, y):
-        if not self.image:
+        if not self.size:
             return False
-        width, height = self.image.GetSize()
-        rect = wx.Rect(self.x, self.y, width, height)
+        rect = wx.Rect(self.x, self.y, self.size[0], self.size[1])
         if rect.ContainsXY(x, y):
             return True
         return False
@@ -1640,6 +1819,9 @@ class Select(Tool):
     """
     Select an item to move it around/resize/change colour/thickness/edit text
     Only create an undo point when an item is selected and been moved/resized
+    Shift-clicking adds/removes shapes to the selection; dragging on an empty
+    area draws a rubber-band rectangle that selects every shape inside it.
+    The whole selection is moved together.
     """
     tooltip = _("Select a shape to move and resize it")
     name = _("Shape Select ")
@@ -1654,16 +1836,22 @@ class Select(Tool):
         self.anchored = False  # Anchor shape's x point -once-, when resizing
         self.handle = None  # handle that was clicked on (if any)
         self.offset = (0, 0)
+        self.offsets = {}  # shape: offset, for each shape being moved
+        self.marquee = None  # (x1, y1, x2, y2) of the rubber-band rectangle
 
 
     def left_down(self, x, y):
         """
-        First, check the selected shape (which will be drawn on top of the
-        others) so that's selected first.
+        First, check the selected shapes (which will be drawn on top of the
+        others) so they're selected first.
         """
         self.canvas.redraw_all()
-        if self.canvas.selected:
-            if self.check_for_hit(self.canvas.selected, x, y):
+        if wx.GetKeyState(wx.WXK_SHIFT):
+            self.toggle_shape(x, y)
+            return
+
+        for shape in self.canvas.selected_shapes():
+            if self.check_for_hit(shape, x, y):
                 return
 
         for shape in reversed(self.canvas.shapes):
@@ -1671,15 +1859,31 @@ class Select(Tool):
                 break  # breaking is vital to selecting the correct shape
         else:
             self.canvas.deselect_shape()
+            self.canvas.overlay = wx.Overlay()
+            self.marquee = (x, y, x, y)
+
+
+    def toggle_shape(self, x, y):
+        """Adds or removes the shape under the mouse to/from the selection"""
+        for shape in reversed(self.canvas.shapes):
+            if shape.hit_test(x, y):
+                if shape.selected:
+                    self.canvas.unselect_shape(shape)
+                else:
+                    pub.sendMessage('shape.selected', shape=shape, add=True)
+                break
 
 
     def check_for_hit(self, shape, x, y):
         """
         Sees if a shape is underneath the mouse coords, and allows the shape to
-        be re-dragged to place
+        be re-dragged to place. Handles can only be used when a single shape
+        is selected.
         """
         found = False
-        handle = shape.handle_hit_test(x, y)  # test handle before area
+        handle = None
+        if len(self.canvas.selection) < 2 or not shape.selected:
+            handle = shape.handle_hit_test(x, y)  # test handle before area
 
         if handle:
             self.handle = handle
@@ -1691,7 +1895,10 @@ class Select(Tool):
             self.shape = shape
             self.dragging = True
             self.offset = self.shape.offset(x, y)
-            pub.sendMessage('shape.selected', shape=shape)
+            if not shape.selected:
+                pub.sendMessage('shape.selected', shape=shape)
+            self.offsets = dict((s, s.offset(x, y)) for s in self.canvas.selection
+                                if not isinstance(s, Media))
         return found
 
 
@@ -1708,17 +1915,19 @@ class Select(Tool):
 
         if not found:
             return
+        if found.selected:  # menu actions apply to the whole selection
+            pub.sendMessage('shape.popup', shape=found)
+            return
 
-        selected = None
-        if self.canvas.selected:
-            selected = self.canvas.selected
-        self.canvas.selected = found
+        selected, selection = self.canvas.selected, self.canvas.selection
+        self.canvas.selected, self.canvas.selection = found, set([found])
         pub.sendMessage('shape.popup', shape=found)
 
-        if selected:
-            self.canvas.selected = selected
-        if not found.selected:
-            self.canvas.selected = None
+        if found.selected:  # chose "Select" from the menu
+            for shape in selection:
+                shape.selected = False
+        else:
+            self.canvas.selected, self.canvas.selection = selected, selection
 
 
     def double_click(self, x, y):
@@ -1727,14 +1936,25 @@ class Select(Tool):
             self.canvas.selected.edit()
 
 
+    def moving(self):
+        """The shapes affected by the current drag"""
+        if self.handle:
+            return [self.shape]
+        return self.offsets.keys()
+
+
     def motion(self, x, y):
-        if self.dragging:
+        if self.marquee:
+            self.marquee = self.marquee[:2] + (x, y)
+        elif self.dragging:
             if not self.undone:  # add a single undo point, not one per call
-                self.canvas.add_undo()
+                self.canvas.add_shape_undo(self.moving())
                 self.undone = True
-                self.shape.start_select_action(self.handle)
+                for shape in self.moving():
+                    shape.start_select_action(self.handle)
             if not self.handle:  # moving
-                self.shape.move(x, y, self.offset)
+                for shape, offset in self.offsets.items():
+                    shape.move(x, y, offset)
                 #self.shape.find_edges()
                 #direction = self.canvas.drag_direction(self.shape.edges[EDGE_LEFT], self.shape.edges[EDGE_TOP])
 
@@ -1750,13 +1970,31 @@ class Select(Tool):
 
 
     def draw(self, dc, replay=False):
-        if self.dragging:
-            self.shape.draw(dc, False)
+        if self.marquee:
+            overlay = wx.DCOverlay(self.canvas.overlay, dc)
+            overlay.Clear()
+            x1, y1, x2, y2 = self.marquee
+            dc.SetPen(wx.Pen(wx.BLACK, 1, wx.SHORT_DASH))
+            dc.SetBrush(wx.TRANSPARENT_BRUSH)
+            dc.DrawRectangle(min(x1, x2), min(y1, y2), abs(x2 - x1), abs(y2 - y1))
+            del overlay
+        elif self.dragging:
+            if self.handle:
+                self.shape.draw(dc, False)
+            else:
+                self.canvas.draw_selection(dc)
 
 
     def left_up(self, x, y):
-        if self.dragging:
-            self.shape.end_select_action(self.handle)
+        if self.marquee:
+            self.canvas.select_in_rect(self.marquee)
+            self.marquee = None
+        elif self.dragging:
+            for shape in self.moving():
+                shape.end_select_action(self.handle)
+            if self.undone:
+                self.canvas.index.invalidate()
+                self.canvas.redraw_all()  # one redraw, however many were moved
 
         pub.sendMessage('update_shape_viewer')
         pub.sendMessage('thumbs.update_current')